@@ -0,0 +1,71 @@
+"""Compares two result files of `benchmarks/scaling.py`.
+
+For every configuration present in both files, prints the ratio of new to
+old time and peak memory of each stage, and marks ratios above the
+threshold as regressions.
+
+Usage:
+    $ python benchmarks/compare.py old.json new.json [--threshold 1.2]
+"""
+
+import argparse
+import json
+import sys
+
+KEY = ("n", "dimension", "labels", "k")
+
+
+def compare(old: dict, new: dict, threshold: float = 1.2) -> list:
+    """Finds ratios of times and peak memory between two reports.
+
+    Parameters
+    ----------
+    old, new : dict
+        reports written by `benchmarks/scaling.py`
+    threshold : float
+        ratio above which a stage is reported as a regression
+
+    Returns
+    -------
+    list
+        dictionaries with the configuration, stage, ratios of "seconds"
+        and "peak_bytes", and whether it is a "regression"
+    """
+    old_results = {tuple(result[key] for key in KEY): result
+                   for result in old["results"]}
+    rows = []
+    for result in new["results"]:
+        configuration = tuple(result[key] for key in KEY)
+        if configuration not in old_results:
+            continue
+        before = old_results[configuration]
+        for stage, seconds in result["seconds"].items():
+            if stage not in before["seconds"]:
+                continue
+            time_ratio = seconds / max(before["seconds"][stage], 1e-9)
+            memory_ratio = (result["peak_bytes"][stage]
+                            / max(before["peak_bytes"][stage], 1))
+            rows.append(dict(zip(KEY, configuration), stage=stage,
+                             seconds=time_ratio, peak_bytes=memory_ratio,
+                             regression=max(time_ratio,
+                                            memory_ratio) > threshold))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    with open(args.old) as old_file, open(args.new) as new_file:
+        rows = compare(json.load(old_file), json.load(new_file),
+                       args.threshold)
+
+    for row in rows:
+        print("n={n:<9} dim={dimension:<3} labels={labels:<5} k={k:<4} "
+              "{stage:<24} time x{seconds:6.2f}  memory x{peak_bytes:6.2f}"
+              "{mark}".format(mark="  REGRESSION" if row["regression"]
+                              else "", **row))
+    sys.exit(1 if any(row["regression"] for row in rows) else 0)
@@ -0,0 +1,66 @@
+"""Measures how long it takes to import the estimator in a fresh interpreter.
+
+Short-lived workers pay the import cost on every start, so importing the
+core estimator should take well under a second and must not load TensorFlow.
+
+Usage:
+    $ python benchmarks/import_time.py [--repeats 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+STATEMENT = """
+import sys, time, json
+start = time.perf_counter()
+from cce import WeightedKraskovEstimator
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed,
+                  "tensorflow_imported": "tensorflow" in sys.modules}))
+"""
+
+
+def measure_import(repeats: int = 10) -> dict:
+    """Imports the estimator `repeats` times, each in a new interpreter.
+
+    Parameters
+    ----------
+    repeats : int
+        number of interpreters started
+
+    Returns
+    -------
+    dict
+        summary of import times in seconds
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [SRC, env.get("PYTHONPATH")]))
+
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", STATEMENT], env=env,
+                                check=True, capture_output=True, text=True)
+        runs.append(json.loads(output.stdout.splitlines()[-1]))
+
+    seconds = [run["seconds"] for run in runs]
+    return {"repeats": repeats,
+            "min": min(seconds),
+            "median": statistics.median(seconds),
+            "max": max(seconds),
+            "tensorflow_imported": any(run["tensorflow_imported"]
+                                       for run in runs)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    print(json.dumps(measure_import(args.repeats), indent=2))
@@ -0,0 +1,215 @@
+"""Measures how the estimator scales with the size and shape of the data.
+
+Every configuration of the grid (number of points, dimension, number of
+labels, k) is run in a new interpreter, on data from a Gaussian channel:
+the outputs of label i are drawn around the point (i / labels, ..., i /
+labels) with standard deviation `--sigma`, as in
+`tests/noisy_channel.communicate`. Stages are timed separately, and the
+peak memory allocated by NumPy and Python during each of them is measured
+(tracemalloc) in another pass, so that tracing does not slow down the timed
+one. The peak resident memory of the whole run is recorded as well. Results are
+written as JSON, to be compared between versions with
+`benchmarks/compare.py`.
+
+Usage:
+    $ python benchmarks/scaling.py --n 1000 10000 --dimension 1 3 \\
+          --labels 2 10 --k 5 10 --output results.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+STAGES = ("load", "load_arrays", "calculate_neighborhoods", "calculate_mi",
+          "calculate_weighted_mi", "calculate_maximized_mi")
+
+
+def gaussian_channel(n: int, dimension: int, labels: int,
+                     sigma: float = 0.3, seed: int = 0) -> tuple:
+    """Draws points of a Gaussian channel with equally likely inputs.
+
+    Parameters
+    ----------
+    n : int
+        number of points
+    dimension : int
+        number of coordinates of an output
+    labels : int
+        number of inputs, labelled 0, 1, ..., labels - 1
+    sigma : float
+        standard deviation of the noise
+    seed : int
+        seed of the random number generator
+
+    Returns
+    -------
+    ndarray
+        label of each point
+    ndarray
+        coordinates of the points. Shape: (n, dimension)
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    label_array = rng.integers(labels, size=n)
+    coordinates = (label_array[:, np.newaxis] / labels
+                   + sigma * rng.standard_normal((n, dimension)))
+    return label_array, coordinates
+
+
+def _time(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def _peak_memory(function) -> int:
+    # Tracing slows down allocations, so it is never on while timing.
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_configuration(n: int, dimension: int, labels: int, k: int,
+                      repeats: int = 3, sigma: float = 0.3,
+                      backend: str = "numpy") -> dict:
+    """Times all the stages for one configuration, in this interpreter.
+
+    Returns
+    -------
+    dict
+        the configuration, with median time (in seconds) and the peak of
+        allocated memory (in bytes, from a separate pass) of each stage
+    """
+    from cce import WeightedKraskovEstimator
+
+    label_array, coordinates = gaussian_channel(n, dimension, labels, sigma)
+    data = list(zip(label_array.tolist(), coordinates))
+    weights = {label: 1 / labels for label in range(labels)}
+
+    def stages(estimator) -> dict:
+        # Neighborhoods are calculated in their own stage, and the later
+        # stages reuse them.
+        return {
+            "load": lambda: estimator.load(data),
+            "load_arrays": lambda: estimator.load_arrays(label_array,
+                                                         coordinates),
+            "calculate_neighborhoods":
+                lambda: estimator.calculate_neighborhoods(k=k),
+            "calculate_mi": lambda: estimator.calculate_mi(k=k),
+            "calculate_weighted_mi":
+                lambda: estimator.calculate_weighted_mi(weights, k=k),
+            "calculate_maximized_mi":
+                lambda: estimator.calculate_maximized_mi(k=k),
+        }
+
+    times = {stage: [] for stage in STAGES}
+    for _ in range(repeats):
+        functions = stages(WeightedKraskovEstimator(backend=backend))
+        for stage in STAGES:
+            times[stage].append(_time(functions[stage]))
+
+    # Peak memory is measured in a separate, traced pass.
+    functions = stages(WeightedKraskovEstimator(backend=backend))
+    memory = {stage: _peak_memory(functions[stage]) for stage in STAGES}
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        # Linux reports kilobytes.
+        max_rss *= 1024
+
+    return {"n": n, "dimension": dimension, "labels": labels, "k": k,
+            "repeats": repeats,
+            "seconds": {stage: statistics.median(times[stage])
+                        for stage in STAGES},
+            "peak_bytes": memory,
+            "max_rss_bytes": max_rss}
+
+
+def run_grid(ns: list, dimensions: list, labels: list, ks: list,
+             repeats: int = 3, sigma: float = 0.3,
+             backend: str = "numpy") -> dict:
+    """Runs every configuration of the grid in a new interpreter.
+
+    Returns
+    -------
+    dict
+        description of the environment and list of results of
+        `run_configuration`
+    """
+    import numpy
+    import scipy
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [SRC, env.get("PYTHONPATH")]))
+
+    results = []
+    for n, dimension, number_of_labels, k in itertools.product(
+            ns, dimensions, labels, ks):
+        configuration = dict(n=n, dimension=dimension,
+                             labels=number_of_labels, k=k, repeats=repeats,
+                             sigma=sigma, backend=backend)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__),
+             "--configuration", json.dumps(configuration)],
+            env=env, check=True, capture_output=True, text=True)
+        results.append(json.loads(output.stdout.splitlines()[-1]))
+        print("n={n} dimension={dimension} labels={labels} k={k}: "
+              "{total:.3f} s".format(
+                  total=sum(results[-1]["seconds"].values()),
+                  **configuration), file=sys.stderr)
+
+    git = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True)
+    return {"commit": git.stdout.strip() or None,
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "scipy": scipy.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "backend": backend,
+            "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--dimension", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--labels", type=int, nargs="+", default=[2, 10])
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 20])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--sigma", type=float, default=0.3)
+    parser.add_argument("--backend", default="numpy")
+    parser.add_argument("--output", help="JSON file for the results, "
+                                         "printed by default")
+    parser.add_argument("--configuration", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.configuration:
+        # A single configuration, run by `run_grid` in a new interpreter.
+        print(json.dumps(run_configuration(**json.loads(args.configuration))))
+        sys.exit()
+
+    report = run_grid(args.n, args.dimension, args.labels, args.k,
+                      repeats=args.repeats, sigma=args.sigma,
+                      backend=args.backend)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,89 @@
+"""Measures the speedup of neighborhood counting given by `spatial_order`.
+
+Points of a Gaussian channel (see `benchmarks/scaling.py`) come in random
+order. For every number of points, dimension and number of labels,
+neighborhoods are counted with the points in this order and in Morton order
+within labels, in a single thread, and the median times of loading
+(including the reordering) and of counting are reported with their ratio.
+
+Usage:
+    $ python benchmarks/spatial_order.py --n 100000 1000000 --labels 2 10
+"""
+
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import time
+
+from scaling import SRC, gaussian_channel
+
+sys.path.insert(0, SRC)
+
+
+def run_configuration(n: int, dimension: int, labels: int, k: int,
+                      repeats: int = 3, sigma: float = 0.3) -> dict:
+    """Times loading and counting of neighborhoods with and without
+    spatial ordering of the points.
+
+    Returns
+    -------
+    dict
+        the configuration, with median times in seconds and the speedup
+        of counting (time without ordering divided by time with it)
+    """
+    from cce import WeightedKraskovEstimator
+
+    label_array, coordinates = gaussian_channel(n, dimension, labels, sigma)
+    result = {"n": n, "dimension": dimension, "labels": labels, "k": k,
+              "repeats": repeats}
+    mis = []
+    for spatial_order in (False, True):
+        load, count = [], []
+        for _ in range(repeats):
+            estimator = WeightedKraskovEstimator(workers=1,
+                                                 spatial_order=spatial_order)
+            start = time.perf_counter()
+            estimator.load_arrays(label_array, coordinates)
+            load.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            estimator.calculate_neighborhoods(k=k)
+            count.append(time.perf_counter() - start)
+        mis.append(estimator.calculate_mi(k=k))
+        name = "ordered" if spatial_order else "unordered"
+        result[name] = {"load_seconds": statistics.median(load),
+                        "neighborhoods_seconds": statistics.median(count)}
+
+    result["speedup"] = (result["unordered"]["neighborhoods_seconds"]
+                         / result["ordered"]["neighborhoods_seconds"])
+    result["mi_difference"] = mis[1] - mis[0]
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, nargs="+",
+                        default=[100000, 1000000])
+    parser.add_argument("--dimension", type=int, nargs="+", default=[2, 3])
+    parser.add_argument("--labels", type=int, nargs="+", default=[2])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--sigma", type=float, default=0.3)
+    parser.add_argument("--output", help="JSON file for the results, "
+                                         "printed by default")
+    args = parser.parse_args()
+
+    results = []
+    for n, dimension, labels in itertools.product(args.n, args.dimension,
+                                                  args.labels):
+        results.append(run_configuration(n, dimension, labels, args.k,
+                                         args.repeats, args.sigma))
+        print("n={n} dimension={dimension} labels={labels}: {speedup:.2f}x"
+              .format(**results[-1]), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
@@ -0,0 +1,213 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Awaitable estimator for asyncio applications
+
+`AsyncEstimator` wraps a `WeightedKraskovEstimator` and runs its stages
+(loading, counting of neighborhoods, scoring and optimization) in an
+executor, so that the event loop of e.g. a web service is not blocked by
+them. A query cancelled while a stage is running stops when the stage
+ends; optimization stops at its next iteration.
+
+Loading and counting of neighborhoods change the estimator, so they are
+serialized by a lock. Queries then score or optimize weights on a snapshot
+of the neighborhoods taken under the lock, so concurrent queries for the
+same k share the neighborhoods and run in parallel.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import functools
+import threading
+from cce.estimator import WeightedKraskovEstimator
+
+
+class _Cancelled(Exception):
+    """Raised in the optimizer callback to stop a cancelled query."""
+
+
+class AsyncEstimator:
+    """Weighted Kraskov Estimator with awaitable methods.
+
+    Parameters
+    ----------
+    estimator : WeightedKraskovEstimator
+        estimator to be used, a new one created with `settings` by default
+    executor : concurrent.futures.Executor
+        executor running the stages, the default (thread pool) executor of
+        the event loop by default. Stages change the estimator in place, so
+        it has to run them in threads of this process
+    settings
+        passed to `WeightedKraskovEstimator` if `estimator` is not given
+
+    Notes
+    -----
+    The estimator should not be used directly while queries are running.
+    Events of instrumentation of concurrent queries are interleaved, and
+    their peak memory (`Instrumentation(memory=True)`) is not reliable.
+    """
+
+    def __init__(self, estimator: WeightedKraskovEstimator = None,
+                 executor=None, **settings):
+        if isinstance(executor, ProcessPoolExecutor):
+            raise ValueError("Stages change the estimator, so they cannot "
+                             "run in other processes.")
+        if estimator is None:
+            estimator = WeightedKraskovEstimator(**settings)
+        elif settings:
+            raise ValueError("Settings are used only to create a new "
+                             "estimator.")
+        self.estimator = estimator
+        self.executor = executor
+        # created on first use, within the running event loop
+        self._lock = None
+
+
+    def _state_lock(self) -> asyncio.Lock:
+        """Returns the lock serializing loading and counting of
+        neighborhoods."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+
+    async def _run(self, function, *args, cancelled: threading.Event = None,
+                   **kwargs):
+        """Runs a stage in the executor.
+
+        A thread cannot be interrupted, so if the awaiting task is
+        cancelled, `cancelled` is set and the stage is waited for before
+        CancelledError propagates. Hence a stage never overlaps with the
+        next one taking the lock.
+        """
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(function, *args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if cancelled is not None:
+                cancelled.set()
+            while not future.done():
+                try:
+                    await asyncio.wait([future])
+                except asyncio.CancelledError:
+                    pass
+            raise
+
+
+    async def _neighborhoods(self, k: int) -> WeightedKraskovEstimator:
+        """Calculates neighborhoods for `k`, unless they are ready, and
+        returns a snapshot of the estimator with them."""
+        async with self._state_lock():
+            estimator = self.estimator
+            if estimator._new_data_loaded or estimator._k != k:
+                await self._run(estimator.calculate_neighborhoods, k)
+            # Later loading or counting replaces the arrays of the
+            # estimator, but does not change them in place.
+            return copy.copy(estimator)
+
+
+    async def load(self, data: list):
+        """Loads data into the estimator, see `WeightedKraskovEstimator.load`.
+
+        Parameters
+        ----------
+        data : list
+            list of tuples (label, value)
+        """
+        async with self._state_lock():
+            await self._run(self.estimator.load, data)
+
+
+    async def load_arrays(self, labels, coordinates, copy: bool = True):
+        """Loads data given as arrays, see
+        `WeightedKraskovEstimator.load_arrays`.
+
+        Parameters
+        ----------
+        labels : numpy array or list
+            label of each point (int or str)
+        coordinates : numpy array
+            coordinates of the points
+        copy : bool
+            if False, coordinates may be normalized in place
+        """
+        async with self._state_lock():
+            await self._run(self.estimator.load_arrays, labels, coordinates,
+                            copy=copy)
+
+
+    async def calculate_mi(self, k: int) -> float:
+        """Calculates MI for the numbers of points of the labels.
+
+        Parameters
+        ----------
+        k : int
+            free parameter in Kraskov estimator
+
+        Returns
+        -------
+        float
+            mutual information in bits
+        """
+        snapshot = await self._neighborhoods(k)
+        return await self._run(snapshot.calculate_mi, k)
+
+
+    async def calculate_weighted_mi(self, weights: dict, k: int) -> float:
+        """Calculates MI for weighted input.
+
+        Parameters
+        ----------
+        weights : dict
+            dictionary {label1: weight1, label2: weight2, ...}, summing up
+            to 1
+        k : int
+            free parameter in Kraskov estimator
+
+        Returns
+        -------
+        float
+            mutual information in bits
+        """
+        snapshot = await self._neighborhoods(k)
+        return await self._run(snapshot.calculate_weighted_mi, weights, k)
+
+
+    async def calculate_maximized_mi(self, k: int, **options) -> tuple:
+        """Calculates maximal MI (channel capacity).
+
+        Parameters
+        ----------
+        k : int
+            free parameter in Kraskov estimator
+        options
+            passed to `WeightedKraskovEstimator.optimize_weights`
+
+        Returns
+        -------
+        float
+            optimized MI, in bits
+        dict
+            dictionary mapping labels to weights
+        """
+        snapshot = await self._neighborhoods(k)
+        cancelled = threading.Event()
+        trace = options.pop("callback",
+                            snapshot._loss_trace().get("callback"))
+
+        def callback(iteration, loss, weights):
+            if cancelled.is_set():
+                raise _Cancelled
+            if trace is not None:
+                trace(iteration, loss, weights)
+
+        def optimize():
+            try:
+                return snapshot.optimize_weights(callback=callback, **options)
+            except _Cancelled:
+                return None
+
+        return await self._run(optimize, cancelled=cancelled)
@@ -0,0 +1,76 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Registry of backends scoring and optimizing weights
+
+A backend is a module providing functions `weight_loss` and
+`weight_optimizer`, and optionally `weight_loss_batch` (see
+`cce.numpy_backend` for their signatures).
+Backends are imported only when they are used for the first time, so that
+importing `cce` does not pull in heavy dependencies like TensorFlow.
+"""
+
+import importlib
+
+# names of backends mapped to names of modules implementing them
+_backend_modules = {
+    "numpy": "cce.numpy_backend",
+    "minibatch": "cce.minibatch_backend",
+    "tensorflow": "cce.tensorflow_backend",
+}
+
+# modules of backends that have already been used
+_loaded_backends = dict()
+
+
+def register_backend(name: str, module_name: str):
+    """Registers a new backend, to be imported on first use.
+
+    Parameters
+    ----------
+    name : str
+        name of the backend, as passed to the estimator
+    module_name : str
+        importable name of the module implementing the backend
+    """
+    _backend_modules[name] = module_name
+    _loaded_backends.pop(name, None)
+
+
+def available_backends() -> list:
+    """Returns names of all registered backends.
+
+    Returns
+    -------
+    list
+        names of backends (some of them may miss their dependencies)
+    """
+    return list(_backend_modules)
+
+
+def check_backend(name: str):
+    """Raises ValueError if there is no backend with a given name."""
+    if name not in _backend_modules:
+        raise ValueError("Unknown backend: {}. Available backends: {}."
+                         .format(name, ", ".join(_backend_modules)))
+
+
+def get_backend(name: str):
+    """Returns the module implementing a backend, importing it if needed.
+
+    Parameters
+    ----------
+    name : str
+        name of the backend
+
+    Returns
+    -------
+    module
+        module with functions `weight_loss` and `weight_optimizer`
+    """
+    if name not in _loaded_backends:
+        check_backend(name)
+        _loaded_backends[name] = importlib.import_module(
+            _backend_modules[name])
+    return _loaded_backends[name]
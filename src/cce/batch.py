@@ -0,0 +1,162 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Estimation for many data sets in a pool of worker processes
+
+Every data set is loaded, its neighborhoods are counted and its weights
+are optimized in a single task, so that the work of many small or
+medium data sets (e.g. time points, cell lines and doses of an experiment)
+is spread across the pool. Results are yielded as soon as their tasks
+complete, and an error in one data set is reported in its result instead
+of stopping the others.
+"""
+
+from concurrent.futures import (ProcessPoolExecutor, FIRST_COMPLETED,
+                                wait)
+import os
+import time
+import traceback
+from cce.estimator import WeightedKraskovEstimator
+from cce.resampling import _statistics
+
+
+def _estimate_dataset(task: tuple) -> dict:
+    key, data, k, statistic, weights, settings = task
+    start = time.perf_counter()
+    try:
+        estimator = WeightedKraskovEstimator(**settings)
+        if isinstance(data, tuple):
+            estimator.load_arrays(*data)
+        else:
+            estimator.load(data)
+
+        result = {"key": key}
+        if statistic == "maximized_mi":
+            result["mi"], result["weights"] = \
+                estimator.calculate_maximized_mi(k=k)
+        elif statistic == "weighted_mi":
+            result["mi"] = estimator.calculate_weighted_mi(weights, k=k)
+        else:
+            result["mi"] = estimator.calculate_mi(k=k)
+    except Exception as error:
+        result = _error_result(key, error)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _error_result(key, error: Exception) -> dict:
+    return {"key": key,
+            "error": "{}: {}".format(type(error).__name__, error),
+            "traceback": "".join(traceback.format_exception(
+                type(error), error, error.__traceback__))}
+
+
+def estimate_batch(datasets, k: int, statistic: str = "maximized_mi",
+                   weights: dict = None, processes: int = None,
+                   executor=None, max_pending: int = None, **settings):
+    """Estimates MI or channel capacity for many data sets in parallel.
+
+    Parameters
+    ----------
+    datasets : dict or iterable
+        data sets mapped to their keys, or an iterable of (key, data set)
+        pairs, e.g. a generator reading them from disk. A data set is either
+        a list of (label, value) tuples, as in
+        `WeightedKraskovEstimator.load`, or a tuple of labels and
+        coordinates, as in `WeightedKraskovEstimator.load_arrays`
+    k : int
+        free parameter in Kraskov estimator
+    statistic : str
+        "mi", "weighted_mi" or "maximized_mi" (channel capacity), for the
+        estimates of `calculate_mi`, `calculate_weighted_mi` and
+        `calculate_maximized_mi`
+    weights : dict
+        weights of labels, required by "weighted_mi", the same for all the
+        data sets
+    processes : int
+        number of worker processes, all cores by default. With 1, data sets
+        are estimated one by one in the calling process
+    executor : concurrent.futures.Executor
+        executor running the tasks instead of a new pool of `processes`,
+        e.g. a pool started with the "spawn" method, which is safer with
+        the TensorFlow backend
+    max_pending : int
+        largest number of data sets submitted but not finished yet, twice
+        the number of processes by default. Data sets are read from
+        `datasets` only when needed, which bounds the memory used
+    settings
+        passed to `WeightedKraskovEstimator`, e.g. `backend` or `leaf_size`.
+        In a pool, every estimator uses a single thread and process
+
+    Returns
+    -------
+    generator
+        yielding dictionaries with results of the data sets as soon as
+        they are ready: "key", "mi" (in bits), "weights" (dictionary mapping
+        labels to optimal weights, for "maximized_mi" only) and "seconds"
+        (time of the estimation). If the estimation failed, "error" and
+        "traceback" describe the exception instead of "mi" and "weights"
+    """
+    if statistic not in _statistics:
+        raise ValueError("Unknown statistic: {}. Available statistics: {}."
+                         .format(statistic, ", ".join(_statistics)))
+    if statistic == "weighted_mi" and weights is None:
+        raise ValueError("Weights are required for weighted MI.")
+
+    items = datasets.items() if isinstance(datasets, dict) else datasets
+
+    if processes == 1 and executor is None:
+        return (_estimate_dataset((key, data, k, statistic, weights,
+                                   settings))
+                for key, data in items)
+
+    processes = processes or os.cpu_count()
+    # Each worker uses a single thread in tree queries, and no pool of its
+    # own.
+    settings = dict(settings, workers=1, processes=1)
+    tasks = ((key, data, k, statistic, weights, settings)
+             for key, data in items)
+    return _run_in_pool(tasks, executor, processes,
+                        max_pending or 2 * processes)
+
+
+def _run_in_pool(tasks, executor, processes: int, max_pending: int,
+                 function=_estimate_dataset):
+    # Tasks are tuples starting with a key, passed to `function`, which
+    # should catch errors of the estimation itself.
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=processes)
+    pending = dict()
+    try:
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                try:
+                    pending[executor.submit(function, task)] = task[0]
+                except Exception as error:
+                    # e.g. a pool broken by a worker killed earlier
+                    yield _error_result(task[0], error)
+
+            if not pending:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                error = future.exception()
+                # Errors of the estimation are caught in the task, so these
+                # are failures of the pool, e.g. data which cannot be
+                # pickled or a worker which crashed.
+                yield (future.result() if error is None
+                       else _error_result(key, error))
+    finally:
+        # Tasks not started yet are dropped when the batch is abandoned.
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
@@ -0,0 +1,200 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""On-disk cache of neighborhood arrays
+
+Every entry is a directory holding `.npy` files, which are memory-mapped
+when the entry is read, and a small JSON file with metadata. Entries are
+keyed by a content hash of the normalized data, k and the settings which
+affect neighborhood arrays. When the cache grows over its size limit, the
+least recently used entries are removed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+_META = "meta.json"
+
+
+def fingerprint(coordinates: np.ndarray, label_array: np.ndarray,
+                labels: list) -> str:
+    """Calculates a content hash of the data.
+
+    Parameters
+    ----------
+    coordinates : numpy array
+        normalized coordinates of the points
+    label_array : numpy array
+        label index of each point
+    labels : list
+        labels, ordered by their indices
+
+    Returns
+    -------
+    str
+        hexadecimal digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for array in (coordinates, label_array):
+        array = np.ascontiguousarray(array)
+        digest.update(repr((array.shape, array.dtype.str)).encode())
+        digest.update(memoryview(array).cast("B"))
+    digest.update(repr(labels).encode())
+    return digest.hexdigest()
+
+
+class NeighborhoodCache:
+    """Directory with neighborhood arrays, evicted in LRU order.
+
+    Parameters
+    ----------
+    directory : str
+        directory of the cache, created if it does not exist
+    max_bytes : int
+        size limit of the cache. The entry stored most recently is kept
+        even if it is larger
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 2**30):
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+
+    @staticmethod
+    def key(data_fingerprint: str, k: int, settings: dict) -> str:
+        """Key of the entry for data with given fingerprint, k and settings
+        of the estimator."""
+        description = json.dumps([data_fingerprint, k, settings],
+                                 sort_keys=True)
+        return hashlib.blake2b(description.encode(),
+                               digest_size=20).hexdigest()
+
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+
+    def load(self, key: str):
+        """Reads an entry.
+
+        Parameters
+        ----------
+        key : str
+            key of the entry, see `key`
+
+        Returns
+        -------
+        dict or None
+            None if there is no such entry. Otherwise, a dictionary with
+            memory-mapped arrays "neighborhood_array" (a CSR matrix if it
+            has been stored as one), "label_array", "epsilon_array" and
+            the list of "labels"
+        """
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, _META)) as file:
+                meta = json.load(file)
+            arrays = {name: np.load(os.path.join(path, name + ".npy"),
+                                    mmap_mode="r")
+                      for name in meta["arrays"]}
+        except (OSError, ValueError):
+            return None
+
+        # Mark the entry as recently used.
+        os.utime(os.path.join(path, _META))
+
+        if meta["sparse"]:
+            neighborhood_array = csr_matrix(
+                (arrays.pop("data"), arrays.pop("indices"),
+                 arrays.pop("indptr")), shape=tuple(meta["shape"]), copy=False)
+        else:
+            neighborhood_array = arrays.pop("neighborhood_array")
+        return dict(arrays, neighborhood_array=neighborhood_array,
+                    labels=meta["labels"])
+
+
+    def store(self, key: str, neighborhood_array, label_array: np.ndarray,
+              epsilon_array: np.ndarray, labels: list):
+        """Writes an entry, and evicts the least recently used entries if
+        the cache has grown too large.
+
+        Parameters
+        ----------
+        key : str
+            key of the entry, see `key`
+        neighborhood_array : ndarray or csr_matrix
+            neighborhood array
+        label_array : numpy array
+            label index of each point
+        epsilon_array : numpy array
+            epsilon of each point
+        labels : list
+            labels, ordered by their indices
+        """
+        arrays = {"label_array": label_array, "epsilon_array": epsilon_array}
+        if issparse(neighborhood_array):
+            arrays.update(data=neighborhood_array.data,
+                          indices=neighborhood_array.indices,
+                          indptr=neighborhood_array.indptr)
+        else:
+            arrays["neighborhood_array"] = neighborhood_array
+        meta = {"arrays": list(arrays), "sparse": issparse(neighborhood_array),
+                "shape": list(neighborhood_array.shape),
+                "labels": labels, "created": time.time()}
+
+        # The entry is written aside and then renamed, so that readers never
+        # see a partial entry.
+        temporary = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(temporary, name + ".npy"), array)
+            with open(os.path.join(temporary, _META), "w") as file:
+                json.dump(meta, file, default=str)
+            os.replace(temporary, self._path(key))
+        except OSError:
+            # Another process has stored the same entry in the meantime.
+            shutil.rmtree(temporary, ignore_errors=True)
+        self._evict(keep=key)
+
+
+    def entries(self) -> list:
+        """Lists entries as tuples (key, size in bytes, time of last use),
+        from the least recently used."""
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                used = os.stat(os.path.join(path, _META)).st_mtime
+            except OSError:
+                continue
+            entries.append((key, size, used))
+        return sorted(entries, key=lambda entry: entry[2])
+
+
+    def _evict(self, keep: str = None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+
+
+    def clear(self):
+        """Removes all entries."""
+        for key, _, _ in self.entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
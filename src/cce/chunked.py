@@ -0,0 +1,220 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Out-of-core neighborhood counting for data larger than memory
+
+Coordinates and labels are read in chunks from (memory-mapped) `.npy`
+files and the neighborhood array is written straight into a memory-mapped
+`.npy` file. Neighborhoods are found in two passes over reference chunks.
+The label trees of each reference chunk are built once per pass and queried
+by all the query chunks: in the first pass for the k nearest neighbors with
+the same label, keeping the k + 1 smallest distances found so far in a
+memory-mapped array, and in the second one for the numbers of neighbors of
+each label, which simply add up over the reference chunks. Only a few
+chunks are held in memory at a time, so peak memory depends on the chunk
+size, and not on the number of points. Repeated points are not perturbed in
+this mode.
+"""
+
+import os
+import numpy as np
+from cce.neighborhoods import build_label_trees, count_tree_neighbors
+
+
+def open_npy(array):
+    """Opens a `.npy` file as a read-only memory-mapped array (arrays are
+    returned as they are)."""
+    if isinstance(array, (str, os.PathLike)):
+        return np.load(array, mmap_mode="r")
+    return array
+
+
+def chunk_size_for(max_memory: int, dimension: int, k: int,
+                   number_of_labels: int) -> int:
+    """Estimates the number of points in a chunk for given peak memory.
+
+    Parameters
+    ----------
+    max_memory : int
+        approximate peak memory used by the chunks, in bytes
+    dimension : int
+        number of coordinates of a point
+    k : int
+        free parameter in Kraskov estimator
+    number_of_labels : int
+        number of different labels
+
+    Returns
+    -------
+    int
+        number of points in a chunk, at least k + 1
+    """
+    # Two chunks of coordinates and labels, a tree over one of them, the
+    # distances to the nearest neighbors and the counts of a query chunk,
+    # and temporary arrays of the tree queries.
+    bytes_per_point = (8 * (4 * dimension + 4 * (k + 1) + number_of_labels)
+                       + 64)
+    return max(k + 1, int(max_memory // bytes_per_point))
+
+
+def _chunks(number_of_points: int, chunk_size: int):
+    for start in range(0, number_of_points, chunk_size):
+        yield start, min(start + chunk_size, number_of_points)
+
+
+def index_labels_chunked(labels, label_array: np.ndarray,
+                         chunk_size: int) -> tuple:
+    """Assigns consecutive indices to labels, in order of first appearance,
+    reading the labels in chunks.
+
+    Parameters
+    ----------
+    labels : numpy array
+        label of each point, e.g. memory-mapped
+    label_array : numpy array
+        output array for the index of each point, e.g. memory-mapped
+    chunk_size : int
+        number of labels read at once
+
+    Returns
+    -------
+    list
+        distinct labels, ordered by their indices
+    ndarray
+        number of points of each label
+    """
+    values = []
+    counts = np.zeros(0, dtype=np.int64)
+    for start, stop in _chunks(len(labels), chunk_size):
+        chunk = np.asarray(labels[start:stop])
+        chunk_values, first = np.unique(chunk, return_index=True)
+        known = set(values)
+        values.extend(value for value in chunk_values[np.argsort(first)]
+                      .tolist() if value not in known)
+
+        # Index of each label is found by binary search in sorted labels.
+        sorted_values = np.array(values)
+        order = np.argsort(sorted_values, kind="stable")
+        indices = order[np.searchsorted(sorted_values[order], chunk)]
+        label_array[start:stop] = indices
+        counts = np.pad(counts, (0, len(values) - len(counts)))
+        counts += np.bincount(indices, minlength=len(values))
+    return values, counts
+
+
+def coordinate_bounds_chunked(coordinates, chunk_size: int) -> tuple:
+    """Finds the smallest and the largest coordinate, reading the
+    coordinates in chunks."""
+    bounds = [(np.amin(coordinates[start:stop]),
+               np.amax(coordinates[start:stop]))
+              for start, stop in _chunks(len(coordinates), chunk_size)]
+    return min(low for low, _ in bounds), max(high for _, high in bounds)
+
+
+def _read_chunk(coordinates, start: int, stop: int,
+                bounds: tuple) -> np.ndarray:
+    # Normalized in the same way as `preprocessing.normalize_coordinates`.
+    chunk = np.array(coordinates[start:stop], dtype=np.float64)
+    if chunk.ndim == 1:
+        chunk = chunk[:, np.newaxis]
+    min_, max_ = bounds
+    chunk -= min_
+    chunk /= max_ - min_
+    return chunk
+
+
+def count_neighborhoods_chunked(coordinates, label_array: np.ndarray,
+                                number_of_labels: int, k: int, bounds: tuple,
+                                neighborhood_array: np.ndarray,
+                                epsilon_array: np.ndarray, chunk_size: int,
+                                directory: str, leaf_size: int = 16,
+                                workers: int = -1):
+    """Counts neighborhoods chunk by chunk.
+
+    Parameters
+    ----------
+    coordinates : numpy array
+        coordinates of the points, e.g. memory-mapped. They are normalized
+        chunk by chunk. Shape: (number of points, dimension) or
+        (number of points, )
+    label_array : numpy array
+        label index of each point, e.g. memory-mapped
+    number_of_labels : int
+        number of different labels
+    k : int
+        free parameter in Kraskov estimator
+    bounds : tuple
+        minimal and maximal coordinate mapped to 0 and 1, respectively
+    neighborhood_array : numpy array
+        output of shape (number of points, number of labels), e.g.
+        memory-mapped, see `neighborhoods.count_neighborhoods`
+    epsilon_array : numpy array
+        output for the distance to the k-th nearest point with the same
+        label, e.g. memory-mapped
+    chunk_size : int
+        number of points in a chunk, see `chunk_size_for`
+    directory : str
+        directory for a temporary memory-mapped array of the k + 1 nearest
+        distances of all the points
+    leaf_size : int
+        positive integer, used for tree construction
+    workers : int
+        number of threads used by the tree queries, -1 means all cores
+    """
+    number_of_points = len(label_array)
+    chunks = list(_chunks(number_of_points, chunk_size))
+
+    def reference_chunks():
+        # Trees of every reference chunk are built once per pass.
+        for start, stop in chunks:
+            labels = np.asarray(label_array[start:stop])
+            yield build_label_trees(
+                _read_chunk(coordinates, start, stop, bounds), labels,
+                number_of_labels, leaf_size=leaf_size)
+
+    def query_chunks():
+        for start, stop in chunks:
+            yield (start, stop, _read_chunk(coordinates, start, stop, bounds),
+                   np.asarray(label_array[start:stop]))
+
+    # The k + 1 smallest distances to points with the same label (including
+    # the point itself) over the reference chunks seen so far.
+    path = os.path.join(directory, "nearest_{}.npy".format(k))
+    nearest = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64,
+                                        shape=(number_of_points, k + 1))
+    nearest[:] = np.inf
+    for trees in reference_chunks():
+        for start, stop, query, labels in query_chunks():
+            chunk_nearest = np.array(nearest[start:stop])
+            for label, tree in enumerate(trees):
+                points = labels == label
+                if tree.n == 0 or not points.any():
+                    continue
+                distances = tree.query(
+                    query[points], k=list(range(1, min(k + 1, tree.n) + 1)),
+                    workers=workers)[0]
+                chunk_nearest[points] = np.sort(
+                    np.hstack([chunk_nearest[points], distances]),
+                    axis=1)[:, :k + 1]
+            nearest[start:stop] = chunk_nearest
+    for start, stop in chunks:
+        epsilon_array[start:stop] = nearest[start:stop, k]
+    del nearest
+    os.remove(path)
+
+    for start, stop in chunks:
+        # Every point lies in its own ball, so we need to subtract it.
+        labels = np.asarray(label_array[start:stop])
+        counts = np.zeros((stop - start, number_of_labels))
+        counts[np.arange(stop - start), labels] = -1
+        neighborhood_array[start:stop] = counts
+    for trees in reference_chunks():
+        for start, stop, query, _ in query_chunks():
+            epsilons = np.asarray(epsilon_array[start:stop])
+            counts = np.array(neighborhood_array[start:stop])
+            for label, tree in enumerate(trees):
+                counts[:, label] += count_tree_neighbors(tree, query,
+                                                         epsilons,
+                                                         workers=workers)
+            neighborhood_array[start:stop] = counts
@@ -0,0 +1,262 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Command-line estimation for many files and values of k
+
+Every input file holds one data set, as a CSV file or a two-dimensional
+`.npy` array with a column of labels and columns of coordinates. Each file
+is read, estimated for all the values of k (reusing the tree queries, see
+`calculate_mi_curve`) and reported by a worker of a process pool. Results
+are written as JSON lines, one for each file and k, as soon as the file is
+done, e.g.:
+
+    $ cce data/*.csv --k 5 10 20 --statistic maximized_mi \\
+          --processes 8 --output results.jsonl
+
+With `--resume`, files and values of k already in the output are skipped
+(except for failed ones), so that an interrupted run can be continued.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import traceback
+import numpy as np
+from cce.batch import _run_in_pool
+from cce.estimator import WeightedKraskovEstimator
+from cce.instrumentation import Instrumentation
+from cce.resampling import _statistics
+
+
+def read_data(path: str, label_column: int = 0, delimiter: str = ",",
+              header: bool = False) -> tuple:
+    """Reads labels and coordinates of the points from a file.
+
+    Parameters
+    ----------
+    path : str
+        a `.npy` file with a two-dimensional array, or a text file with
+        delimited values (CSV), with a row for each point
+    label_column : int
+        index of the column of labels, the other columns are coordinates
+    delimiter : str
+        delimiter of values in a CSV file
+    header : bool
+        whether the first row of a CSV file is a header, to be skipped
+
+    Returns
+    -------
+    ndarray
+        label of each point. Labels of `.npy` files which are whole numbers
+        are converted to int
+    ndarray
+        coordinates of the points. Shape: (number of points, dimension)
+    """
+    if path.endswith(".npy"):
+        array = np.load(path)
+        if array.ndim != 2:
+            raise ValueError("Expected a two-dimensional array in {}."
+                             .format(path))
+        labels = array[:, label_column]
+        if (np.issubdtype(labels.dtype, np.floating)
+                and np.all(labels == np.round(labels))):
+            labels = labels.astype(np.int64)
+    else:
+        with open(path, newline="") as file:
+            rows = [row for row in csv.reader(file, delimiter=delimiter)
+                    if row]
+        if header:
+            rows = rows[1:]
+        array = np.array(rows, dtype=object)
+        labels = array[:, label_column].astype(str)
+    coordinates = np.delete(array, label_column, axis=1).astype(np.float64)
+    return labels, coordinates
+
+
+def _estimate_file(task: tuple) -> dict:
+    (path, ks), statistic, weights, settings, read_options = task
+    start = time.perf_counter()
+    instrumentation = Instrumentation()
+    try:
+        estimator = WeightedKraskovEstimator(instrumentation=instrumentation,
+                                             **settings)
+        estimator.load_arrays(*read_data(path, **read_options))
+
+        if statistic == "maximized_mi":
+            mis, weights_matrix = estimator.calculate_maximized_mi_curve(ks)
+            results = [{"mi": float(mi),
+                        "weights": {str(label): float(weight)
+                                    for label, weight
+                                    in zip(estimator.labels, row)}}
+                       for mi, row in zip(mis, weights_matrix)]
+        elif statistic == "weighted_mi":
+            # Weights are given for labels as text.
+            label_weights = {label: weights[str(label)]
+                             for label in estimator.labels}
+            results = [{"mi": float(estimator.calculate_weighted_mi(
+                label_weights, k=k))} for k in ks]
+        else:
+            results = [{"mi": float(mi)}
+                       for mi in estimator.calculate_mi_curve(ks)]
+    except Exception as error:
+        return {"key": (path, ks),
+                "error": "{}: {}".format(type(error).__name__, error),
+                "traceback": "".join(traceback.format_exception(
+                    type(error), error, error.__traceback__))}
+    return {"key": (path, ks), "results": results,
+            "seconds": time.perf_counter() - start,
+            "stages": {stage: summary["seconds"] for stage, summary
+                       in instrumentation.summary()["stages"].items()}}
+
+
+def _finished_jobs(output: str, statistic: str) -> set:
+    """Returns (file, k) pairs with results in an earlier output."""
+    finished = set()
+    if not os.path.exists(output):
+        return finished
+    with open(output) as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # e.g. the last line of an interrupted run
+                continue
+            if "error" not in result and result.get("statistic") == statistic:
+                finished.add((result["file"], result["k"]))
+    return finished
+
+
+def _parse_weights(pairs: list) -> dict:
+    weights = dict()
+    for pair in pairs:
+        label, separator, weight = pair.rpartition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(
+                "Expected LABEL=WEIGHT, got {}.".format(pair))
+        weights[label] = float(weight)
+    return weights
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Returns the parser of command-line arguments of `main`."""
+    parser = argparse.ArgumentParser(
+        prog="cce", description="Estimates mutual information or channel "
+                                "capacity for data sets in files.")
+    parser.add_argument("files", nargs="+",
+                        help="CSV or .npy files with a column of labels and "
+                             "columns of coordinates")
+    parser.add_argument("-k", "--k", type=int, nargs="+", default=[10],
+                        help="values of k (default: 10)")
+    parser.add_argument("-s", "--statistic", choices=_statistics,
+                        default="maximized_mi",
+                        help="estimated statistic (default: maximized_mi, "
+                             "i.e. channel capacity)")
+    parser.add_argument("-w", "--weights", nargs="+", metavar="LABEL=WEIGHT",
+                        help="weights of labels for weighted_mi")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="number of worker processes (default: all "
+                             "cores)")
+    parser.add_argument("-o", "--output",
+                        help="JSON lines file for the results (default: "
+                             "standard output)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip files and values of k with results in "
+                             "the output, and append the others")
+    parser.add_argument("--label-column", type=int, default=0,
+                        help="index of the column of labels (default: 0)")
+    parser.add_argument("--delimiter", default=",",
+                        help="delimiter of CSV files (default: ,)")
+    parser.add_argument("--header", action="store_true",
+                        help="skip the first row of CSV files")
+    parser.add_argument("--backend", default="numpy",
+                        help="backend optimizing weights (default: numpy)")
+    parser.add_argument("--sparse", action="store_true",
+                        help="use sparse neighborhood arrays")
+    parser.add_argument("--compact", action="store_true",
+                        help="store neighborhood counts as small integers")
+    parser.add_argument("--spatial-order", action="store_true",
+                        help="reorder points for faster tree queries")
+    return parser
+
+
+def main(argv: list = None) -> int:
+    """Runs the `cce` command.
+
+    Parameters
+    ----------
+    argv : list
+        command-line arguments, `sys.argv[1:]` by default
+
+    Returns
+    -------
+    int
+        exit status: 0 if all the estimates succeeded, 1 otherwise
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    weights = None
+    if args.statistic == "weighted_mi":
+        if not args.weights:
+            parser.error("--weights are required by weighted_mi")
+        try:
+            weights = _parse_weights(args.weights)
+        except (argparse.ArgumentTypeError, ValueError) as error:
+            parser.error(str(error))
+    if args.resume and not args.output:
+        parser.error("--resume requires --output")
+
+    finished = (_finished_jobs(args.output, args.statistic) if args.resume
+                else set())
+    ks = list(dict.fromkeys(args.k))
+    jobs = [(path, tuple(k for k in ks if (path, k) not in finished))
+            for path in dict.fromkeys(args.files)]
+    jobs = [job for job in jobs if job[1]]
+
+    settings = {"backend": args.backend, "sparse": args.sparse,
+                "compact": args.compact,
+                "spatial_order": args.spatial_order}
+    read_options = {"label_column": args.label_column,
+                    "delimiter": args.delimiter, "header": args.header}
+    processes = args.processes or os.cpu_count()
+    if processes > 1:
+        # Each worker uses a single thread in tree queries.
+        settings["workers"] = 1
+    tasks = ((job, args.statistic, weights, settings, read_options)
+             for job in jobs)
+    if processes == 1:
+        results = map(_estimate_file, tasks)
+    else:
+        results = _run_in_pool(tasks, None, processes, 2 * processes,
+                               function=_estimate_file)
+
+    output = (open(args.output, "a" if args.resume else "w")
+              if args.output else sys.stdout)
+    failed = False
+    try:
+        for result in results:
+            path, job_ks = result["key"]
+            failed = failed or "error" in result
+            for i, k in enumerate(job_ks):
+                line = {"file": path, "k": k, "statistic": args.statistic}
+                if "error" in result:
+                    line.update(error=result["error"],
+                                traceback=result["traceback"])
+                else:
+                    line.update(result["results"][i],
+                                seconds=result["seconds"],
+                                stages=result["stages"])
+                output.write(json.dumps(line) + "\n")
+            # Results can be followed while the batch is running.
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,20 +5,44 @@
 """Kraskov estimator for weighted input distributions"""
 
 from collections import defaultdict
+import os
+import tempfile
+from scipy.sparse import csr_matrix, hstack, vstack, issparse
 from scipy.spatial import cKDTree
 from scipy.special import digamma
 import numpy as np
-from cce.preprocessing import normalize, add_noise_if_duplicates
+from cce.preprocessing import (normalize_coordinates, jitter_duplicates,
+                               index_labels, morton_order)
+from cce.neighborhoods import (build_label_trees, count_neighborhoods,
+                               count_neighborhoods_multi, count_tree_neighbors,
+                               label_epsilons)
+from cce import resampling, subsets
+from cce.cache import NeighborhoodCache, fingerprint
+from cce.parallel import count_neighborhoods_parallel
+from cce.chunked import (open_npy, chunk_size_for, index_labels_chunked,
+                         coordinate_bounds_chunked,
+                         count_neighborhoods_chunked)
+from cce.backends import check_backend
 from cce.optimization import weight_optimizer
-from cce.scoring import weight_loss
+from cce.scoring import weight_loss, weight_loss_batch
+from cce.instrumentation import DISABLED
+
+# approximate size of a node of cKDTree (a struct of nine 8-byte fields),
+# used in `memory_report`
+_TREE_NODE_BYTES = 72
 
 
 class WeightedKraskovEstimator:
 
-    # constant separating points with different labels (X)
-    _huge_dist = 1e6
+    # methods of counting neighborhoods, see `calculate_neighborhoods`
+    _neighborhood_methods = ("count", "list")
 
-    def __init__(self, data: list = None, leaf_size: int = 16):
+    def __init__(self, data: list = None, leaf_size: int = 16,
+                 neighborhood_method: str = "count", workers: int = -1,
+                 backend: str = "numpy", sparse: bool = False,
+                 cache=None, processes: int = 1, approximation: float = 0.,
+                 compact: bool = False, spatial_order: bool = False,
+                 instrumentation=None):
         """Weighted Kraskov Estimator
 
         Parameters
@@ -27,8 +51,90 @@ class WeightedKraskovEstimator:
             check `load` method
         leaf_size : int
             positive integer, used for tree construction
+        neighborhood_method : str
+            "count" (default) fills the neighborhood array with batched,
+            count-only ball queries on per-label trees, whereas "list"
+            is the original per-point implementation, kept for
+            cross-checking
+        workers : int
+            number of threads used in tree queries, -1 means all cores
+        backend : str
+            "numpy" (default), "tensorflow" or any other backend registered
+            in `cce.backends`, used to score and optimize weights. Backends
+            are imported on first use
+        sparse : bool
+            if True, neighborhood_array is stored as a CSR matrix holding
+            only non-zero counts, so that memory and optimization time scale
+            with the number of neighboring labels rather than with
+            number of points times number of labels. Recommended when there
+            are hundreds of labels or more
+        cache : NeighborhoodCache or str
+            opt-in on-disk cache (or its directory) of neighborhood arrays.
+            When the same data are loaded again, neighborhoods for the same
+            k are read from the cache instead of being calculated, and the
+            trees are not even built
+        processes : int
+            number of worker processes counting neighborhoods with the
+            "count" method, all cores if None. With more than one, query
+            points are split across a pool of processes sharing the data,
+            which gives the same results as a single process
+        approximation : float
+            relative error allowed in tree queries of the "count" method,
+            0 (exact) by default. Epsilons are then at most
+            1 + approximation times too large and balls count points up to
+            that much too far or close, which speeds up the queries a lot
+            for outputs with 10 or more dimensions. Use
+            `approximation_report` to measure the resulting error of MI.
+            Data loaded with `load_npy` are always counted exactly
+        compact : bool
+            if True, neighborhood_array stores counts in the smallest
+            unsigned integer type holding the number of points (e.g. uint16
+            up to 65536 points, uint32 up to 4 billion) instead of float64,
+            and points are grouped by label when loaded, so that the trees
+            share the coordinates instead of copying them. Coordinates are
+            kept in float64, since k-d trees make float64 copies of any
+            other type. Counts are exact integers in both modes, so results
+            differ only by rounding, as rows (points) are summed in another
+            order. Rows of neighborhood_array and label_array follow the
+            grouped order, see `in_loaded_order`. See also `memory_report`.
+            Data loaded with `load_npy` are not affected
+        spatial_order : bool
+            if True, points are grouped by label when loaded and ordered
+            along the Morton (Z-order) curve within each label, so that
+            successive tree queries visit nearby points and the same tree
+            nodes. This makes neighborhood counting several times faster
+            for data given in random order. Results are the same up to
+            rounding, and rows of neighborhood_array and label_array follow
+            the new order, see `in_loaded_order`. Data loaded with
+            `load_npy` are not affected
+        instrumentation : Instrumentation
+            collects times (and peak memory) of the stages, numbers of tree
+            queries, the average ball size and the loss during optimization,
+            see `cce.instrumentation`. Disabled by default
         """
+        if neighborhood_method not in self._neighborhood_methods:
+            raise ValueError("Unknown neighborhood method: {}."
+                             .format(neighborhood_method))
+        if approximation < 0:
+            raise ValueError("Approximation should be non-negative.")
+        if approximation and neighborhood_method != "count":
+            raise ValueError("Approximation requires the count method.")
+        check_backend(backend)
+
         self.leaf_size = leaf_size
+        self.neighborhood_method = neighborhood_method
+        self.workers = workers
+        self.backend = backend
+        self.sparse = sparse
+        self.processes = processes
+        self.approximation = approximation
+        self.compact = compact
+        self.spatial_order = spatial_order
+        if cache is not None and not isinstance(cache, NeighborhoodCache):
+            cache = NeighborhoodCache(cache)
+        self.cache = cache
+        self.instrumentation = (DISABLED if instrumentation is None
+                                else instrumentation)
 
         # Define dictionaries bidirectionally mapping labels and numpy 
         # array indices.
@@ -39,22 +145,48 @@ class WeightedKraskovEstimator:
         self._number_of_points_for_label = defaultdict(lambda: 0)
         self._number_of_labels = None
 
-        # Immersed data -- X is mapped from categorical data into reals
-        # using _huge_dist, and we store spaces X x Y and just Y.
-        self._immersed_data_full = None
+        # Coordinates of the points (Y), with labels (X) in label_array.
         self._immersed_data_coordinates = None
 
         self._number_of_points_total = None
 
-        # Trees with points - tree_full stores X x Y, whereas 
-        # tree_coordinates stores just Y.
-        self.tree_full = None
-        self.tree_coordinates = None
+        # Smallest and largest coordinate of the loaded data, used to
+        # normalize points of labels added later.
+        self._bounds = None
+
+        # Report of `jitter_duplicates` on the loaded data: how many repeated
+        # points have been perturbed.
+        self.jitter_report = None
+
+        # Tree with all the points (Y), used by the "list" method of
+        # counting neighborhoods. It is built on first use.
+        self._tree_coordinates = None
+
+        # Trees storing Y separately for each label, used when counting
+        # neighborhoods with the "count" method. They are built on first use.
+        self._label_trees = None
+
+        # Content hash of the loaded data, set only if `cache` is used.
+        self._fingerprint = None
+
+        # Index (in the order of loading) of the point of each row of
+        # label_array and neighborhood_array, or None if the points have not
+        # been reordered (see `compact` and `spatial_order`).
+        self._order = None
 
-        # Array of labels and array of neighborhood for each point.
+        # Memory-mapped coordinates, output directory and peak memory of data
+        # loaded with `load_npy`, whose neighborhoods are counted in chunks.
+        self._out_of_core = None
+
+        # Array of labels and array of neighborhood for each point. The latter
+        # is a CSR matrix if `sparse` is set.
         self.label_array = None
         self.neighborhood_array = None
 
+        # Distance to the k-th neighbor with the same label for each point,
+        # for k used in neighborhood_array.
+        self._epsilon_array = None
+
         self._data_loaded = False
 
         # We store last used k, to enable restoring the arrays from cache
@@ -100,55 +232,84 @@ class WeightedKraskovEstimator:
             where label can be either int or string and value is a
             one-dimensional numpy array/list representing coordinates
         """
-        normalized_data = add_noise_if_duplicates(normalize(data))
-
-        # Sort data for better branch prediction.
-        # normalized_data = sorted(normalized_data, key=hash)
-        # `immersed_data` is a list of Euclidean points:
-        # [ [label_real, coordinate_1, coordinate_2, ...], ... ]
-        immersed_data = []
-        # `index` is a unique int for every label. It will have values
-        # 0, 1, 2, ...
-        index = 0
-        # We want to build array of labels in this step
-        label_array_tmp = []
-
-        for label, value in normalized_data:
-            # If we see this label for the first time, we create a new 
-            # category for it.
-            if label not in self._label2index:
-                self._label2index[label] = index
-                self._index2label[index] = label
-                index += 1
-
-            # Now we are sure that the considered label has unique index.
-            label_index = self._label2index[label]
-            separating_coordinate = label_index * self._huge_dist
-            immersed_data.append([separating_coordinate] + list(value))
-            label_array_tmp.append(label_index)
-
-            # Add this point to the summary how many points are for each 
-            # label_index.
-            self._number_of_points_for_label[label_index] += 1
-
-        # Number of different labels (X) is just index now.
-        self._number_of_labels = index
-
-        # Create immersed data and data without label information (X x Y and Y).
-        self._immersed_data_full = np.array(immersed_data)
-        self._immersed_data_coordinates = self._immersed_data_full[:, 1:]
-
-        # Calculate array of labels.
-        self.label_array = np.array(label_array_tmp, dtype=np.uint32)
+        labels = np.empty(len(data), dtype=object)
+        labels[:] = [label for label, _ in data]
+        coordinates = np.array([value for _, value in data], dtype=np.float64)
+        self.load_arrays(labels, coordinates, copy=False)
+
+
+    def load_arrays(self, labels, coordinates, copy: bool = True):
+        """Loads data given as arrays into the structure.
+
+        Parameters
+        ----------
+        labels : numpy array or list
+            label of each point (int or str)
+        coordinates : numpy array
+            coordinates of the points. Shape: (number of points, dimension),
+            or (number of points, ) for one-dimensional coordinates
+        copy : bool
+            if False, an array of C-contiguous float64 coordinates is not
+            copied, but normalized (and perturbed if it contains repeated
+            points) in place and kept by the estimator
+        """
+        coordinates = np.asarray(coordinates)
+        if coordinates.ndim == 1:
+            coordinates = coordinates[:, np.newaxis]
+        if len(labels) != len(coordinates):
+            raise ValueError("Got {} labels for {} points."
+                             .format(len(labels), len(coordinates)))
+
+        with self.instrumentation.stage("preprocessing"):
+            # Every label gets a unique index 0, 1, 2, ..., in order of
+            # appearance.
+            self.label_array, label_values = index_labels(labels)
+
+            self._bounds = (np.amin(coordinates), np.amax(coordinates))
+            coordinates = normalize_coordinates(coordinates, self._bounds,
+                                                copy=copy)
+            # The hash does not depend on the random perturbation of repeated
+            # points.
+            self._fingerprint = None
+            if self.cache is not None:
+                self._fingerprint = fingerprint(coordinates, self.label_array,
+                                                label_values)
+            # The order is found before the random perturbation as well, so
+            # that it is the same for every load of data with the same hash,
+            # which cached neighborhoods rely on.
+            self._order = None
+            if self.spatial_order:
+                self._order = morton_order(coordinates, self.label_array)
+            elif self.compact and np.any(self.label_array[:-1]
+                                         > self.label_array[1:]):
+                # Trees of labels are then built on slices of coordinates.
+                self._order = np.argsort(self.label_array, kind="stable")
+            if self._order is not None:
+                self.label_array = self.label_array[self._order]
+                coordinates = coordinates[self._order]
+            # With the cache, repeated points are perturbed in the same way
+            # on every load, so that cached epsilons match their points.
+            seed = (None if self._fingerprint is None
+                    else int(self._fingerprint, 16))
+            coordinates, self.jitter_report = jitter_duplicates(coordinates,
+                                                                rng=seed)
+        self._label2index = {label: i for i, label in enumerate(label_values)}
+        self._index2label = dict(enumerate(label_values))
+        self._number_of_labels = len(label_values)
+
+        # Add the summary how many points are for each label index.
+        self._number_of_points_for_label = defaultdict(lambda: 0)
+        self._number_of_points_for_label.update(enumerate(
+            np.bincount(self.label_array,
+                        minlength=self._number_of_labels).tolist()))
 
         # Calculate the number of points.
-        self._number_of_points_total = len(self._immersed_data_full)
+        self._number_of_points_total = len(coordinates)
 
-        # Put the data into the k-d trees.
-        self.tree_full = cKDTree(self._immersed_data_full,
-                                 leafsize=self.leaf_size)
-        self.tree_coordinates = cKDTree(self._immersed_data_coordinates,
-                                        leafsize=self.leaf_size)
+        # The k-d trees are built on first use.
+        self._set_coordinates(coordinates)
+        self._label_trees = None
+        self._out_of_core = None
 
         # Toggle the flag that the trees are ready to use.
         self._data_loaded = True
@@ -158,6 +319,472 @@ class WeightedKraskovEstimator:
         self._new_data_loaded = True
 
 
+    def load_npy(self, labels, coordinates, directory: str = None,
+                 max_memory: int = 2**28):
+        """Loads data from `.npy` files, to be processed out of core.
+
+        The files are memory-mapped and neighborhoods are counted in chunks,
+        whose size is chosen so that they take about `max_memory` bytes,
+        and written into memory-mapped `.npy` files. Repeated points are not
+        perturbed, and neither sparse neighborhood arrays, nor `add_label`,
+        `remove_label` and `bootstrap` are available for such data.
+
+        Parameters
+        ----------
+        labels : str or numpy array
+            path to a `.npy` file with the label of each point (int or str),
+            or an array, e.g. memory-mapped
+        coordinates : str or numpy array
+            path to a `.npy` file with coordinates of the points, or an
+            array. Shape: (number of points, dimension) or
+            (number of points, )
+        directory : str
+            directory for the label array, neighborhood arrays and epsilons,
+            a new temporary directory by default
+        max_memory : int
+            approximate peak memory used by the chunks, in bytes
+        """
+        if self.sparse:
+            raise ValueError("Sparse neighborhood arrays are not available "
+                             "for data loaded with load_npy.")
+        labels, coordinates = open_npy(labels), open_npy(coordinates)
+        if len(labels) != len(coordinates):
+            raise ValueError("Got {} labels for {} points."
+                             .format(len(labels), len(coordinates)))
+
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="cce-")
+        os.makedirs(directory, exist_ok=True)
+        dimension = 1 if coordinates.ndim == 1 else coordinates.shape[1]
+        chunk_size = chunk_size_for(max_memory, dimension, 1, 1)
+
+        self.label_array = np.lib.format.open_memmap(
+            os.path.join(directory, "label_array.npy"), mode="w+",
+            dtype=np.uint32, shape=(len(labels), ))
+        label_values, counts = index_labels_chunked(labels, self.label_array,
+                                                    chunk_size)
+        self._label2index = {label: i for i, label in enumerate(label_values)}
+        self._index2label = dict(enumerate(label_values))
+        self._number_of_labels = len(label_values)
+        self._number_of_points_for_label = defaultdict(lambda: 0)
+        self._number_of_points_for_label.update(enumerate(counts.tolist()))
+        self._number_of_points_total = len(labels)
+
+        self._bounds = coordinate_bounds_chunked(coordinates, chunk_size)
+        self.jitter_report = None
+        self._fingerprint = None
+        self._order = None
+        self._set_coordinates(None)
+        self._label_trees = None
+        self._out_of_core = {"coordinates": coordinates,
+                             "dimension": dimension,
+                             "directory": directory,
+                             "max_memory": max_memory}
+
+        self._data_loaded = True
+        self._new_data_loaded = True
+
+
+    def _chunked_neighborhoods(self, k: int) -> tuple:
+        """Counts neighborhoods of data loaded with `load_npy`, chunk by
+        chunk, into memory-mapped files.
+
+        Returns
+        -------
+        memmap
+            epsilons
+        memmap
+            neighborhood array
+        """
+        directory = self._out_of_core["directory"]
+        shape = (self._number_of_points_total, self._number_of_labels)
+        neighborhood_array = np.lib.format.open_memmap(
+            os.path.join(directory, "neighborhood_array_{}.npy".format(k)),
+            mode="w+", dtype=np.float64, shape=shape)
+        epsilon_array = np.lib.format.open_memmap(
+            os.path.join(directory, "epsilon_array_{}.npy".format(k)),
+            mode="w+", dtype=np.float64, shape=shape[:1])
+
+        chunk_size = chunk_size_for(self._out_of_core["max_memory"],
+                                    self._out_of_core["dimension"], k,
+                                    self._number_of_labels)
+        count_neighborhoods_chunked(
+            self._out_of_core["coordinates"], self.label_array,
+            self._number_of_labels, k, self._bounds, neighborhood_array,
+            epsilon_array, chunk_size, directory, leaf_size=self.leaf_size,
+            workers=self.workers)
+        neighborhood_array.flush()
+        epsilon_array.flush()
+        return epsilon_array, neighborhood_array
+
+
+    def _check_if_data_are_in_memory(self):
+        if self._out_of_core is not None:
+            raise ValueError("Not available for data loaded with load_npy.")
+
+
+    @property
+    def label_trees(self) -> list:
+        """k-d trees with points (Y) of each label, built on first use."""
+        if (self._label_trees is None
+                and self._immersed_data_coordinates is not None):
+            with self.instrumentation.stage("tree_construction"):
+                self._label_trees = build_label_trees(
+                    self._immersed_data_coordinates, self.label_array,
+                    self._number_of_labels, leaf_size=self.leaf_size)
+        return self._label_trees
+
+
+    @property
+    def tree_coordinates(self) -> cKDTree:
+        """k-d tree with points in Y, built on first use."""
+        if (self._tree_coordinates is None
+                and self._immersed_data_coordinates is not None):
+            with self.instrumentation.stage("tree_construction"):
+                self._tree_coordinates = cKDTree(
+                    self._immersed_data_coordinates, leafsize=self.leaf_size)
+        return self._tree_coordinates
+
+
+    def add_label(self, label, points):
+        """Adds points of a new label to the loaded data.
+
+        Epsilons of the other points do not depend on the new label, so if
+        neighborhoods have already been calculated, only the new label's
+        epsilons, its column of counts and its rows are calculated.
+
+        Parameters
+        ----------
+        label : int or str
+            new label
+        points : list
+            coordinates of the points of the new label, as a list of
+            one-dimensional numpy arrays/lists or a two-dimensional array.
+            They are normalized in the same way as the loaded data
+        """
+        self._check_if_data_are_loaded()
+        self._check_if_data_are_in_memory()
+        if label in self._label2index:
+            raise ValueError("Label {} has already been loaded.".format(label))
+
+        update_neighborhoods = (not self._new_data_loaded
+                                and self._k is not None)
+        if update_neighborhoods and len(points) <= self._k:
+            raise ValueError("Label {} needs more than k = {} points."
+                             .format(label, self._k))
+
+        new_coordinates = np.asarray(points)
+        if new_coordinates.ndim == 1:
+            new_coordinates = new_coordinates[:, np.newaxis]
+        new_coordinates, report = jitter_duplicates(
+            normalize_coordinates(new_coordinates, self._bounds))
+        self.jitter_report["perturbed"] += report["perturbed"]
+
+        index = self._number_of_labels
+        new_label_array = np.full(len(new_coordinates), index,
+                                  dtype=self.label_array.dtype)
+        old_coordinates = self._immersed_data_coordinates
+
+        self._label2index[label] = index
+        self._index2label[index] = label
+        self._number_of_points_for_label[index] = len(new_coordinates)
+        self._number_of_labels += 1
+        self._number_of_points_total += len(new_coordinates)
+
+        self.label_array = np.concatenate([self.label_array, new_label_array])
+        self._set_coordinates(np.vstack([old_coordinates, new_coordinates]))
+        if self._order is not None:
+            # New points follow the loaded ones in their given order.
+            self._order = np.concatenate([self._order, np.arange(
+                len(self._order), self._number_of_points_total)])
+
+        self._fingerprint = None
+        new_tree = cKDTree(new_coordinates, leafsize=self.leaf_size)
+        if self._label_trees is not None:
+            self._label_trees.append(new_tree)
+
+        if not update_neighborhoods:
+            return
+
+        new_epsilons = new_tree.query(new_coordinates, k=[self._k + 1],
+                                      eps=self.approximation,
+                                      workers=self.workers)[0][:, 0]
+        # Neighbors with the new label of the points loaded before...
+        new_column = count_tree_neighbors(new_tree, old_coordinates,
+                                          self._epsilon_array,
+                                          workers=self.workers,
+                                          approximation=self.approximation)
+        # ...and neighbors of the new points.
+        new_rows = count_neighborhoods(self.label_trees, new_coordinates,
+                                       new_label_array, new_epsilons,
+                                       workers=self.workers,
+                                       sparse=self.sparse,
+                                       approximation=self.approximation,
+                                       same_label_count=self._k,
+                                       dtype=self._counts_type())
+
+        if self.sparse:
+            neighborhood_array = hstack([self.neighborhood_array,
+                                         csr_matrix(new_column[:, np.newaxis])])
+            neighborhood_array = vstack([neighborhood_array, new_rows],
+                                        format="csr")
+        else:
+            neighborhood_array = np.vstack([
+                np.hstack([self.neighborhood_array, new_column[:, np.newaxis]]),
+                new_rows])
+        # Compact counts may need a larger type for more points.
+        self.neighborhood_array = neighborhood_array.astype(
+            self._counts_type(), copy=False)
+
+        self._epsilon_array = np.concatenate([self._epsilon_array,
+                                              new_epsilons])
+
+
+    def remove_label(self, label):
+        """Removes all points of a label from the loaded data.
+
+        Epsilons of the other points do not depend on the removed label, so
+        if neighborhoods have already been calculated, only its rows and its
+        column of counts are removed.
+
+        Parameters
+        ----------
+        label : int or str
+            label to be removed
+        """
+        self._check_if_data_are_loaded()
+        self._check_if_data_are_in_memory()
+        if label not in self._label2index:
+            raise ValueError("Label {} has not been loaded.".format(label))
+        if self._number_of_labels == 1:
+            raise ValueError("Cannot remove the only label.")
+
+        index = self._label2index[label]
+        kept = self.label_array != index
+
+        labels = [lab for lab in self.labels if lab != label]
+        self._label2index = {lab: i for i, lab in enumerate(labels)}
+        self._index2label = dict(enumerate(labels))
+
+        number_of_points_for_label = defaultdict(lambda: 0)
+        for i in range(self._number_of_labels):
+            if i != index:
+                number_of_points_for_label[i - (i > index)] = \
+                    self._number_of_points_for_label[i]
+        self._number_of_points_for_label = number_of_points_for_label
+        self._number_of_labels -= 1
+        self._number_of_points_total = int(kept.sum())
+
+        label_array = self.label_array[kept]
+        label_array[label_array > index] -= 1
+        self.label_array = label_array
+        self._set_coordinates(self._immersed_data_coordinates[kept])
+        if self._order is not None:
+            # Remaining points are numbered by their ranks in the loaded order.
+            self._order = np.argsort(np.argsort(self._order[kept]))
+        self._fingerprint = None
+        if self._label_trees is not None:
+            del self._label_trees[index]
+
+        if not self._new_data_loaded and self.neighborhood_array is not None:
+            kept_columns = np.arange(self.neighborhood_array.shape[1]) != index
+            self.neighborhood_array = \
+                self.neighborhood_array[kept][:, kept_columns]
+            self._epsilon_array = self._epsilon_array[kept]
+
+
+    def _counts_type(self) -> np.dtype:
+        """Type of counts in neighborhood arrays, see `compact`."""
+        if not self.compact:
+            return np.dtype(np.float64)
+        # A point has at most n - 1 neighbors.
+        return np.min_scalar_type(max(self._number_of_points_total - 1, 0))
+
+
+    def memory_report(self) -> dict:
+        """Reports the memory taken by the arrays and trees of the estimator.
+
+        Returns
+        -------
+        dict
+            number of bytes taken by "coordinates", "label_array",
+            "neighborhood_array", "epsilon_array", "label_trees" and
+            "tree_coordinates" (points copied by the trees, their indices
+            and, estimated, their nodes), and their "total". Arrays which
+            have not been calculated (or are memory-mapped) take no bytes
+        """
+        def array_bytes(array):
+            if array is None or isinstance(array, np.memmap):
+                return 0
+            if issparse(array):
+                return (array.data.nbytes + array.indices.nbytes
+                        + array.indptr.nbytes)
+            return array.nbytes
+
+        def tree_bytes(tree):
+            if tree is None:
+                return 0
+            # Trees share the points with the estimator if possible.
+            shared = np.shares_memory(tree.data,
+                                      self._immersed_data_coordinates)
+            return ((0 if shared else tree.data.nbytes) + tree.indices.nbytes
+                    + tree.size * _TREE_NODE_BYTES)
+
+        report = {
+            "coordinates": array_bytes(self._immersed_data_coordinates),
+            "label_array": array_bytes(self.label_array),
+            "neighborhood_array": array_bytes(self.neighborhood_array),
+            "epsilon_array": array_bytes(self._epsilon_array),
+            "label_trees": sum(tree_bytes(tree)
+                               for tree in self._label_trees or []),
+            "tree_coordinates": tree_bytes(self._tree_coordinates)}
+        report["total"] = sum(report.values())
+        return report
+
+
+    def _set_coordinates(self, coordinates: np.ndarray):
+        """Replaces coordinates of the points (keeping label_array), and
+        invalidates the tree with all the points."""
+        self._immersed_data_coordinates = coordinates
+        self._tree_coordinates = None
+
+
+    def _settings(self) -> dict:
+        """Returns arguments of __init__ (except data and cache) used to
+        create this estimator, e.g. to create similar estimators in worker
+        processes."""
+        return {"leaf_size": self.leaf_size,
+                "neighborhood_method": self.neighborhood_method,
+                "workers": self.workers,
+                "backend": self.backend,
+                "sparse": self.sparse,
+                "processes": self.processes,
+                "approximation": self.approximation,
+                "compact": self.compact,
+                "spatial_order": self.spatial_order}
+
+
+    def in_loaded_order(self, array) -> np.ndarray:
+        """Rearranges rows of a per-point array into the order of loading.
+
+        With `compact` or `spatial_order` set, rows of label_array,
+        neighborhood_array and other per-point arrays follow the internal
+        order of the points, which may differ from the order in which they
+        were loaded (including points of labels added later).
+
+        Parameters
+        ----------
+        array : numpy array or scipy sparse matrix
+            array with a row for each point, in the internal order, e.g.
+            neighborhood_array
+
+        Returns
+        -------
+        ndarray or scipy sparse matrix
+            the rows in the order of loading
+        """
+        self._check_if_data_are_loaded()
+        if self._order is None:
+            return array
+        return array[np.argsort(self._order)]
+
+
+    def bootstrap(self, k: int, statistic: str = "mi", **options) -> dict:
+        """Calculates confidence intervals by resampling the loaded data.
+
+        Parameters
+        ----------
+        k : int
+            free parameter in Kraskov estimator
+        statistic : str
+            "mi", "weighted_mi" or "maximized_mi"
+        options
+            see `cce.resampling.bootstrap`, e.g. `weights`, `n_resamples`,
+            `processes`
+
+        Returns
+        -------
+        dict
+            see `cce.resampling.bootstrap`
+        """
+        self._check_if_data_are_in_memory()
+        return resampling.bootstrap(self, k=k, statistic=statistic, **options)
+
+
+    def calculate_subset_mi(self, labels: list, k: int) -> float:
+        """Calculates MI for the data restricted to a subset of labels,
+        reusing the neighborhoods of all the data.
+
+        Parameters
+        ----------
+        labels : list
+            at least two loaded labels
+        k : int
+            free parameter in Kraskov estimator
+
+        Returns
+        -------
+        float
+            mutual information in bits
+        """
+        return subsets.subset_estimates(self, [labels], k, statistic="mi",
+                                        processes=1)[0]
+
+
+    def calculate_subset_maximized_mi(self, labels: list, k: int,
+                                      **options) -> tuple:
+        """Calculates maximal MI for the data restricted to a subset of
+        labels, reusing the neighborhoods of all the data.
+
+        Parameters
+        ----------
+        labels : list
+            at least two loaded labels
+        k : int
+            free parameter in Kraskov estimator
+        options
+            passed to the optimizer of the backend, see `optimize_weights`
+
+        Returns
+        -------
+        float
+            optimized MI, in bits
+        dict
+            dictionary mapping labels of the subset to weights
+        """
+        return subsets.subset_estimates(self, [labels], k,
+                                        statistic="maximized_mi",
+                                        processes=1, **options)[0]
+
+
+    def calculate_capacity_matrix(self, k: int, labels: list = None,
+                                  processes: int = None,
+                                  **options) -> np.ndarray:
+        """Calculates channel capacity for every pair of labels, from
+        a single calculation of neighborhoods.
+
+        Parameters
+        ----------
+        k : int
+            free parameter in Kraskov estimator
+        labels : list
+            labels to be paired, all the loaded labels by default
+        processes : int
+            number of worker processes optimizing the pairs, all cores by
+            default
+        options
+            passed to the optimizer of the backend, see `optimize_weights`
+
+        Returns
+        -------
+        ndarray
+            symmetric matrix of capacities in bits, with rows and columns
+            ordered as `labels` (or `self.labels`) and zeros on the diagonal
+        """
+        return subsets.capacity_matrix(self, k, labels=labels,
+                                       processes=processes, **options)
+
+
     def _check_if_data_are_loaded(self):
         if not self._data_loaded:
             raise Exception("Data have not been loaded yet.")
@@ -176,21 +803,90 @@ class WeightedKraskovEstimator:
         float
             mutual information in bits
         """
-        n = self._number_of_points_total
         self.calculate_neighborhoods(k=k)
+        with self.instrumentation.stage("scoring"):
+            return self._mi_from_neighborhoods(self.neighborhood_array, k)
 
-        # Calculate the number of points in neighborhood.
-        n_y = self.neighborhood_array.sum(axis=1)
 
-        def _n_x_for_a_given_point_index(i):
-            return self._number_of_points_for_label[self.label_array[i]]
+    def _mi_from_neighborhoods(self, neighborhood_array, k: int) -> float:
+        n = self._number_of_points_total
 
-        n_x = [_n_x_for_a_given_point_index(i) for i in range(n)]
+        # Calculate the number of points in neighborhood.
+        n_y = np.asarray(neighborhood_array.sum(axis=1)).ravel()
+
+        # Calculate the number of points with the same label.
+        label_counts = np.array([self._number_of_points_for_label[i]
+                                 for i in range(self._number_of_labels)])
+        n_x = label_counts[self.label_array]
         digammas = digamma(n_y) + digamma(n_x)
 
         return (digamma(k) + digamma(n) - digammas.mean()) / np.log(2)
 
 
+    def _mi_from_loss(self, loss: float, k: int) -> float:
+        n = self._number_of_points_total
+        return (digamma(k) + digamma(n) - loss) / np.log(2)
+
+
+    def calculate_mi_curve(self, ks: list) -> np.ndarray:
+        """Calculates MI for many values of k, reusing the tree queries.
+
+        The k_max + 1 nearest neighbors of each point are searched for only
+        once and neighborhoods for all ks are counted together, which is
+        much faster than calling `calculate_mi` for each k separately.
+
+        Parameters
+        ----------
+        ks : list
+            values of k, free parameter in Kraskov estimator
+
+        Returns
+        -------
+        ndarray
+            mutual information in bits for each k
+        """
+        neighborhood_arrays = self._neighborhoods_for_ks(ks)
+        with self.instrumentation.stage("scoring"):
+            return np.array([self._mi_from_neighborhoods(neighborhood_array, k)
+                             for k, neighborhood_array
+                             in zip(ks, neighborhood_arrays)])
+
+
+    def calculate_maximized_mi_curve(self, ks: list) -> tuple:
+        """Calculates maximal MI for many values of k, reusing the tree queries.
+
+        Parameters
+        ----------
+        ks : list
+            values of k, free parameter in Kraskov estimator
+
+        Returns
+        -------
+        ndarray
+            optimized MI in bits for each k. Shape: (len(ks), )
+        ndarray
+            optimal weights for each k. Shape: (len(ks), number of labels),
+            columns follow the order of `labels`
+        """
+        mis, weights = [], []
+        for k, neighborhood_array in zip(ks, self._neighborhoods_for_ks(ks)):
+            with self.instrumentation.stage("optimization"):
+                loss, w = weight_optimizer(neighb_count=neighborhood_array,
+                                           labels=self.label_array,
+                                           backend=self.backend,
+                                           **self._loss_trace())
+            mis.append(self._mi_from_loss(loss, k))
+            weights.append(w)
+
+        return np.array(mis), np.array(weights)
+
+
+    @property
+    def labels(self) -> list:
+        """Loaded labels, in the order of columns of neighborhood_array."""
+        return [self._index2label[i] for i in range(self._number_of_labels)]
+
+
     def calculate_weighted_mi(self, weights: dict, k: int) -> float:
         """Calculates mutual information for weighted input in bits.
 
@@ -215,42 +911,125 @@ class WeightedKraskovEstimator:
         if abs(sum(w_list) - 1) > 0.01:
             raise ValueError("Weights should sum up to 1.")
 
-        loss = weight_loss(neighb_count=self.neighborhood_array,
-                           labels=self.label_array, weights=w_list)
+        with self.instrumentation.stage("scoring"):
+            loss = weight_loss(neighb_count=self.neighborhood_array,
+                               labels=self.label_array, weights=w_list,
+                               backend=self.backend)
 
-        k = self._k
-        n = self._number_of_points_total
-        optimized_mi = digamma(k) + digamma(n) - loss
+        return self._mi_from_loss(loss, self._k)
 
-        return optimized_mi / np.log(2)
 
+    def calculate_weighted_mi_batch(self, weights_matrix: np.ndarray,
+                                    k: int) -> np.ndarray:
+        """Calculates mutual information in bits for many weight vectors.
 
-    def optimize_weights(self) -> tuple:
+        All the losses are evaluated together, reusing the neighborhoods,
+        which is much faster than calling `calculate_weighted_mi` for each
+        weight vector, e.g. when scanning the space of input distributions.
+
+        Parameters
+        ----------
+        weights_matrix : numpy array
+            weights of labels in each row, with columns ordered as `labels`.
+            Each row should sum up to 1 and contain non-negative floats.
+            Shape: (number of weight vectors, number of labels)
+        k : int
+            positive int indicating the size of the neighborhood
+
+        Returns
+        -------
+        ndarray
+            mutual information in bits for each weight vector
+        """
+        self.calculate_neighborhoods(k=k)
+
+        weights_matrix = np.atleast_2d(np.asarray(weights_matrix,
+                                                  dtype=np.float64))
+        if weights_matrix.shape[1] != self._number_of_labels:
+            raise ValueError("Expected {} weights in each row, got {}."
+                             .format(self._number_of_labels,
+                                     weights_matrix.shape[1]))
+        if (np.abs(weights_matrix.sum(axis=1) - 1) > 0.01).any():
+            raise ValueError("Weights should sum up to 1.")
+
+        with self.instrumentation.stage("scoring"):
+            losses = weight_loss_batch(neighb_count=self.neighborhood_array,
+                                       labels=self.label_array,
+                                       weights_matrix=weights_matrix,
+                                       backend=self.backend)
+
+        return self._mi_from_loss(losses, self._k)
+
+
+    def optimize_weights(self, backend: str = None,
+                         initial_weights: dict = None,
+                         return_diagnostics: bool = False,
+                         **options) -> tuple:
         """Optimizes probabilities of input distributions (weights).
 
+        Parameters
+        ----------
+        backend : str
+            name of the backend, overrides the one chosen at initialization
+        initial_weights : dict
+            dictionary mapping labels to weights the optimization starts
+            from, e.g. the optimum found for similar data. Uniform weights
+            are used by default
+        return_diagnostics : bool
+            whether to return diagnostics of the optimization as well
+        options
+            passed to the optimizer of the backend, e.g. `max_iter`,
+            `loss_tol` or `grad_tol` (see `cce.numpy_backend` and
+            `cce.tensorflow_backend`)
+
         Returns
         -------
         float
             optimized MI, in bits
         dict
             dictionary mapping labels to weights
+        dict
+            only if `return_diagnostics` is set: "iterations" (number of
+            iterations used), "gradient_norm" (final norm of the gradient
+            with respect to logits of the weights), "converged" and
+            "wall_time" (in seconds)
         """
         if self._new_data_loaded:
             raise Exception("New data have been loaded. You need to invoke calculate_neighborhoods().")
 
-        # Get loss and best weights from TensorFlow.
-        loss, w = weight_optimizer(neighb_count=self.neighborhood_array,
-                                   labels=self.label_array)
+        backend = self.backend if backend is None else backend
+
+        if return_diagnostics:
+            options["return_diagnostics"] = True
+        if initial_weights is not None:
+            options["initial_weights"] = [initial_weights[label]
+                                          for label in self.labels]
+
+        if "callback" not in options:
+            options.update(self._loss_trace())
+
+        # Get loss and best weights from the chosen backend.
+        with self.instrumentation.stage("optimization"):
+            loss, w, *diagnostics = weight_optimizer(
+                neighb_count=self.neighborhood_array, labels=self.label_array,
+                backend=backend, **options)
 
         # Get back initial labels.
         w_dict = {self._index2label[i]: w for i, w in enumerate(w)}
 
         # Just a final touch :)
-        k = self._k
-        n = self._number_of_points_total
-        optimized_mi = digamma(k) + digamma(n) - loss
+        return (self._mi_from_loss(loss, self._k), w_dict, *diagnostics)
+
+
+    def _loss_trace(self) -> dict:
+        """Options of the optimizer tracing the loss under "loss" in the
+        instrumentation, empty if the instrumentation is disabled."""
+        if not self.instrumentation.enabled:
+            return dict()
 
-        return optimized_mi / np.log(2), w_dict
+        def callback(iteration, loss, weights):
+            self.instrumentation.trace("loss", float(loss))
+        return {"callback": callback}
 
 
     def _turn_into_neigh_list(self, indices, special_point_label):
@@ -295,11 +1074,206 @@ class WeightedKraskovEstimator:
         if not self._new_data_loaded and k == self._k:
             return
 
-        # ...otherwise we need to recalculate everything.
+        # ...otherwise we need to recalculate everything, unless it is in the
+        # on-disk cache.
         self._k = k
-        epses = [self.tree_full.query(datum, k=k+1,
-                                      distance_upper_bound=self._huge_dist)[0][-1]
-                 for datum in self._immersed_data_full]
+        key = None
+        if self._fingerprint is not None:
+            settings = {"neighborhood_method": self.neighborhood_method,
+                        "sparse": self.sparse,
+                        "approximation": self.approximation,
+                        "compact": self.compact,
+                        "spatial_order": self.spatial_order}
+            key = self.cache.key(self._fingerprint, k, settings)
+            entry = self.cache.load(key)
+            if entry is not None:
+                self.instrumentation.count("cache_hits")
+                self.neighborhood_array = entry["neighborhood_array"]
+                self._epsilon_array = entry["epsilon_array"]
+                self._new_data_loaded = False
+                return
+
+        if self._out_of_core is not None:
+            with self.instrumentation.stage("neighborhoods"):
+                self._epsilon_array, self.neighborhood_array = \
+                    self._chunked_neighborhoods(k)
+        elif self.neighborhood_method == "count" and self.processes != 1:
+            with self.instrumentation.stage("neighborhoods"):
+                epsilons, neighborhood_arrays = self._count_in_processes([k])
+            self._epsilon_array = epsilons[:, 0]
+            self.neighborhood_array = neighborhood_arrays[0]
+        elif self.neighborhood_method == "count":
+            self._epsilon_array = self._epsilons([k])[:, 0]
+            with self.instrumentation.stage("ball_counting"):
+                self.neighborhood_array = count_neighborhoods(
+                    self.label_trees, self._immersed_data_coordinates,
+                    self.label_array, self._epsilon_array,
+                    workers=self.workers, sparse=self.sparse,
+                    approximation=self.approximation, same_label_count=k,
+                    dtype=self._counts_type(),
+                    instrumentation=self.instrumentation)
+        else:
+            with self.instrumentation.stage("neighborhoods"):
+                self._epsilon_array, self.neighborhood_array = \
+                    self._list_neighborhoods(k)
+        self._record_ball_size(self.neighborhood_array)
+
+        if key is not None:
+            self.cache.store(key, self.neighborhood_array, self.label_array,
+                             self._epsilon_array, self.labels)
+
+        # Turn off the flag with fresh data.
+        self._new_data_loaded = False
+
+
+    def _count_in_processes(self, ks: list) -> tuple:
+        """Finds epsilons and counts neighborhoods for many values of k in a
+        pool of worker processes, see `cce.parallel`."""
+        return count_neighborhoods_parallel(
+            self._immersed_data_coordinates, self.label_array,
+            self._number_of_labels, ks, processes=self.processes,
+            leaf_size=self.leaf_size, sparse=self.sparse,
+            approximation=self.approximation, dtype=self._counts_type())
+
+
+    def _epsilons(self, ks: list) -> np.ndarray:
+        """Distances to the k-th nearest point with the same label, for each
+        point and each k, found with batched queries in the label trees.
+
+        Returns
+        -------
+        ndarray
+            epsilons of shape (number of points, len(ks))
+        """
+        # The trees are built (and timed) before the queries.
+        label_trees = self.label_trees
+        self.instrumentation.count("epsilon_queries",
+                                   self._number_of_points_total * len(ks))
+        with self.instrumentation.stage("epsilons"):
+            return label_epsilons(label_trees,
+                                  self._immersed_data_coordinates,
+                                  self.label_array, ks, workers=self.workers,
+                                  approximation=self.approximation)
+
+
+    def _record_ball_size(self, neighborhood_array):
+        """Records the average number of neighbors in a ball (excluding the
+        point itself) in the instrumentation."""
+        if self.instrumentation.enabled:
+            self.instrumentation.record(
+                "average_ball_size",
+                float(neighborhood_array.sum()) / self._number_of_points_total)
+
+
+    def _neighborhoods_for_ks(self, ks: list) -> list:
+        """Prepares neighborhood arrays for many values of k at once.
+
+        Returns
+        -------
+        list
+            neighborhood array for each k
+        """
+        self._check_if_data_are_loaded()
+
+        if self._out_of_core is not None:
+            with self.instrumentation.stage("neighborhoods"):
+                return [self._chunked_neighborhoods(k)[1] for k in ks]
+        if self.neighborhood_method == "list":
+            with self.instrumentation.stage("neighborhoods"):
+                return [self._list_neighborhoods(k)[1] for k in ks]
+        if self.processes != 1:
+            with self.instrumentation.stage("neighborhoods"):
+                return self._count_in_processes(ks)[1]
+
+        epsilons = self._epsilons(ks)
+        with self.instrumentation.stage("ball_counting"):
+            return count_neighborhoods_multi(
+                self.label_trees, self._immersed_data_coordinates,
+                self.label_array, epsilons, workers=self.workers,
+                sparse=self.sparse, approximation=self.approximation,
+                same_label_counts=list(ks), dtype=self._counts_type(),
+                instrumentation=self.instrumentation)
+
+
+    def approximation_report(self, k: int, sample_size: int = 1000,
+                             seed: int = None) -> dict:
+        """Measures the error of approximate tree queries on a sample.
+
+        Neighborhoods of a random sample of points are counted exactly and
+        compared with the approximate ones. MI is a mean over points, so the
+        mean difference of the contributions of the sampled points estimates
+        the deviation of the approximate MI from the exact one, at a small
+        fraction of the cost of the exact calculation.
+
+        Parameters
+        ----------
+        k : int
+            free parameter in Kraskov estimator
+        sample_size : int
+            number of points counted exactly
+        seed : int
+            seed of the random choice of points
+
+        Returns
+        -------
+        dict
+            "mi_deviation": estimated approximate minus exact MI, in bits,
+            "standard_error" of this estimate, "epsilon_error": largest
+            relative error of the epsilons in the sample, "exact_fraction":
+            fraction of the sampled points whose neighborhoods are counted
+            exactly, and "sample_size"
+        """
+        self._check_if_data_are_in_memory()
+        self.calculate_neighborhoods(k=k)
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(sample_size, self._number_of_points_total)
+        sample = np.sort(rng.choice(self._number_of_points_total,
+                                    sample_size, replace=False))
+        coordinates = self._immersed_data_coordinates[sample]
+        label_array = self.label_array[sample]
+
+        epsilons = label_epsilons(self.label_trees, coordinates, label_array,
+                                  [k], workers=self.workers)[:, 0]
+        exact = count_neighborhoods(self.label_trees, coordinates,
+                                    label_array, epsilons,
+                                    workers=self.workers)
+        approximate = self.neighborhood_array[sample]
+        if self.sparse:
+            approximate = approximate.toarray()
+
+        # Only the numbers of neighbors of all labels differ in MI.
+        differences = (digamma(exact.sum(axis=1))
+                       - digamma(approximate.sum(axis=1))) / np.log(2)
+        standard_error = (differences.std(ddof=1) / np.sqrt(sample_size)
+                          if sample_size > 1 else np.nan)
+        return {"mi_deviation": differences.mean(),
+                "standard_error": standard_error,
+                "epsilon_error": np.nanmax(self._epsilon_array[sample]
+                                           / epsilons - 1),
+                "exact_fraction": np.mean((exact == approximate).all(axis=1)),
+                "sample_size": sample_size}
+
+
+    def _list_neighborhoods(self, k: int) -> np.ndarray:
+        """Prepares neighborhood_array point by point, using lists of indices
+        of the neighbors.
+
+        Parameters
+        ----------
+        k : int
+            free parameter in Kraskov estimator
+
+        Returns
+        -------
+        ndarray
+            epsilons
+        ndarray or csr_matrix
+            neighborhood array
+        """
+        epses = [self.label_trees[label].query(coord, k=k+1)[0][-1]
+                 for label, coord in zip(self.label_array,
+                                         self._immersed_data_coordinates)]
 
         neighs = [
             self._turn_into_neigh_list(
@@ -307,7 +1281,7 @@ class WeightedKraskovEstimator:
                 self.label_array[i])
             for i, coord in enumerate(self._immersed_data_coordinates)]
 
-        self.neighborhood_array = np.array(neighs)
-
-        # Turn off the flag with fresh data.
-        self._new_data_loaded = False
+        neighs = np.array(neighs, dtype=self._counts_type())
+        if self.sparse:
+            return np.array(epses), csr_matrix(neighs)
+        return np.array(epses), neighs
@@ -0,0 +1,208 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Timers, counters and traces of the stages of the estimation
+
+An estimator created with an `Instrumentation` reports how long its stages
+take (preprocessing, tree construction, epsilon queries, ball counting,
+scoring and optimization), counts tree queries, records the average ball
+size and traces the loss during optimization. Every measurement is also
+sent as an event (a dictionary) to the registered sinks, e.g. a callback
+or a `JSONLinesSink`. Estimators without instrumentation use `DISABLED`,
+whose methods do nothing.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+class Instrumentation:
+    """Collects metrics of an estimator and sends them to sinks.
+
+    Parameters
+    ----------
+    sinks : list
+        callables receiving every event, see `add_sink`
+    memory : bool
+        whether to measure peak memory of the stages. Allocations are then
+        traced with `tracemalloc`, which slows down the estimation
+    """
+
+    enabled = True
+
+    def __init__(self, sinks: list = (), memory: bool = False):
+        self.sinks = list(sinks)
+        self.memory = memory
+        self.stages = defaultdict(lambda: {"calls": 0, "seconds": 0.,
+                                           "peak_bytes": 0})
+        self.counters = defaultdict(int)
+        self.gauges = dict()
+        self.traces = defaultdict(list)
+        # traced memory at the start and peak traced memory of each stage
+        # in progress, the innermost one last
+        self._peaks = []
+
+
+    def add_sink(self, sink):
+        """Registers a callable receiving every event.
+
+        Events are dictionaries with keys "event" ("stage", "counter",
+        "gauge" or "trace"), "name", "time" and the measured values:
+        "seconds", "peak_bytes" and "max_rss_bytes" for stages, "value"
+        for the others (and "step" for traces).
+        """
+        self.sinks.append(sink)
+
+
+    def _emit(self, event: dict):
+        event["time"] = time.time()
+        for sink in self.sinks:
+            sink(event)
+
+
+    @contextmanager
+    def stage(self, name: str):
+        """Context manager timing a stage (and measuring its peak memory).
+
+        The peak memory of a stage is the largest amount of memory
+        allocated during the stage on top of what was allocated before it.
+        Stages may be nested.
+        """
+        started_tracing = False
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak of an enclosing stage is kept before it is reset.
+            if self._peaks:
+                self._peaks[-1][1] = max(self._peaks[-1][1], peak)
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            self._peaks.append([current, current])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = 0
+            if self.memory:
+                start_memory, peak = self._peaks.pop()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1][1] = max(self._peaks[-1][1], peak)
+                # Memory allocated before the stage is not counted.
+                peak -= start_memory
+            if started_tracing:
+                tracemalloc.stop()
+
+            stage = self.stages[name]
+            stage["calls"] += 1
+            stage["seconds"] += seconds
+            stage["peak_bytes"] = max(stage["peak_bytes"], peak)
+            self._emit({"event": "stage", "name": name, "seconds": seconds,
+                        "peak_bytes": peak, "max_rss_bytes": _max_rss()})
+
+
+    def count(self, name: str, value: int = 1):
+        """Adds `value` to a counter."""
+        self.counters[name] += value
+        self._emit({"event": "counter", "name": name, "value": value})
+
+
+    def record(self, name: str, value: float):
+        """Sets the value of a gauge, e.g. the average ball size."""
+        self.gauges[name] = value
+        self._emit({"event": "gauge", "name": name, "value": value})
+
+
+    def trace(self, name: str, value: float):
+        """Appends a value to a trace, e.g. the loss in each iteration."""
+        self.traces[name].append(value)
+        self._emit({"event": "trace", "name": name,
+                    "step": len(self.traces[name]) - 1, "value": value})
+
+
+    def summary(self) -> dict:
+        """Returns all the metrics collected so far.
+
+        Returns
+        -------
+        dict
+            with keys "stages" (number of calls, total time in seconds and
+            peak memory in bytes of each stage), "counters", "gauges",
+            "traces" (lists of values) and "max_rss_bytes" (peak resident
+            memory of the process)
+        """
+        return {"stages": {name: dict(stage)
+                           for name, stage in self.stages.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "traces": {name: list(values)
+                           for name, values in self.traces.items()},
+                "max_rss_bytes": _max_rss()}
+
+
+    def reset(self):
+        """Forgets the metrics collected so far (sinks are kept)."""
+        self.stages.clear()
+        self.counters.clear()
+        self.gauges.clear()
+        self.traces.clear()
+
+
+class _DisabledInstrumentation:
+    """Instrumentation which does nothing, used by default."""
+
+    enabled = False
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+    def record(self, name: str, value: float):
+        pass
+
+    def trace(self, name: str, value: float):
+        pass
+
+
+DISABLED = _DisabledInstrumentation()
+
+
+class JSONLinesSink:
+    """Sink writing every event as a line of JSON.
+
+    Parameters
+    ----------
+    file : file object
+        text file, e.g. opened with `open(path, "a")` or `sys.stderr`
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def __call__(self, event: dict):
+        self.file.write(json.dumps(event, default=float) + "\n")
+        self.file.flush()
+
+
+def _max_rss() -> int:
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes.
+    return max_rss if sys.platform == "darwin" else 1024 * max_rss
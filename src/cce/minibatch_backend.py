@@ -0,0 +1,220 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Stochastic minibatch optimization of weights for very large data
+
+Every iteration of the full-batch optimizers evaluates the loss and its
+gradient on all the rows of the neighborhood array. Here an iteration uses
+a minibatch of rows instead, drawn separately from the points of each
+label in proportion to their numbers (stratified sampling), which gives an
+unbiased estimate of the gradient at a cost independent of the number of
+points. Exponentiated gradient steps, as in `cce.numpy_backend`, are then
+taken with one of the following variance reduction methods:
+
+    "svrg"     every epoch, the full gradient is calculated at a snapshot
+               of the weights, and minibatch gradients are corrected by
+               their value at the snapshot (stochastic variance reduced
+               gradient). Steps are constant and the full gradient stops
+               the optimization once the weights are close to optimal
+    "average"  steps decrease as 1 / sqrt(iteration) and the weights are
+               averaged over the iterations
+    None       plain stochastic steps of decreasing size
+
+The weights are finally polished with a few full-batch iterations of
+`cce.numpy_backend.weight_optimizer`, which also give the loss on all the
+data. Losses are calculated as in `cce.numpy_backend`.
+"""
+
+import numpy as np
+from cce import numpy_backend
+from cce.numpy_backend import (weight_loss, weight_loss_batch,
+                               _loss_and_gradient, _label_counts,
+                               _MIN_WEIGHT)
+
+__all__ = ["weight_loss", "weight_loss_batch", "weight_optimizer"]
+
+# variance reduction methods, see the module docstring
+_variance_reductions = ("svrg", "average", None)
+
+
+def _stratified_sampler(labels: np.ndarray, label_counts: np.ndarray,
+                        batch_size: int, rng: np.random.Generator):
+    """Returns a function drawing rows of a stratified minibatch, with
+    their labels and the number of points each of them stands for."""
+    order = np.argsort(labels, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(label_counts)[:-1]]).astype(int)
+
+    # Every label with points gets at least one row of the minibatch.
+    sizes = np.minimum(np.maximum(np.round(
+        batch_size * label_counts / label_counts.sum()), 1), label_counts)
+    sizes = sizes.astype(int)
+    sample_labels = np.repeat(np.arange(len(label_counts)), sizes)
+    scale = (label_counts / np.maximum(sizes, 1))[sample_labels]
+
+    def sample():
+        # Rows are drawn with replacement, which keeps estimates unbiased.
+        offsets = np.floor(rng.random(len(sample_labels))
+                           * label_counts[sample_labels]).astype(int)
+        return order[starts[sample_labels] + offsets], sample_labels, scale
+
+    return sample
+
+
+def weight_optimizer(neighb_count, labels: np.ndarray,
+                     batch_size: int = 4096, max_iter: int = 2000,
+                     step_size: float = 1., variance_reduction: str = "svrg",
+                     epoch_length: int = None, tol: float = 1e-4,
+                     polish_iter: int = 50, seed: int = None,
+                     initial_weights: list = None,
+                     return_diagnostics: bool = False, callback=None,
+                     **polish_options) -> tuple:
+    """Returns loss and optimized weights for given neighbors description,
+    found with minibatch steps and polished on all the data.
+
+    Parameters
+    ----------
+    neighb_count : numpy array or scipy sparse matrix
+        describes for each point the number of neighbors with each label.
+        Shape: (# of data points, # of labels)
+
+    labels : numpy array of shape (# of data points, )
+        label for each point
+
+    batch_size : int
+        number of rows in a minibatch, drawn from the points of every label
+        in proportion to their number (at least one of each label)
+
+    max_iter : int
+        maximal number of minibatch steps
+
+    step_size : float
+        size of the exponentiated gradient steps; with "average" or no
+        variance reduction, the step of iteration t is
+        step_size / sqrt(t + 1)
+
+    variance_reduction : str
+        "svrg", "average" or None, see the module docstring
+
+    epoch_length : int
+        number of minibatch steps between full gradients of "svrg",
+        by default the number of minibatches covering all the points
+
+    tol : float
+        "svrg" stops when the duality gap at a snapshot, which bounds the
+        distance of its loss from the optimum, drops below `tol`
+
+    polish_iter : int
+        maximal number of full-batch iterations finishing the optimization
+
+    seed : int
+        seed of the random choice of minibatches
+
+    initial_weights : list
+        weights of labels to start from, uniform by default
+
+    return_diagnostics : bool
+        whether to return diagnostics as well
+
+    callback : callable
+        called as `callback(iteration, loss, weights)` after every
+        minibatch step, with the minibatch estimate of the loss, and after
+        every full-batch iteration, with the loss on all the data
+
+    polish_options
+        passed to the full-batch `cce.numpy_backend.weight_optimizer`, e.g.
+        its tolerances
+
+    Returns
+    -------
+    float
+        loss on all the data
+    ndarray
+        weight for each label
+    dict
+        only if `return_diagnostics` is set: "iterations" (minibatch steps),
+        "full_gradients" (full gradients calculated by "svrg"),
+        "polish_iterations", "gradient_norm" (final norm of the gradient
+        with respect to logits) and "converged" (whether the full-batch
+        polish met a stopping criterion)
+    """
+    if variance_reduction not in _variance_reductions:
+        raise ValueError("Unknown variance reduction: {}. Available: {}."
+                         .format(variance_reduction,
+                                 ", ".join(map(str, _variance_reductions))))
+
+    num_data, num_labels = neighb_count.shape
+    label_counts = _label_counts(labels, num_labels)
+    sample = _stratified_sampler(labels, label_counts, batch_size,
+                                 np.random.default_rng(seed))
+    if epoch_length is None:
+        epoch_length = max(1, num_data // batch_size)
+
+    def minibatch_gradient(rows, sample_labels, scale, w):
+        return _loss_and_gradient(neighb_count[rows], sample_labels,
+                                  label_counts, w, num_data=num_data,
+                                  scale=scale)
+
+    def step(w, gradient, size):
+        new_w = w * np.exp(-size * (gradient - gradient.min()))
+        new_w = np.maximum(new_w / new_w.sum(), _MIN_WEIGHT)
+        return new_w / new_w.sum()
+
+    if initial_weights is None:
+        w = np.full(num_labels, 1. / num_labels)
+    else:
+        w = np.maximum(np.asarray(initial_weights, dtype=np.float64),
+                       _MIN_WEIGHT)
+        w /= w.sum()
+    average = w.copy()
+    steps_total = 0.
+    full_gradients = 0
+    iterations = 0
+
+    while iterations < max_iter:
+        if variance_reduction == "svrg" and iterations % epoch_length == 0:
+            snapshot = w
+            _, snapshot_gradient = _loss_and_gradient(
+                neighb_count, labels, label_counts, snapshot)
+            full_gradients += 1
+            if snapshot_gradient @ w - snapshot_gradient.min() < tol:
+                break
+
+        rows, sample_labels, scale = sample()
+        loss, gradient = minibatch_gradient(rows, sample_labels, scale, w)
+        if variance_reduction == "svrg":
+            gradient = (gradient + snapshot_gradient
+                        - minibatch_gradient(rows, sample_labels, scale,
+                                             snapshot)[1])
+            size = step_size
+        else:
+            size = step_size / np.sqrt(iterations + 1)
+
+        w = step(w, gradient, size)
+        iterations += 1
+        if variance_reduction == "average":
+            # Iterates are averaged with the sizes of their steps.
+            steps_total += size
+            average += size / steps_total * (w - average)
+        if callback is not None:
+            callback(iterations, loss, w)
+
+    if variance_reduction == "average":
+        w = average
+
+    polish_callback = None
+    if callback is not None:
+        def polish_callback(iteration, loss, weights):
+            callback(iterations + iteration, loss, weights)
+
+    loss, w, diagnostics = numpy_backend.weight_optimizer(
+        neighb_count, labels, max_iter=polish_iter, initial_weights=w,
+        return_diagnostics=True, callback=polish_callback, **polish_options)
+
+    if not return_diagnostics:
+        return loss, w
+    return loss, w, {"iterations": iterations,
+                     "full_gradients": full_gradients,
+                     "polish_iterations": diagnostics["iterations"],
+                     "gradient_norm": diagnostics["gradient_norm"],
+                     "converged": diagnostics["converged"]}
@@ -0,0 +1,313 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Batched counting of neighborhoods used by the Kraskov estimator"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+from cce.instrumentation import DISABLED
+
+
+def build_label_trees(coordinates: np.ndarray, label_array: np.ndarray,
+                      number_of_labels: int, leaf_size: int = 16) -> list:
+    """Builds a separate k-d tree for the points of every label.
+
+    If points are grouped by label (i.e. `label_array` is sorted), the trees
+    are built on views of `coordinates` and share its memory, provided it
+    is a C-contiguous float64 array. Otherwise every tree keeps a copy of
+    the points of its label.
+
+    Parameters
+    ----------
+    coordinates : numpy array
+        coordinates of all points. Shape: (number of points, dimension)
+    label_array : numpy array
+        label index of each point. Shape: (number of points, )
+    number_of_labels : int
+        number of different labels, i.e. label indices are
+        0, 1, ..., number_of_labels - 1
+    leaf_size : int
+        positive integer, used for tree construction
+
+    Returns
+    -------
+    list
+        k-d tree with the points of label `i` at position `i`
+    """
+    if np.all(label_array[:-1] <= label_array[1:]):
+        bounds = np.searchsorted(label_array, np.arange(number_of_labels + 1))
+        return [cKDTree(coordinates[start:stop], leafsize=leaf_size)
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+    return [cKDTree(coordinates[label_array == label], leafsize=leaf_size)
+            for label in range(number_of_labels)]
+
+
+def label_epsilons(label_trees: list, coordinates: np.ndarray,
+                   label_array: np.ndarray, ks: list, workers: int = -1,
+                   approximation: float = 0.) -> np.ndarray:
+    """Finds distances to the k-th nearest point with the same label.
+
+    Points of each label are queried at once in the tree of that label.
+
+    Parameters
+    ----------
+    label_trees : list
+        k-d trees built by `build_label_trees`
+    coordinates : numpy array
+        coordinates of all points. Shape: (number of points, dimension)
+    label_array : numpy array
+        label index of each point. Shape: (number of points, )
+    ks : list
+        values of k
+    workers : int
+        number of threads used by the tree queries, -1 means all cores
+    approximation : float
+        non-negative relative error allowed in the queries (`eps` of
+        `cKDTree.query`): the epsilons found are at most
+        1 + approximation times larger than the exact ones
+
+    Returns
+    -------
+    ndarray
+        epsilons of shape (number of points, len(ks)). They are infinite
+        for points of labels with at most k points.
+    """
+    epsilons = np.empty((len(coordinates), len(ks)))
+    for label, tree in enumerate(label_trees):
+        points = label_array == label
+        if tree.n == 0 or not points.any():
+            continue
+        # The nearest point is the point itself.
+        epsilons[points] = tree.query(coordinates[points],
+                                      k=[k + 1 for k in ks],
+                                      eps=approximation,
+                                      workers=workers)[0]
+    return epsilons
+
+
+def _balls_reaching_box(coordinates: np.ndarray, epsilons: np.ndarray,
+                        mins: np.ndarray, maxes: np.ndarray) -> np.ndarray:
+    """Returns indices of points whose balls intersect a given box."""
+    gaps = (np.maximum(mins - coordinates, 0)
+            + np.maximum(coordinates - maxes, 0))
+    # The margin makes sure that rounding errors do not exclude any ball.
+    return np.flatnonzero(np.einsum("ij,ij->i", gaps, gaps)
+                          <= (epsilons * (1 + 1e-9))**2)
+
+
+def count_tree_neighbors(tree: cKDTree, coordinates: np.ndarray,
+                         epsilons: np.ndarray, workers: int = -1,
+                         approximation: float = 0.,
+                         instrumentation=DISABLED) -> np.ndarray:
+    """Counts points of a tree lying in the epsilon-balls of query points.
+
+    Points whose balls do not reach the bounding box of the tree are not
+    queried at all.
+
+    Parameters
+    ----------
+    tree : cKDTree
+        tree with points to be counted
+    coordinates : numpy array
+        coordinates of the query points. Shape: (number of points, dimension)
+    epsilons : numpy array
+        radius of the ball around each query point, or several radii for
+        each of them. Shape: (number of points, ) or
+        (number of points, number of radii)
+    workers : int
+        number of threads used by the tree queries, -1 means all cores
+    approximation : float
+        non-negative relative error allowed in the queries (`eps` of
+        `cKDTree.query_ball_point`): points closer than
+        radius / (1 + approximation) are always counted and points farther
+        than radius * (1 + approximation) never are
+    instrumentation : Instrumentation
+        counts the ball queries issued under "ball_queries", see
+        `cce.instrumentation`
+
+    Returns
+    -------
+    ndarray
+        integer counts, of the same shape as `epsilons`
+    """
+    counts = np.zeros(epsilons.shape, dtype=np.int64)
+    if tree.n == 0:
+        return counts
+
+    radii = epsilons if epsilons.ndim == 1 else epsilons.max(axis=1)
+    candidates = _balls_reaching_box(coordinates, radii,
+                                     tree.mins, tree.maxes)
+    # Each radius of a point is a separate query.
+    instrumentation.count("ball_queries", len(candidates)
+                          * (1 if epsilons.ndim == 1 else epsilons.shape[1]))
+    points = coordinates[candidates]
+    if epsilons.ndim == 2:
+        # Each point is repeated for each of its radii.
+        points = np.broadcast_to(points[:, np.newaxis, :],
+                                 epsilons[candidates].shape
+                                 + (coordinates.shape[1], ))
+
+    counts[candidates] = tree.query_ball_point(
+        points, epsilons[candidates], eps=approximation, return_length=True,
+        workers=workers)
+    return counts
+
+
+def count_neighborhoods(label_trees: list, coordinates: np.ndarray,
+                        label_array: np.ndarray, epsilons: np.ndarray,
+                        workers: int = -1, sparse: bool = False,
+                        approximation: float = 0., same_label_count: int = None,
+                        dtype=np.float64, instrumentation=DISABLED):
+    """Counts neighbors of each label lying in the epsilon-ball of each point.
+
+    For every label a single, count-only ball query is issued for all the
+    points at once, so that neither Python-level loops over points nor
+    lists of neighbor indices are needed. Points whose balls do not reach
+    the bounding box of a label are not queried against its tree at all.
+
+    Parameters
+    ----------
+    label_trees : list
+        k-d trees with points of each label, as built by `build_label_trees`
+    coordinates : numpy array
+        coordinates of the query points. Shape: (number of points, dimension)
+    label_array : numpy array
+        label index of each query point. Shape: (number of points, )
+    epsilons : numpy array
+        radius of the ball around each query point.
+        Shape: (number of points, )
+    workers : int
+        number of threads used by the tree queries, -1 means all cores
+    sparse : bool
+        whether to return the neighborhood array as a CSR matrix, storing
+        only non-zero counts. Useful when there are many labels
+    approximation : float
+        non-negative relative error allowed in the ball queries, see
+        `count_tree_neighbors`
+    same_label_count : int
+        number of neighbors with the same label, i.e. k, required if
+        `approximation` is positive, see `count_neighborhoods_multi`
+    dtype : data-type
+        type of the counts in the neighborhood array
+    instrumentation : Instrumentation
+        counts the ball queries, see `count_tree_neighbors`
+
+    Returns
+    -------
+    ndarray or csr_matrix
+        neighborhood array of shape (number of points, number of labels).
+        The query point itself is not counted.
+    """
+    return count_neighborhoods_multi(label_trees, coordinates, label_array,
+                                     epsilons[:, np.newaxis], workers=workers,
+                                     sparse=sparse,
+                                     approximation=approximation,
+                                     same_label_counts=[same_label_count],
+                                     dtype=dtype,
+                                     instrumentation=instrumentation)[0]
+
+
+def count_neighborhoods_multi(label_trees: list, coordinates: np.ndarray,
+                              label_array: np.ndarray, epsilons: np.ndarray,
+                              workers: int = -1, sparse: bool = False,
+                              approximation: float = 0.,
+                              same_label_counts: list = None,
+                              dtype=np.float64,
+                              instrumentation=DISABLED) -> list:
+    """Counts neighborhoods for several radii around each point at once.
+
+    This is `count_neighborhoods` for many values of k: every label's tree
+    is still queried only once, with all the radii of a point together.
+
+    With a positive `approximation`, points are not queried in the tree of
+    their own label at all, since an approximate ball could miss the very
+    neighbors which define its radius. Exactly k of them lie in the ball
+    instead (as for the exact query of distinct points), given for each
+    radius in `same_label_counts`.
+
+    Parameters
+    ----------
+    label_trees : list
+        k-d trees with points of each label, as built by `build_label_trees`
+    coordinates : numpy array
+        coordinates of the query points. Shape: (number of points, dimension)
+    label_array : numpy array
+        label index of each query point. Shape: (number of points, )
+    epsilons : numpy array
+        radii of the balls around each query point.
+        Shape: (number of points, number of radii)
+    workers : int
+        number of threads used by the tree queries, -1 means all cores
+    sparse : bool
+        whether to return neighborhood arrays as CSR matrices
+    approximation : float
+        non-negative relative error allowed in the ball queries, see
+        `count_tree_neighbors`
+    same_label_counts : list
+        number of neighbors with the same label (k) for each radius,
+        required if `approximation` is positive
+    dtype : data-type
+        type of the counts in the neighborhood arrays
+    instrumentation : Instrumentation
+        counts the ball queries, see `count_tree_neighbors`
+
+    Returns
+    -------
+    list
+        neighborhood array (see `count_neighborhoods`) for each radius
+    """
+    number_of_points, number_of_radii = epsilons.shape
+    shape = (number_of_points, len(label_trees))
+    if approximation and same_label_counts is None:
+        raise ValueError("Approximate counting requires same_label_counts.")
+
+    if not sparse:
+        neighborhood_arrays = np.zeros((number_of_radii,) + shape,
+                                       dtype=dtype)
+
+    rows, columns, radii, counts = [], [], [], []
+
+    for label, tree in enumerate(label_trees):
+        if tree.n == 0:
+            continue
+        own = label_array == label
+        if approximation:
+            column = np.empty(epsilons.shape, dtype=np.int64)
+            column[~own] = count_tree_neighbors(
+                tree, coordinates[~own], epsilons[~own], workers=workers,
+                approximation=approximation, instrumentation=instrumentation)
+            column[own] = same_label_counts
+        else:
+            column = count_tree_neighbors(tree, coordinates, epsilons,
+                                          workers=workers,
+                                          instrumentation=instrumentation)
+
+            # Every point lies in its own ball, so we need to subtract it.
+            column[own] -= 1
+
+        if sparse:
+            nonzero_rows, nonzero_radii = np.nonzero(column)
+            rows.append(nonzero_rows)
+            columns.append(np.full(len(nonzero_rows), label))
+            radii.append(nonzero_radii)
+            counts.append(column[nonzero_rows, nonzero_radii])
+        else:
+            neighborhood_arrays[:, :, label] = column.T
+
+    if not sparse:
+        return list(neighborhood_arrays)
+
+    if not rows:
+        return [csr_matrix(shape, dtype=dtype)
+                for _ in range(number_of_radii)]
+
+    rows, columns, radii, counts = (np.concatenate(x)
+                                    for x in (rows, columns, radii, counts))
+    counts = counts.astype(dtype)
+
+    return [csr_matrix((counts[radii == r], (rows[radii == r],
+                                             columns[radii == r])),
+                       shape=shape)
+            for r in range(number_of_radii)]
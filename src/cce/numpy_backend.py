@@ -0,0 +1,342 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Loss and weight optimization implemented in NumPy
+
+The loss is the same as in the TensorFlow implementation, i.e. for
+weights w, label counts c and neighborhood counts N it reads
+
+    sum_j w_j digamma(n w_j) + sum_i w_l(i) / c_l(i) digamma(n_y(i)),
+
+where n_y(i) = c_l(i) / w_l(i) * sum_j N_ij w_j / c_j. Its gradient is
+known in closed form, so the loss can be minimized over the probability
+simplex with exponentiated gradient (mirror descent) steps. The resulting
+multiplicative update is the one of the Blahut-Arimoto algorithm, with the
+step size chosen by backtracking line search. The optimization stops when
+the Frank-Wolfe duality gap, which bounds the distance between the current
+and the optimal loss, drops below the tolerance or when the loss stops
+decreasing.
+"""
+
+import numpy as np
+from scipy.special import digamma
+
+# parameter of the sufficient decrease (Armijo) condition
+_ARMIJO = 1e-4
+# bounds on the step size of the exponentiated gradient method
+_MIN_STEP = 1e-12
+_MAX_STEP = 1e6
+# weights are kept above this value to avoid division by zero
+_MIN_WEIGHT = 1e-12
+# batched losses are evaluated for as many weight vectors at once as fit
+# into arrays with this number of elements
+_BATCH_ELEMENTS = 2**24
+# neighborhood arrays with compact (e.g. integer) counts are multiplied in
+# blocks of rows with about this number of elements, converted to float64
+_BLOCK_ELEMENTS = 2**18
+
+
+def _trigamma(x: np.ndarray) -> np.ndarray:
+    """Trigamma function, i.e. the derivative of digamma.
+
+    Faster than `scipy.special.polygamma(1, x)`, which is the bottleneck of
+    the gradient evaluation otherwise. Arguments are shifted above 10 using
+    the recurrence relation, where the asymptotic expansion is accurate to
+    double precision.
+    """
+    x = np.array(x, dtype=np.float64)
+    result = np.zeros_like(x)
+
+    small = x < 10
+    while small.any():
+        result[small] += 1. / x[small]**2
+        x[small] += 1
+        small = x < 10
+
+    x_inv = 1. / x
+    x_inv2 = x_inv * x_inv
+    return result + x_inv + x_inv2 / 2 + x_inv * x_inv2 * (
+        1/6 - x_inv2 * (1/30 - x_inv2 * (1/42 - x_inv2 / 30)))
+
+
+def _blocks(neighb_count) -> list:
+    """Slices of rows of a neighborhood array with compact counts, or None
+    for float64 counts, which are multiplied at once."""
+    if neighb_count.dtype == np.float64:
+        return None
+    num_data, num_labels = neighb_count.shape
+    block_size = max(1, _BLOCK_ELEMENTS // max(num_labels, 1))
+    return [slice(start, start + block_size)
+            for start in range(0, num_data, block_size)]
+
+
+def _product(neighb_count, x: np.ndarray) -> np.ndarray:
+    """Returns neighb_count @ x, without converting all the counts to float64
+    at once (NumPy would make a temporary float64 copy of the array)."""
+    blocks = _blocks(neighb_count)
+    if blocks is None:
+        return neighb_count @ x
+    return np.concatenate([neighb_count[block].astype(np.float64) @ x
+                           for block in blocks])
+
+
+def _transposed_product(neighb_count, y: np.ndarray) -> np.ndarray:
+    """Returns neighb_count.T @ y, see `_product`."""
+    blocks = _blocks(neighb_count)
+    if blocks is None:
+        return neighb_count.T @ y
+    result = np.zeros(neighb_count.shape[1])
+    for block in blocks:
+        result += neighb_count[block].astype(np.float64).T @ y[block]
+    return result
+
+
+def _label_counts(labels: np.ndarray, num_labels: int) -> np.ndarray:
+    return np.bincount(labels, minlength=num_labels).astype(np.float64)
+
+
+def _label_terms(weights: np.ndarray, num_data: int) -> np.ndarray:
+    """Returns digamma(weights * num_data) * weights, set to zero for zero
+    weights, so that labels with zero weight drop out of the loss."""
+    positive = weights > 0
+    return np.where(positive,
+                    digamma(np.where(positive, weights, 1.) * num_data)
+                    * weights, 0.)
+
+
+def _loss_and_gradient(neighb_count, labels: np.ndarray,
+                       label_counts: np.ndarray, weights: np.ndarray,
+                       compute_gradient: bool = True, num_data: int = None,
+                       scale: np.ndarray = None) -> tuple:
+    # For a sample of the points, `num_data` is the number of all the points
+    # and `scale` is the number of points each sampled point stands for,
+    # which makes the loss and its gradient unbiased estimates.
+    if num_data is None:
+        num_data = len(labels)
+
+    nx = weights * num_data
+    w_list = weights[labels]
+    label_cnts_list = label_counts[labels]
+    # Points of labels with zero weight drop out of the loss, since their
+    # terms are multiplied by the weight. Their ny is set to 1 instead of
+    # dividing by zero. (The optimizers keep all the weights positive.)
+    dropped = w_list == 0
+    ny = label_cnts_list / np.where(dropped, 1., w_list) * _product(
+        neighb_count, weights / label_counts)
+    ny[dropped] = 1.
+    digamma_ny = digamma(ny)
+    point_terms = digamma_ny if scale is None else digamma_ny * scale
+
+    loss = (np.sum(_label_terms(weights, num_data))
+            + np.sum(point_terms * w_list / label_cnts_list))
+
+    if not compute_gradient:
+        return loss, None
+
+    trigamma_ny = _trigamma(ny)
+    own_terms = digamma_ny - ny * trigamma_ny
+    if scale is not None:
+        own_terms *= scale
+        trigamma_ny *= scale
+    own_label = np.bincount(labels, weights=own_terms,
+                            minlength=len(weights))
+    gradient = (digamma(nx) + nx * _trigamma(nx)
+                + (own_label + _transposed_product(neighb_count, trigamma_ny))
+                / label_counts)
+
+    return loss, gradient
+
+
+def weight_loss(neighb_count, labels: np.ndarray, weights: list) -> float:
+    """Calculates loss for given neighbors and weights.
+
+    Parameters
+    ----------
+    neighb_count : numpy array or scipy sparse matrix
+        describes for each point the number of neighbors with each label.
+        Shape: (number of data points, number of labels)
+
+    labels : numpy array
+        label for each point. Shape: (number of data points, )
+
+    weights : list
+        weight of each label. Length: number of labels
+
+    Returns
+    -------
+    float
+        calculated loss
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    label_counts = _label_counts(labels, len(weights))
+    return _loss_and_gradient(neighb_count, labels, label_counts, weights,
+                              compute_gradient=False)[0]
+
+
+def weight_loss_batch(neighb_count, labels: np.ndarray,
+                      weights_matrix: np.ndarray) -> np.ndarray:
+    """Calculates losses for given neighbors and many weight vectors.
+
+    Weight vectors are processed together in blocks, with a single product
+    of the neighborhood array and a matrix of weights per block.
+
+    Parameters
+    ----------
+    neighb_count : numpy array or scipy sparse matrix
+        describes for each point the number of neighbors with each label.
+        Shape: (number of data points, number of labels)
+
+    labels : numpy array
+        label for each point. Shape: (number of data points, )
+
+    weights_matrix : numpy array
+        weight of each label in each row.
+        Shape: (number of weight vectors, number of labels)
+
+    Returns
+    -------
+    ndarray
+        loss for each weight vector
+    """
+    weights_matrix = np.atleast_2d(np.asarray(weights_matrix,
+                                              dtype=np.float64))
+    num_data = len(labels)
+    label_counts = _label_counts(labels, weights_matrix.shape[1])
+    label_cnts_list = label_counts[labels][:, np.newaxis]
+    block_size = max(1, _BATCH_ELEMENTS // max(num_data, 1))
+
+    losses = []
+    for start in range(0, len(weights_matrix), block_size):
+        weights = weights_matrix[start:start + block_size]
+        # Rows of the following arrays are points, columns weight vectors.
+        w_list = weights.T[labels]
+        # Zero weights are masked as in `_loss_and_gradient`.
+        dropped = w_list == 0
+        ny = (label_cnts_list / np.where(dropped, 1., w_list)
+              * _product(neighb_count, (weights / label_counts).T))
+        ny[dropped] = 1.
+        losses.append(np.sum(_label_terms(weights, num_data), axis=1)
+                      + np.sum(digamma(ny) * w_list / label_cnts_list,
+                               axis=0))
+    return np.concatenate(losses) if losses else np.zeros(0)
+
+
+def _gradient_norm(weights: np.ndarray, gradient: np.ndarray) -> float:
+    # Norm of the gradient with respect to logits of the weights, which
+    # vanishes at the optimum.
+    return float(np.linalg.norm(weights * (gradient - gradient @ weights)))
+
+
+def weight_optimizer(neighb_count, labels: np.ndarray, tol: float = 1e-6,
+                     loss_tol: float = 1e-9, grad_tol: float = 0.,
+                     max_iter: int = 10000, initial_weights: list = None,
+                     return_diagnostics: bool = False,
+                     callback=None) -> tuple:
+    """Returns loss and optimized weights for given neighbors description.
+
+    Parameters
+    ----------
+    neighb_count : numpy array or scipy sparse matrix
+        describes for each point the number of neighbors with each label.
+        Shape: (# of data points, # of labels)
+
+    labels : numpy array of shape (# of data points, )
+        label for each point
+
+    tol : float
+        the optimization stops when the loss is guaranteed to be at most
+        `tol` above the optimum
+
+    loss_tol : float
+        the optimization stops when an iteration decreases the loss by less
+        than `loss_tol`. Weights of labels which are hardly ever optimal
+        approach zero very slowly, so the above guarantee alone may require
+        many iterations which do not change the loss noticeably
+
+    grad_tol : float
+        the optimization stops when the norm of the gradient with respect
+        to logits of the weights, w * (g - g @ w), drops below `grad_tol`
+
+    max_iter : int
+        maximal number of iterations
+
+    initial_weights : list
+        weights of labels to start from (e.g. the optimum found for similar
+        data), uniform by default
+
+    return_diagnostics : bool
+        whether to return diagnostics as well
+
+    callback : callable
+        called as `callback(iteration, loss, weights)` after every
+        iteration, e.g. to trace the loss
+
+    Returns
+    -------
+    float
+        loss
+    ndarray
+        weight for each label
+    dict
+        only if `return_diagnostics` is set: "iterations" (number of
+        iterations), "gradient_norm" (final norm of the gradient with
+        respect to logits) and "converged" (whether a stopping criterion
+        was met within `max_iter` iterations)
+    """
+    num_labels = neighb_count.shape[1]
+    label_counts = _label_counts(labels, num_labels)
+
+    if initial_weights is None:
+        w = np.full(num_labels, 1. / num_labels)
+    else:
+        w = np.maximum(np.asarray(initial_weights, dtype=np.float64),
+                       _MIN_WEIGHT)
+        w /= w.sum()
+    loss, gradient = _loss_and_gradient(neighb_count, labels, label_counts, w)
+    step = 1.
+    iterations, converged = 0, False
+
+    while True:
+        # The duality gap bounds from above the difference between
+        # the current and the optimal loss.
+        if (gradient @ w - gradient.min() < tol
+                or _gradient_norm(w, gradient) < grad_tol):
+            converged = True
+            break
+        if iterations == max_iter:
+            break
+
+        while step > _MIN_STEP:
+            new_w = w * np.exp(-step * (gradient - gradient.min()))
+            new_w = np.maximum(new_w / new_w.sum(), _MIN_WEIGHT)
+            new_w /= new_w.sum()
+            new_loss, new_gradient = _loss_and_gradient(
+                neighb_count, labels, label_counts, new_w)
+            if new_loss <= loss + _ARMIJO * gradient @ (new_w - w):
+                break
+            step /= 2
+        else:
+            converged = True
+            break
+
+        improvement = loss - new_loss
+        # No further progress is possible in floating point arithmetic.
+        if improvement <= 0:
+            converged = True
+            break
+
+        w, loss, gradient = new_w, new_loss, new_gradient
+        iterations += 1
+        if callback is not None:
+            callback(iterations, loss, w)
+        if improvement < loss_tol:
+            converged = True
+            break
+        step = min(2 * step, _MAX_STEP)
+
+    if not return_diagnostics:
+        return loss, w
+    return loss, w, {"iterations": iterations,
+                     "gradient_norm": _gradient_norm(w, gradient),
+                     "converged": converged}
@@ -0,0 +1,133 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Counting neighborhoods in a pool of worker processes
+
+Coordinates and labels are put into shared memory once, together with the
+output arrays, and every worker builds the label trees only once, when it
+starts. Workers then receive ranges of query points and write their
+epsilons and counts straight into the shared output. Every point is
+queried in exactly the same way as in `cce.neighborhoods`, so the results
+are identical to the serial ones.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+from scipy.sparse import vstack
+from cce.neighborhoods import (build_label_trees, label_epsilons,
+                               count_neighborhoods_multi)
+from cce.sharing import share_arrays, attach, views, release
+
+# state of a worker process, set by `_init_worker`
+_worker = dict()
+
+
+def _init_worker(specs: dict, number_of_labels: int, leaf_size: int):
+    blocks, arrays = attach(specs)
+    label_trees = build_label_trees(arrays["coordinates"],
+                                    arrays["label_array"], number_of_labels,
+                                    leaf_size=leaf_size)
+    _worker.update(blocks=blocks, arrays=arrays, label_trees=label_trees)
+
+
+def _count_range(task: tuple):
+    start, stop, ks, sparse, approximation, dtype = task
+    arrays = _worker["arrays"]
+    coordinates = arrays["coordinates"][start:stop]
+    labels = arrays["label_array"][start:stop]
+
+    # Each worker uses a single thread in tree queries.
+    epsilons = label_epsilons(_worker["label_trees"], coordinates, labels, ks,
+                              workers=1, approximation=approximation)
+    neighborhood_arrays = count_neighborhoods_multi(
+        _worker["label_trees"], coordinates, labels, epsilons, workers=1,
+        sparse=sparse, approximation=approximation, same_label_counts=ks,
+        dtype=dtype)
+
+    arrays["epsilons"][start:stop] = epsilons
+    if sparse:
+        return neighborhood_arrays
+    for output, neighborhood_array in zip(arrays["neighborhoods"],
+                                          neighborhood_arrays):
+        output[start:stop] = neighborhood_array
+    return None
+
+
+def count_neighborhoods_parallel(coordinates: np.ndarray,
+                                 label_array: np.ndarray,
+                                 number_of_labels: int, ks: list,
+                                 processes: int = None, leaf_size: int = 16,
+                                 sparse: bool = False,
+                                 tasks_per_process: int = 4,
+                                 approximation: float = 0.,
+                                 dtype=np.float64) -> tuple:
+    """Finds epsilons and counts neighborhoods for many values of k, with
+    query points split across worker processes.
+
+    Parameters
+    ----------
+    coordinates : numpy array
+        coordinates of all points. Shape: (number of points, dimension)
+    label_array : numpy array
+        label index of each point. Shape: (number of points, )
+    number_of_labels : int
+        number of different labels
+    ks : list
+        values of k
+    processes : int
+        number of worker processes, all cores by default
+    leaf_size : int
+        positive integer, used for tree construction
+    sparse : bool
+        whether to return neighborhood arrays as CSR matrices
+    tasks_per_process : int
+        number of ranges of query points per process, for load balancing
+    approximation : float
+        non-negative relative error allowed in the tree queries, see
+        `neighborhoods.count_neighborhoods_multi`
+    dtype : data-type
+        type of the counts in the neighborhood arrays
+
+    Returns
+    -------
+    ndarray
+        epsilons of shape (number of points, len(ks)), see
+        `neighborhoods.label_epsilons`
+    list
+        neighborhood array for each k, see
+        `neighborhoods.count_neighborhoods`
+    """
+    processes = processes or os.cpu_count()
+    number_of_points = len(coordinates)
+    arrays = {"coordinates": coordinates, "label_array": label_array,
+              "epsilons": np.zeros((number_of_points, len(ks)))}
+    if not sparse:
+        arrays["neighborhoods"] = np.zeros(
+            (len(ks), number_of_points, number_of_labels), dtype=dtype)
+
+    bounds = np.linspace(0, number_of_points,
+                         min(number_of_points, processes * tasks_per_process)
+                         + 1).astype(int)
+    tasks = [(start, stop, list(ks), sparse, approximation, dtype)
+             for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    blocks, specs = share_arrays(arrays)
+    try:
+        with ProcessPoolExecutor(
+                max_workers=processes, initializer=_init_worker,
+                initargs=(specs, number_of_labels, leaf_size)) as executor:
+            results = list(executor.map(_count_range, tasks))
+        shared = views(blocks, specs)
+        epsilons = shared["epsilons"].copy()
+        if sparse:
+            neighborhood_arrays = [vstack([result[i] for result in results],
+                                          format="csr")
+                                   for i in range(len(ks))]
+        else:
+            neighborhood_arrays = list(shared["neighborhoods"].copy())
+        del shared
+    finally:
+        release(blocks)
+    return epsilons, neighborhood_arrays
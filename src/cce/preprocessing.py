@@ -15,7 +15,26 @@ def _project_coords(data: list) -> list:
     return [x[1] for x in data]
 
 
-def normalize(data: list) -> list:
+def coordinate_bounds(data: list) -> tuple:
+    """Finds the smallest and the largest coordinate in the data.
+
+    Parameters
+    ----------
+    data : list
+        data is a list of tuples. Each tuple has form (label, value),
+        where label can be either int or string and value is a
+        one-dimensional numpy array/list representing coordinates.
+
+    Returns
+    -------
+    tuple
+        minimal and maximal coordinate
+    """
+    arr = np.array(_project_coords(data))
+    return np.amin(arr), np.amax(arr)
+
+
+def normalize(data: list, bounds: tuple = None) -> list:
     """Performs input data normalization.
 
     Parameters
@@ -24,23 +43,141 @@ def normalize(data: list) -> list:
         data is a list of tuples. Each tuple has form (label, value),
         where label can be either int or string and value is a
         one-dimensional numpy array/list representing coordinates.
+    bounds : tuple
+        minimal and maximal coordinate mapped to 0 and 1, respectively.
+        By default, they are found in the data, see `coordinate_bounds`.
 
     Returns
     -------
     list
         list of data points. Each data point is normalized to interval
-        [0, 1].
+        [0, 1] (unless `bounds` do not contain all the coordinates).
     """
     lab = _project_labels(data)
-    arr = _project_coords(data)
-    arr = np.array(arr)
+    arr = normalize_coordinates(np.array(_project_coords(data)), bounds,
+                                copy=False)
 
-    max_ = np.amax(arr)
-    min_ = np.amin(arr)
+    return list(zip(lab, arr))
 
-    arr = (arr - min_)/(max_ - min_)
 
-    return list(zip(lab, arr))
+def normalize_coordinates(arr: np.ndarray, bounds: tuple = None,
+                          copy: bool = True) -> np.ndarray:
+    """Performs normalization of an array of coordinates.
+
+    Parameters
+    ----------
+    arr : numpy array
+        coordinates of the points. Shape: (number of points, dimension)
+    bounds : tuple
+        minimal and maximal coordinate mapped to 0 and 1, respectively.
+        By default, they are found in the array.
+    copy : bool
+        if False, an array of C-contiguous float64 is normalized in place
+        (any other array is converted anyway)
+
+    Returns
+    -------
+    ndarray
+        float64 array of normalized coordinates
+    """
+    if copy:
+        arr = np.array(arr, dtype=np.float64, order="C")
+    else:
+        arr = np.ascontiguousarray(arr, dtype=np.float64)
+
+    if bounds is None:
+        min_, max_ = np.amin(arr), np.amax(arr)
+    else:
+        min_, max_ = bounds
+
+    arr -= min_
+    arr /= max_ - min_
+    return arr
+
+
+def morton_order(arr: np.ndarray, labels: np.ndarray = None,
+                 bits: int = None) -> np.ndarray:
+    """Finds an order of points along the Morton (Z-order) curve.
+
+    Each coordinate is scaled to its range and cut to `bits` bits, and the
+    bits of all the coordinates are interleaved into a single 64-bit code
+    of each point. Points close in the order of codes are close in space,
+    so successive tree queries in this order touch the same nodes.
+
+    Parameters
+    ----------
+    arr : numpy array
+        coordinates of the points. Shape: (number of points, dimension)
+    labels : numpy array
+        if given, points are grouped by label (in order of label indices)
+        and ordered along the curve within each label
+    bits : int
+        bits of each coordinate, by default as many as fit into 64 bits
+        (at most 21). Only the first 64 coordinates are used if there are
+        more
+
+    Returns
+    -------
+    ndarray
+        indices of the points in the new order
+    """
+    dimension = min(arr.shape[1], 64)
+    if bits is None:
+        bits = max(1, min(21, 64 // dimension))
+    columns = arr[:, :dimension]
+    low = np.amin(columns, axis=0) if len(arr) else 0
+    spread = np.ptp(columns, axis=0) if len(arr) else 1
+    spread = np.where(spread > 0, spread, 1)
+    cells = np.minimum((columns - low) / spread * 2**bits,
+                       2**bits - 1).astype(np.uint64)
+
+    codes = np.zeros(len(arr), dtype=np.uint64)
+    one = np.uint64(1)
+    for bit in range(bits - 1, -1, -1):
+        for column in cells.T:
+            codes = (codes << one) | ((column >> np.uint64(bit)) & one)
+
+    if labels is None:
+        return np.argsort(codes, kind="stable")
+    return np.lexsort((codes, labels))
+
+
+def index_labels(labels) -> tuple:
+    """Assigns consecutive indices to labels, in order of first appearance.
+
+    Parameters
+    ----------
+    labels : iterable
+        label of each point (int or str)
+
+    Returns
+    -------
+    ndarray
+        index of the label of each point, as uint32
+    list
+        distinct labels, ordered by their indices
+    """
+    if not isinstance(labels, np.ndarray):
+        # np.asarray would turn e.g. [1, '1'] into strings, merging labels.
+        labels = list(labels)
+        array = np.empty(len(labels), dtype=object)
+        array[:] = labels
+        labels = array
+    try:
+        values, first, inverse = np.unique(labels, return_index=True,
+                                           return_inverse=True)
+    except TypeError:
+        # Labels of different types cannot be sorted.
+        values = list(dict.fromkeys(labels.tolist()))
+        label2index = {label: i for i, label in enumerate(values)}
+        return (np.array([label2index[label] for label in labels.tolist()],
+                         dtype=np.uint32), values)
+
+    # Indices of sorted labels are replaced by their ranks of appearance.
+    order = np.argsort(first)
+    rank = np.empty(len(values), dtype=np.uint32)
+    rank[order] = np.arange(len(values), dtype=np.uint32)
+    return rank[inverse.ravel()], values[order].tolist()
 
 
 def unique(arr) -> bool:
@@ -56,7 +193,10 @@ def unique(arr) -> bool:
     bool:
         True if points are distinct, False otherwise
     """
-    return len(arr) == len({tuple(p) for p in arr})
+    arr = np.asarray(arr)
+    if len(arr) == 0:
+        return True
+    return not _repeated_rows(arr.reshape(len(arr), -1)).any()
 
 
 def add_noise_if_duplicates(data: list) -> list:
@@ -74,20 +214,86 @@ def add_noise_if_duplicates(data: list) -> list:
     """
 
     lab, arr = _project_labels(data), _project_coords(data)
-    arr = np.array(arr)
-    if not unique(arr):
-        print("WARNING: data contains points that are not unique.",
-              "Data will be perturbed to avoid numerical issues.")
-        eps = min(filter(lambda x: x > 0,
-                         {x for x in np.ndarray.flatten(arr)}))
-        eps /= 2
-
-        arr += eps * np.random.rand(*arr.shape)
-        while not unique(arr):
-            eps /= 2
-            arr += eps * np.random.rand(*arr.shape)
-            if eps == 0.:
-                raise Exception("Cannot add noise to input data.")
-        print("eps used:", eps)
+    arr, _ = jitter_duplicates(np.array(arr, dtype=np.float64))
 
     return list(zip(lab, arr))
+
+
+def _repeated_rows(arr: np.ndarray) -> np.ndarray:
+    # Mask of rows equal to an earlier row. The sort is stable, so the
+    # earliest copy of each row comes first.
+    order = np.lexsort(arr.T[::-1])
+    ordered = arr[order]
+    repeated = np.zeros(len(arr), dtype=bool)
+    repeated[order[1:]] = (ordered[1:] == ordered[:-1]).all(axis=1)
+    return repeated
+
+
+def _smallest_gaps(arr: np.ndarray) -> np.ndarray:
+    # The smallest positive difference between values of each column.
+    gaps = np.ones(arr.shape[1])
+    for column in range(arr.shape[1]):
+        differences = np.diff(np.unique(arr[:, column]))
+        if len(differences):
+            gaps[column] = differences.min()
+    return gaps
+
+
+def jitter_duplicates(arr: np.ndarray, rng=None,
+                      max_attempts: int = 10) -> tuple:
+    """Perturbs repeated points, keeping the first copy of each of them.
+
+    Each coordinate of a repeated point is shifted up by a random amount
+    from (0, gap / 2], where gap is the smallest positive difference between
+    values in that column. Hence a perturbed point differs from all points
+    with other coordinates by more than gap / 2 in some column, and it can
+    only coincide with another copy of the same point, which is checked
+    (and such copies are drawn again) afterwards.
+
+    Parameters
+    ----------
+    arr : numpy array
+        float coordinates of the points, perturbed in place.
+        Shape: (number of points, dimension)
+    rng : numpy.random.Generator or int
+        random number generator or its seed
+    max_attempts : int
+        how many times coinciding copies are drawn again
+
+    Returns
+    -------
+    ndarray
+        the same array
+    dict
+        report with keys "perturbed" (number of perturbed points) and
+        "max_shift" (the largest possible shift in each column)
+    """
+    report = {"perturbed": 0, "max_shift": np.zeros(arr.shape[1])}
+    if len(arr) < 2:
+        return arr, report
+
+    repeated = _repeated_rows(arr)
+    report["perturbed"] = int(repeated.sum())
+    if not report["perturbed"]:
+        return arr, report
+
+    print("WARNING: data contains {} repeated points.".format(
+        report["perturbed"]),
+        "They will be perturbed to avoid numerical issues.")
+    rng = np.random.default_rng(rng)
+    report["max_shift"] = _smallest_gaps(arr) / 2
+    original = arr[repeated]
+    indices = np.flatnonzero(repeated)
+
+    for _ in range(max_attempts):
+        # 1 - random() lies in (0, 1].
+        shifts = report["max_shift"] * (1 - rng.random(original.shape))
+        arr[indices] = original + shifts
+        coinciding = _repeated_rows(arr)
+        if not coinciding.any():
+            return arr, report
+        # Only the coinciding copies are drawn again.
+        again = coinciding[indices]
+        indices, original = indices[again], original[again]
+
+    raise Exception("Cannot add noise to input data.")
@@ -0,0 +1,184 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Bootstrap and subsampling confidence intervals
+
+Resamples are drawn separately for each label, so that every label keeps
+its share of points, and they are estimated in parallel by a pool of
+worker processes. The (already preprocessed) data of the estimator are put
+into shared memory once, and workers only receive seeds of their resamples.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+from cce.sharing import share_arrays, attach, release
+
+# statistics which can be resampled, mapped to names of estimator methods
+_statistics = {
+    "mi": "calculate_mi",
+    "weighted_mi": "calculate_weighted_mi",
+    "maximized_mi": "calculate_maximized_mi",
+}
+
+# state of a worker process, set by `_init_worker`
+_worker = dict()
+
+
+def _init_worker(specs: dict, estimator_class: type, settings: dict):
+    blocks, arrays = attach(specs)
+
+    # Indices of points of each label.
+    label_array = arrays["label_array"]
+    points_of_label = np.split(np.argsort(label_array, kind="stable"),
+                               np.cumsum(np.bincount(label_array))[:-1])
+
+    _worker.update(blocks=blocks, arrays=arrays,
+                   estimator_class=estimator_class, settings=settings,
+                   points_of_label=points_of_label)
+
+
+def _estimate_resample(task: tuple) -> tuple:
+    seed, k, statistic, options, fraction, replace = task
+    rng = np.random.default_rng(seed)
+    coordinates = _worker["arrays"]["coordinates"]
+    label_array = _worker["arrays"]["label_array"]
+
+    indices = np.concatenate([
+        rng.choice(points, size=max(1, int(round(fraction * len(points)))),
+                   replace=replace)
+        for points in _worker["points_of_label"]])
+
+    # Labels of the resample are label indices of the original estimator.
+    estimator = _worker["estimator_class"](**_worker["settings"])
+    estimator.load_arrays(label_array[indices], coordinates[indices],
+                          copy=False)
+
+    if statistic == "maximized_mi":
+        estimator.calculate_neighborhoods(k=k)
+        mi, weights = estimator.optimize_weights(**options)
+        return mi, [weights[label] for label in range(len(weights))]
+
+    return getattr(estimator, _statistics[statistic])(k=k, **options), None
+
+
+def _percentile_interval(samples: np.ndarray, confidence: float) -> tuple:
+    alpha = 100 * (1 - confidence) / 2
+    lower, upper = np.percentile(samples, [alpha, 100 - alpha], axis=0)
+    return lower, upper
+
+
+def bootstrap(estimator, k: int, statistic: str = "mi",
+              weights: dict = None, n_resamples: int = 100,
+              fraction: float = 1., replace: bool = True,
+              confidence: float = 0.95, processes: int = None,
+              seed: int = None) -> dict:
+    """Calculates percentile confidence intervals by resampling the data.
+
+    By default, bootstrap resamples (drawn with replacement) are used.
+    Note that repeated points are perturbed by the estimator in the same
+    way as duplicates in the input data. Subsampling, i.e. drawing a
+    fraction of points without replacement, avoids repeated points
+    altogether, but the spread of its estimates corresponds to the smaller
+    number of points.
+
+    Parameters
+    ----------
+    estimator : WeightedKraskovEstimator
+        estimator with loaded data
+    k : int
+        free parameter in Kraskov estimator
+    statistic : str
+        "mi", "weighted_mi" or "maximized_mi", for the estimates of
+        `calculate_mi`, `calculate_weighted_mi` and `calculate_maximized_mi`
+    weights : dict
+        weights of labels, required by "weighted_mi"
+    n_resamples : int
+        number of resamples
+    fraction : float
+        number of points of each label in a resample, as a fraction of
+        the number of points of that label in the data
+    replace : bool
+        whether points are drawn with replacement
+    confidence : float
+        confidence level of the intervals
+    processes : int
+        number of worker processes, all cores by default. With 1, resamples
+        are estimated in the calling process
+    seed : int
+        seed making the resamples reproducible
+
+    Returns
+    -------
+    dict
+        with keys "estimate" (estimate for the full data, in bits),
+        "interval" (lower and upper end of the confidence interval),
+        "samples" (estimates for all resamples). For "maximized_mi"
+        there are also keys "weights", "weight_intervals" (dictionaries
+        mapping labels to optimal weights and their intervals) and
+        "weight_samples" (array of weights for each resample, with columns
+        ordered as `estimator.labels`)
+    """
+    if statistic not in _statistics:
+        raise ValueError("Unknown statistic: {}. Available statistics: {}."
+                         .format(statistic, ", ".join(_statistics)))
+    if statistic == "weighted_mi" and weights is None:
+        raise ValueError("Weights are required for weighted MI.")
+
+    estimator._check_if_data_are_loaded()
+    labels = estimator.labels
+
+    options = dict()
+    if statistic == "weighted_mi":
+        options["weights"] = {i: weights[label]
+                              for i, label in enumerate(labels)}
+        estimate = estimator.calculate_weighted_mi(weights, k=k)
+    elif statistic == "maximized_mi":
+        estimate, optimal_weights = estimator.calculate_maximized_mi(k=k)
+        # Every resample starts the optimization from the full-data optimum.
+        options["initial_weights"] = {i: optimal_weights[label]
+                                      for i, label in enumerate(labels)}
+    else:
+        estimate = estimator.calculate_mi(k=k)
+
+    seeds = np.random.SeedSequence(seed).spawn(n_resamples)
+    tasks = [(child, k, statistic, options, fraction, replace)
+             for child in seeds]
+
+    settings = estimator._settings()
+    blocks, specs = share_arrays({
+        "coordinates": estimator._immersed_data_coordinates,
+        "label_array": estimator.label_array})
+    try:
+        if processes == 1:
+            _init_worker(specs, type(estimator), settings)
+            results = list(map(_estimate_resample, tasks))
+        else:
+            # Each worker uses a single thread in tree queries, and no pool
+            # of its own.
+            settings["workers"] = 1
+            settings["processes"] = 1
+            with ProcessPoolExecutor(
+                    max_workers=processes or os.cpu_count(),
+                    initializer=_init_worker,
+                    initargs=(specs, type(estimator), settings)) as executor:
+                results = list(executor.map(_estimate_resample, tasks))
+    finally:
+        _worker.clear()
+        release(blocks)
+
+    samples = np.array([mi for mi, _ in results])
+    result = {"estimate": estimate,
+              "interval": _percentile_interval(samples, confidence),
+              "samples": samples}
+
+    if statistic == "maximized_mi":
+        weight_samples = np.array([w for _, w in results])
+        lower, upper = _percentile_interval(weight_samples, confidence)
+        result["weights"] = optimal_weights
+        result["weight_intervals"] = {label: (lower[i], upper[i])
+                                      for i, label in enumerate(labels)}
+        result["weight_samples"] = weight_samples
+
+    return result
@@ -2,20 +2,19 @@
 # licenced under GNU GPL 3 (see file License.txt).
 # Homepage: http://pmbm.ippt.pan.pl/software/cce 
 
-from collections import Counter
-import numpy as np
-import tensorflow.compat.v1 as tf
+"""Scoring of weights, dispatched to a chosen backend"""
 
-tf.disable_v2_behavior()
+import numpy as np
+from cce.backends import get_backend
 
 
 def weight_loss(neighb_count: np.array, labels: np.array,
-                weights: list) -> float:
+                weights: list, backend: str = "numpy") -> float:
     """Calculates loss for given neighbors and weights.
 
     Parameters
     ----------
-    neighb_count : numpy array
+    neighb_count : numpy array or scipy sparse matrix
         describes for each point the number of neighbors with each label.
         Shape: (number of data points, number of labels)
 
@@ -25,41 +24,46 @@ def weight_loss(neighb_count: np.array, labels: np.array,
     weights : list
         weight of each label. Length: number of labels
 
+    backend : str
+        name of the backend calculating the loss, see `cce.backends`
+
     Returns
     -------
     float
         calculated loss
     """
-    # reset graph before each run
-    tf.reset_default_graph()
-
-    num_data, num_labels = neighb_count.shape
-    label_counts = np.zeros([num_labels])
-    for label, count in Counter(labels).most_common():
-        label_counts[label] = count
+    return get_backend(backend).weight_loss(neighb_count, labels, weights)
 
-    # neighbors matrix
-    neigh_matx = tf.constant(neighb_count, dtype=tf.float32)
 
-    # label count vector
-    label_cnts = tf.constant(label_counts, dtype=tf.float32)
+def weight_loss_batch(neighb_count: np.array, labels: np.array,
+                      weights_matrix: np.array,
+                      backend: str = "numpy") -> np.ndarray:
+    """Calculates losses for given neighbors and many weight vectors.
 
-    # weights
-    w = tf.constant(weights, dtype=tf.float32)
-
-    # weight lookup list
-    w_list = tf.reduce_sum(tf.one_hot(labels, num_labels) * w, axis=1)
+    Parameters
+    ----------
+    neighb_count : numpy array or scipy sparse matrix
+        describes for each point the number of neighbors with each label.
+        Shape: (number of data points, number of labels)
 
-    # label counts lookup list
-    label_cnts_list = tf.reduce_sum(tf.one_hot(labels, num_labels) * label_cnts,
-                                    axis=1)
-    nx = w * num_data
+    labels : numpy array
+        label for each point. Shape: (number of data points, )
 
-    ny = label_cnts_list / w_list * \
-         tf.reduce_sum(neigh_matx * (w/label_cnts), axis=1)
+    weights_matrix : numpy array
+        weight of each label in each row.
+        Shape: (number of weight vectors, number of labels)
 
-    loss = (tf.reduce_sum(tf.digamma(nx) * w) \
-          + tf.reduce_sum(tf.digamma(ny) * w_list / label_cnts_list))
+    backend : str
+        name of the backend calculating the losses, see `cce.backends`.
+        Backends without `weight_loss_batch` calculate them one by one
 
-    with tf.Session() as sess:
-        return sess.run(loss)
+    Returns
+    -------
+    ndarray
+        loss for each weight vector
+    """
+    module = get_backend(backend)
+    if hasattr(module, "weight_loss_batch"):
+        return module.weight_loss_batch(neighb_count, labels, weights_matrix)
+    return np.array([module.weight_loss(neighb_count, labels, weights)
+                     for weights in np.atleast_2d(weights_matrix)])
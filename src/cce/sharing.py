@@ -0,0 +1,94 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Sharing NumPy arrays with worker processes without copying them"""
+
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+
+def share_arrays(arrays: dict) -> tuple:
+    """Copies arrays into shared memory blocks.
+
+    Parameters
+    ----------
+    arrays : dict
+        dictionary mapping names to numpy arrays
+
+    Returns
+    -------
+    list
+        shared memory blocks, to be released with `release` when the
+        workers are done
+    dict
+        picklable description of the blocks, to be passed to `attach`
+    """
+    blocks, specs = [], dict()
+    try:
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype,
+                       buffer=block.buf)[...] = array
+            specs[name] = (block.name, array.shape, array.dtype.str)
+    except BaseException:
+        release(blocks)
+        raise
+    return blocks, specs
+
+
+def attach(specs: dict) -> tuple:
+    """Attaches to shared memory blocks created with `share_arrays`.
+
+    Parameters
+    ----------
+    specs : dict
+        description of the blocks, as returned by `share_arrays`
+
+    Returns
+    -------
+    list
+        attached blocks, which must be kept alive as long as the arrays
+        are used
+    dict
+        dictionary mapping names to numpy arrays backed by shared memory
+    """
+    blocks, arrays = [], dict()
+    for name, (block_name, shape, dtype) in specs.items():
+        # Workers share the resource tracker with the process which created
+        # the block, so it is unlinked only once, by `release`.
+        block = SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype),
+                                  buffer=block.buf)
+    return blocks, arrays
+
+
+def views(blocks: list, specs: dict) -> dict:
+    """Returns arrays backed by shared memory blocks created with
+    `share_arrays`, e.g. to read results written by the workers. They
+    must be deleted before the blocks are released.
+
+    Parameters
+    ----------
+    blocks : list
+        shared memory blocks, as returned by `share_arrays`
+    specs : dict
+        description of the blocks, as returned by `share_arrays`
+
+    Returns
+    -------
+    dict
+        dictionary mapping names to numpy arrays backed by shared memory
+    """
+    return {name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            for block, (name, (_, shape, dtype)) in zip(blocks, specs.items())}
+
+
+def release(blocks: list):
+    """Frees shared memory blocks created with `share_arrays`."""
+    for block in blocks:
+        block.close()
+        block.unlink()
@@ -0,0 +1,195 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""MI and channel capacity of subsets of labels
+
+Epsilon of a point depends only on the points with its label, so the
+neighborhood array of the data restricted to a subset of labels consists
+of the rows of points with these labels and the columns of these labels
+of the full neighborhood array. Estimates for any number of subsets, e.g.
+for all pairs of labels, are therefore obtained from a single calculation
+of neighborhoods. They are calculated in parallel by a pool of worker
+processes, with the neighborhood array in shared memory.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+from scipy.special import digamma
+from cce.optimization import weight_optimizer
+from cce.sharing import share_arrays, attach, release
+
+# statistics which can be calculated for subsets
+_statistics = ("mi", "maximized_mi")
+
+# state of a worker process, set by `_init_worker`
+_worker = dict()
+
+
+def _init_worker(specs: dict, shape: tuple, k: int, backend: str):
+    blocks, arrays = attach(specs)
+    if "neighborhood_array" in arrays:
+        neighborhood_array = arrays["neighborhood_array"]
+    else:
+        neighborhood_array = csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=shape, copy=False)
+
+    # Indices of points of each label.
+    label_array = arrays["label_array"]
+    points_of_label = np.split(np.argsort(label_array, kind="stable"),
+                               np.cumsum(np.bincount(label_array,
+                                                     minlength=shape[1]))[:-1])
+
+    _worker.update(blocks=blocks, neighborhood_array=neighborhood_array,
+                   points_of_label=points_of_label, k=k, backend=backend)
+
+
+def _estimate_subset(task: tuple) -> tuple:
+    subset, statistic, options = task
+    k = _worker["k"]
+    points = [_worker["points_of_label"][label] for label in subset]
+    sizes = np.array([len(label_points) for label_points in points])
+    number_of_points = sizes.sum()
+
+    neighborhood_array = \
+        _worker["neighborhood_array"][np.concatenate(points)][:, list(subset)]
+    # Labels of the subset are numbered 0, 1, ... in its order.
+    label_array = np.repeat(np.arange(len(subset)), sizes)
+
+    if statistic == "maximized_mi":
+        loss, weights = weight_optimizer(neighb_count=neighborhood_array,
+                                         labels=label_array,
+                                         backend=_worker["backend"],
+                                         **options)
+        return ((digamma(k) + digamma(number_of_points) - loss) / np.log(2),
+                list(weights))
+
+    n_y = np.asarray(neighborhood_array.sum(axis=1)).ravel()
+    n_x = sizes[label_array]
+    return ((digamma(k) + digamma(number_of_points)
+             - (digamma(n_y) + digamma(n_x)).mean()) / np.log(2),
+            None)
+
+
+def subset_estimates(estimator, subsets: list, k: int,
+                     statistic: str = "maximized_mi", processes: int = None,
+                     **options) -> list:
+    """Estimates MI or channel capacity for the data restricted to subsets
+    of labels.
+
+    The results are the same as for estimators loaded with the points of
+    each subset only, up to the random perturbation of repeated points and
+    rounding: the k-th neighbor of a point lies on the boundary of its ball
+    and whether it is counted may depend on the rounding of coordinates,
+    which are normalized differently for the subset.
+
+    Parameters
+    ----------
+    estimator : WeightedKraskovEstimator
+        estimator with loaded data
+    subsets : list
+        subsets of labels, each a list of at least two labels
+    k : int
+        free parameter in Kraskov estimator
+    statistic : str
+        "mi" (for the numbers of points of the labels, as in
+        `calculate_mi`) or "maximized_mi" (channel capacity)
+    processes : int
+        number of worker processes, all cores by default. With 1, subsets
+        are estimated in the calling process
+    options
+        passed to the optimizer of the estimator's backend
+
+    Returns
+    -------
+    list
+        for each subset, MI in bits, or a tuple of capacity in bits and
+        a dictionary mapping labels of the subset to optimal weights
+    """
+    if statistic not in _statistics:
+        raise ValueError("Unknown statistic: {}. Available statistics: {}."
+                         .format(statistic, ", ".join(_statistics)))
+    estimator._check_if_data_are_loaded()
+    subsets = [list(subset) for subset in subsets]
+    tasks = []
+    for subset in subsets:
+        for label in subset:
+            if label not in estimator._label2index:
+                raise ValueError("Label {} has not been loaded."
+                                 .format(label))
+        indices = tuple(estimator._label2index[label] for label in subset)
+        if len(indices) < 2 or len(set(indices)) < len(indices):
+            raise ValueError("Subsets should have at least two different "
+                             "labels.")
+        tasks.append((indices, statistic, options))
+
+    estimator.calculate_neighborhoods(k=k)
+    neighborhood_array = estimator.neighborhood_array
+    arrays = {"label_array": estimator.label_array}
+    if issparse(neighborhood_array):
+        arrays.update(data=neighborhood_array.data,
+                      indices=neighborhood_array.indices,
+                      indptr=neighborhood_array.indptr)
+    else:
+        arrays["neighborhood_array"] = neighborhood_array
+    initargs = (neighborhood_array.shape, k, estimator.backend)
+
+    blocks, specs = share_arrays(arrays)
+    try:
+        if processes == 1:
+            _init_worker(specs, *initargs)
+            results = list(map(_estimate_subset, tasks))
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=processes or os.cpu_count(),
+                    initializer=_init_worker,
+                    initargs=(specs,) + initargs) as executor:
+                results = list(executor.map(_estimate_subset, tasks))
+    finally:
+        _worker.clear()
+        release(blocks)
+
+    if statistic == "mi":
+        return [mi for mi, _ in results]
+    return [(mi, dict(zip(subset, weights)))
+            for subset, (mi, weights) in zip(subsets, results)]
+
+
+def capacity_matrix(estimator, k: int, labels: list = None,
+                    processes: int = None, **options) -> np.ndarray:
+    """Calculates channel capacity for every pair of labels.
+
+    Parameters
+    ----------
+    estimator : WeightedKraskovEstimator
+        estimator with loaded data
+    k : int
+        free parameter in Kraskov estimator
+    labels : list
+        labels to be paired, all the loaded labels (in the order of
+        `estimator.labels`) by default
+    processes : int
+        number of worker processes, all cores by default
+    options
+        passed to the optimizer of the estimator's backend
+
+    Returns
+    -------
+    ndarray
+        symmetric matrix of capacities in bits, with rows and columns
+        ordered as `labels` and zeros on the diagonal
+    """
+    labels = estimator.labels if labels is None else list(labels)
+    pairs = list(itertools.combinations(range(len(labels)), 2))
+    results = subset_estimates(
+        estimator, [(labels[i], labels[j]) for i, j in pairs], k,
+        statistic="maximized_mi", processes=processes, **options)
+
+    matrix = np.zeros((len(labels), len(labels)))
+    for (i, j), (capacity, _) in zip(pairs, results):
+        matrix[i, j] = matrix[j, i] = capacity
+    return matrix
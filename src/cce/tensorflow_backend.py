@@ -0,0 +1,222 @@
+# This file is part of Channel Capacity Estimator,
+# licenced under GNU GPL 3 (see file License.txt).
+# Homepage: http://pmbm.ippt.pan.pl/software/cce
+
+"""Loss and weight optimization implemented in TensorFlow
+
+Every call builds its computations in a fresh graph, so that neither
+the default graph nor the global TensorFlow behaviour is modified.
+"""
+
+import numpy as np
+from scipy.sparse import issparse
+import tensorflow.compat.v1 as tf
+
+
+def _neighbors_matrix(neighb_count):
+    if not issparse(neighb_count):
+        return tf.constant(neighb_count, dtype=tf.float32)
+
+    coo = neighb_count.tocoo()
+    indices = np.stack([coo.row, coo.col], axis=1).astype(np.int64)
+    return tf.SparseTensor(indices=indices,
+                           values=coo.data.astype(np.float32),
+                           dense_shape=coo.shape)
+
+
+def _loss(neighb_count, labels: np.ndarray, w):
+    num_data, num_labels = neighb_count.shape
+    label_counts = np.bincount(labels, minlength=num_labels)
+
+    # neighbors matrix, dense or sparse
+    neigh_matx = _neighbors_matrix(neighb_count)
+
+    # label count vector
+    label_cnts = tf.constant(label_counts, dtype=tf.float32)
+
+    # weight and label counts lookup lists
+    labels = tf.constant(labels, dtype=tf.int64)
+    w_list = tf.gather(w, labels)
+    label_cnts_list = tf.gather(label_cnts, labels)
+
+    nx = w * num_data
+
+    w_per_point = tf.reshape(w / label_cnts, [-1, 1])
+    if isinstance(neigh_matx, tf.SparseTensor):
+        weighted_neighbors = tf.sparse.sparse_dense_matmul(neigh_matx,
+                                                           w_per_point)
+    else:
+        weighted_neighbors = tf.matmul(neigh_matx, w_per_point)
+
+    ny = label_cnts_list / w_list * weighted_neighbors[:, 0]
+
+    return (tf.reduce_sum(tf.digamma(nx) * w) +
+            tf.reduce_sum(tf.digamma(ny) * w_list / label_cnts_list))
+
+
+def weight_loss(neighb_count, labels: np.ndarray, weights: list) -> float:
+    """Calculates loss for given neighbors and weights.
+
+    Parameters
+    ----------
+    neighb_count : numpy array or scipy sparse matrix
+        describes for each point the number of neighbors with each label.
+        Shape: (number of data points, number of labels)
+
+    labels : numpy array
+        label for each point. Shape: (number of data points, )
+
+    weights : list
+        weight of each label. Length: number of labels
+
+    Returns
+    -------
+    float
+        calculated loss
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        # weights
+        w = tf.constant(weights, dtype=tf.float32)
+        loss = _loss(neighb_count, labels, w)
+
+    with tf.Session(graph=graph) as sess:
+        return sess.run(loss)
+
+
+def weight_loss_batch(neighb_count, labels: np.ndarray,
+                      weights_matrix: np.ndarray) -> np.ndarray:
+    """Calculates losses for given neighbors and many weight vectors.
+
+    The graph is built once and evaluated for every weight vector.
+
+    Parameters
+    ----------
+    neighb_count : numpy array or scipy sparse matrix
+        describes for each point the number of neighbors with each label.
+        Shape: (number of data points, number of labels)
+
+    labels : numpy array
+        label for each point. Shape: (number of data points, )
+
+    weights_matrix : numpy array
+        weight of each label in each row.
+        Shape: (number of weight vectors, number of labels)
+
+    Returns
+    -------
+    ndarray
+        loss for each weight vector
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        # weights
+        w = tf.placeholder(tf.float32, shape=[neighb_count.shape[1]])
+        loss = _loss(neighb_count, labels, w)
+
+    with tf.Session(graph=graph) as sess:
+        return np.array([sess.run(loss, feed_dict={w: weights})
+                         for weights in np.atleast_2d(weights_matrix)])
+
+
+def weight_optimizer(neighb_count, labels: np.ndarray, max_iter: int = 5000,
+                     loss_tol: float = 1e-6, grad_tol: float = 1e-4,
+                     initial_weights: list = None, check_every: int = 100,
+                     return_diagnostics: bool = False,
+                     callback=None) -> tuple:
+    """Returns loss and optimized weights for given neighbors description.
+
+    Parameters
+    ----------
+    neighb_count : numpy array or scipy sparse matrix
+        describes for each point the number of neighbors with each label.
+        Shape: (# of data points, # of labels)
+
+    labels : numpy array of shape (# of data points, )
+        label for each point
+
+    max_iter : int
+        maximal number of steps of ADAM algorithm
+
+    loss_tol : float
+        the optimization stops when `check_every` steps decrease the loss
+        by less than `loss_tol`. Note that the loss is computed in single
+        precision
+
+    grad_tol : float
+        the optimization stops when the norm of the gradient with respect
+        to the logits drops below `grad_tol`
+
+    initial_weights : list
+        weights of labels to start from (e.g. the optimum found for similar
+        data), uniform by default
+
+    check_every : int
+        number of steps between checks of the stopping criteria
+
+    return_diagnostics : bool
+        whether to return diagnostics as well
+
+    callback : callable
+        called as `callback(step, loss, weights)` at every check of the
+        stopping criteria, i.e. every `check_every` steps
+
+    Returns
+    -------
+    float
+        loss
+    list
+        weight for each label
+    dict
+        only if `return_diagnostics` is set: "iterations" (number of
+        steps), "gradient_norm" (final norm of the gradient with respect to
+        the logits) and "converged" (whether a stopping criterion was met
+        within `max_iter` steps)
+    """
+    num_labels = neighb_count.shape[1]
+
+    if initial_weights is None:
+        initial_logits = np.ones(num_labels)
+    else:
+        initial_logits = np.log(np.maximum(np.asarray(initial_weights,
+                                                      dtype=np.float64),
+                                           1e-12))
+
+    graph = tf.Graph()
+    with graph.as_default():
+        # logits -- to be optimized
+        logits = tf.Variable(initial_logits, dtype=tf.float32)
+
+        # weights
+        w = tf.nn.softmax(logits)
+        loss = _loss(neighb_count, labels, w)
+        gradient_norm = tf.norm(tf.gradients(loss, logits)[0])
+
+        optimizer = tf.train.AdamOptimizer()
+        train = optimizer.minimize(loss)
+        init = tf.global_variables_initializer()
+
+    with tf.Session(graph=graph) as sess:
+        sess.run(init)
+        previous_loss = sess.run(loss)
+        iterations, converged = 0, False
+        while iterations < max_iter:
+            for _ in range(min(check_every, max_iter - iterations)):
+                sess.run(train)
+                iterations += 1
+            current_loss, current_norm = sess.run([loss, gradient_norm])
+            if callback is not None:
+                callback(iterations, current_loss, sess.run(w))
+            if (current_norm < grad_tol
+                    or previous_loss - current_loss < loss_tol):
+                converged = True
+                break
+            previous_loss = current_loss
+
+        final_loss, weights, final_norm = sess.run([loss, w, gradient_norm])
+
+    if not return_diagnostics:
+        return final_loss, weights
+    return final_loss, weights, {"iterations": iterations,
+                                 "gradient_norm": float(final_norm),
+                                 "converged": converged}
@@ -0,0 +1,109 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import unittest
+import numpy as np
+from cce.aio import AsyncEstimator
+from cce.estimator import WeightedKraskovEstimator as wke
+from cce.instrumentation import Instrumentation
+from tests.noisy_channel import communicate
+
+NN_K = 10
+
+
+class TestAsyncEstimator(unittest.IsolatedAsyncioTestCase):
+    """Tests of the awaitable estimator against the synchronous one."""
+
+    def setUp(self):
+        self.data = communicate({'A': 400, 'B': 600, 'C': 500},
+                                {'A': 0.0, 'B': 0.5, 'C': 1.0}, sigma=0.3)
+        self.estimator = wke(self.data)
+
+    async def test_results_agree(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            est = AsyncEstimator(executor=executor)
+            await est.load(self.data)
+            self.assertAlmostEqual(await est.calculate_mi(k=NN_K),
+                                   self.estimator.calculate_mi(k=NN_K))
+            weights = {'A': 0.2, 'B': 0.3, 'C': 0.5}
+            self.assertAlmostEqual(
+                await est.calculate_weighted_mi(weights, k=NN_K),
+                self.estimator.calculate_weighted_mi(weights, k=NN_K))
+            mi, optimal = await est.calculate_maximized_mi(k=NN_K)
+            expected_mi, expected = self.estimator.calculate_maximized_mi(
+                k=NN_K)
+            self.assertAlmostEqual(mi, expected_mi)
+            for label in expected:
+                self.assertAlmostEqual(optimal[label], expected[label])
+
+            labels = np.array([label for label, _ in self.data])
+            coordinates = np.array([value for _, value in self.data])
+            await est.load_arrays(labels, coordinates)
+            self.assertAlmostEqual(await est.calculate_mi(k=NN_K),
+                                   self.estimator.calculate_mi(k=NN_K))
+
+    async def test_concurrent_queries_share_neighborhoods(self):
+        instrumentation = Instrumentation()
+        est = AsyncEstimator(wke(self.data, instrumentation=instrumentation))
+        weights = [dict(zip("ABC", w))
+                   for w in np.random.dirichlet(np.ones(3), size=10)]
+        mis = await asyncio.gather(*[est.calculate_weighted_mi(w, k=NN_K)
+                                     for w in weights])
+        for mi, w in zip(mis, weights):
+            self.assertAlmostEqual(
+                mi, self.estimator.calculate_weighted_mi(w, k=NN_K))
+        stages = instrumentation.summary()["stages"]
+        self.assertEqual(stages["ball_counting"]["calls"], 1)
+        self.assertEqual(stages["scoring"]["calls"], 10)
+
+    async def test_cancellation_between_stages(self):
+        events = []
+        est = AsyncEstimator(
+            wke(self.data, instrumentation=Instrumentation([events.append])))
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(est.calculate_maximized_mi(k=NN_K))
+
+        def cancel_after_counting(event):
+            if event.get("name") == "ball_counting":
+                loop.call_soon_threadsafe(task.cancel)
+        est.estimator.instrumentation.add_sink(cancel_after_counting)
+
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        # Neighborhoods were completed and are reused, but no optimization
+        # has started.
+        self.assertIsNotNone(est.estimator.neighborhood_array)
+        self.assertNotIn("optimization", [event.get("name")
+                                          for event in events])
+        self.assertAlmostEqual(await est.calculate_mi(k=NN_K),
+                               self.estimator.calculate_mi(k=NN_K))
+
+    async def test_cancellation_stops_optimization(self):
+        est = AsyncEstimator()
+        await est.load(self.data)
+        loop = asyncio.get_running_loop()
+        iterations = []
+
+        def callback(iteration, loss, weights):
+            iterations.append(iteration)
+            if iteration == 5:
+                loop.call_soon_threadsafe(task.cancel)
+
+        task = asyncio.ensure_future(est.calculate_maximized_mi(
+            k=NN_K, max_iter=10**6, tol=0, loss_tol=0, callback=callback))
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertLess(max(iterations), 100)
+
+    async def test_errors(self):
+        est = AsyncEstimator()
+        with self.assertRaises(Exception):
+            await est.calculate_mi(k=NN_K)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(ValueError):
+                AsyncEstimator(executor=executor)
+        with self.assertRaises(ValueError):
+            AsyncEstimator(self.estimator, sparse=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
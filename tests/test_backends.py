@@ -0,0 +1,36 @@
+import subprocess
+import sys
+import unittest
+from cce import backends
+from cce import numpy_backend
+
+
+class TestBackends(unittest.TestCase):
+    """Tests of the lazily loading registry of backends."""
+
+    def test_import_does_not_load_tensorflow(self):
+        statement = ("import sys; from cce import WeightedKraskovEstimator; "
+                     "print('tensorflow' in sys.modules)")
+        output = subprocess.run([sys.executable, "-c", statement],
+                                check=True, capture_output=True, text=True)
+        self.assertEqual(output.stdout.strip(), "False")
+
+    def test_get_backend(self):
+        self.assertIs(backends.get_backend("numpy"), numpy_backend)
+        self.assertIn("tensorflow", backends.available_backends())
+
+    def test_register_backend(self):
+        backends.register_backend("numpy_copy", "cce.numpy_backend")
+        try:
+            self.assertIs(backends.get_backend("numpy_copy"), numpy_backend)
+        finally:
+            del backends._backend_modules["numpy_copy"]
+            del backends._loaded_backends["numpy_copy"]
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            backends.get_backend("unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+from cce.batch import estimate_batch
+from cce.estimator import WeightedKraskovEstimator as wke
+from tests.noisy_channel import communicate
+
+NN_K = 5
+
+
+class TestBatch(unittest.TestCase):
+    """Tests of estimation for many data sets."""
+
+    def setUp(self):
+        self.datasets = {
+            sigma: communicate({'A': 200, 'B': 300},
+                               {'A': 0.0, 'B': 0.5}, sigma=sigma)
+            for sigma in (0.1, 0.3, 1.0)}
+        # Labels and coordinates of different lengths.
+        self.datasets["broken"] = (np.zeros(10), np.zeros(20))
+
+    def test_pool(self):
+        results = {result["key"]: result
+                   for result in estimate_batch(self.datasets, k=NN_K,
+                                                processes=2, max_pending=2)}
+        self.assertEqual(set(results), set(self.datasets))
+        self.assertIn("ValueError", results["broken"]["error"])
+        for sigma in (0.1, 0.3, 1.0):
+            mi, weights = wke(self.datasets[sigma]).calculate_maximized_mi(
+                k=NN_K)
+            self.assertAlmostEqual(results[sigma]["mi"], mi)
+            self.assertAlmostEqual(results[sigma]["weights"]["A"],
+                                   weights["A"])
+            self.assertGreaterEqual(results[sigma]["seconds"], 0)
+
+    def test_serial(self):
+        datasets = ((key, data) for key, data in self.datasets.items())
+        results = list(estimate_batch(datasets, k=NN_K, statistic="mi",
+                                      processes=1))
+        self.assertEqual([result["key"] for result in results],
+                         list(self.datasets))
+        self.assertAlmostEqual(results[0]["mi"],
+                               wke(self.datasets[0.1]).calculate_mi(k=NN_K))
+        self.assertIn("error", results[-1])
+
+    def test_weighted_mi(self):
+        with self.assertRaises(ValueError):
+            estimate_batch(self.datasets, k=NN_K, statistic="weighted_mi")
+        weights = {'A': 0.3, 'B': 0.7}
+        result = next(estimate_batch({"data": self.datasets[0.3]}, k=NN_K,
+                                     statistic="weighted_mi",
+                                     weights=weights, processes=1))
+        self.assertAlmostEqual(
+            result["mi"],
+            wke(self.datasets[0.3]).calculate_weighted_mi(weights, k=NN_K))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from scipy.sparse import issparse
+from cce.cache import NeighborhoodCache
+from cce.estimator import WeightedKraskovEstimator as wke
+from tests.noisy_channel import communicate
+
+NN_K = 5
+
+
+class TestCache(unittest.TestCase):
+    """Tests of the on-disk cache of neighborhood arrays."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = communicate({'A': 300, 'B': 400},
+                                {'A': 0.0, 'B': 0.5}, sigma=0.3)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_warm_run(self):
+        for sparse in (False, True):
+            cache = NeighborhoodCache(os.path.join(self.directory.name,
+                                                   str(sparse)))
+            cold = wke(self.data, sparse=sparse, cache=cache)
+            mi = cold.calculate_mi(k=NN_K)
+            self.assertEqual(len(cache.entries()), 1)
+
+            warm = wke(self.data, sparse=sparse, cache=cache.directory)
+            self.assertAlmostEqual(warm.calculate_mi(k=NN_K), mi)
+            self.assertIsNone(warm._label_trees)
+            self.assertEqual(issparse(warm.neighborhood_array), sparse)
+            self.assertAlmostEqual(warm.optimize_weights()[0],
+                                   cold.optimize_weights()[0])
+
+    def test_different_k_or_data(self):
+        cache = NeighborhoodCache(self.directory.name)
+        wke(self.data, cache=cache).calculate_mi(k=NN_K)
+        wke(self.data, cache=cache).calculate_mi(k=NN_K + 1)
+        wke(self.data[1:], cache=cache).calculate_mi(k=NN_K)
+        self.assertEqual(len(cache.entries()), 3)
+
+    def test_spatial_order_with_duplicates(self):
+        # Repeated points are perturbed randomly on every load, which must
+        # not change the order of the points paired with cached rows.
+        labels = np.random.randint(3, size=3000)
+        coordinates = np.round(np.random.normal(size=(3000, 2)), 1)
+        cache = NeighborhoodCache(self.directory.name)
+        cold = wke(spatial_order=True, cache=cache)
+        cold.load_arrays(labels, coordinates)
+        cold.calculate_neighborhoods(k=NN_K)
+
+        warm = wke(spatial_order=True, cache=cache)
+        warm.load_arrays(labels, coordinates)
+        warm.calculate_neighborhoods(k=NN_K)
+        self.assertIsNone(warm._label_trees)
+        np.testing.assert_array_equal(warm._order, cold._order)
+        np.testing.assert_array_equal(warm.in_loaded_order(warm.label_array),
+                                      cold.in_loaded_order(cold.label_array))
+        np.testing.assert_array_equal(warm._immersed_data_coordinates,
+                                      cold._immersed_data_coordinates)
+        np.testing.assert_array_equal(warm._epsilons([NN_K])[:, 0],
+                                      warm._epsilon_array)
+
+        new_points = np.random.normal(size=(50, 2))
+        cold.add_label(3, new_points)
+        warm.add_label(3, new_points)
+        np.testing.assert_array_equal(warm.neighborhood_array,
+                                      cold.neighborhood_array)
+
+    def test_eviction(self):
+        cache = NeighborhoodCache(self.directory.name)
+        wke(self.data, cache=cache).calculate_mi(k=NN_K)
+        entry_size = cache.entries()[0][1]
+
+        cache.max_bytes = 2 * entry_size + 100
+        for k in range(NN_K + 1, NN_K + 4):
+            wke(self.data, cache=cache).calculate_mi(k=k)
+        self.assertEqual(len(cache.entries()), 2)
+
+        cache.clear()
+        self.assertEqual(cache.entries(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from cce import chunked
+from cce.estimator import WeightedKraskovEstimator as wke
+
+NN_K = 5
+
+
+class TestChunked(unittest.TestCase):
+    """Tests of out-of-core neighborhood counting against the in-memory
+    implementation."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.labels = np.random.choice(['A', 'BB', 'C'], size=700)
+        self.coordinates = np.random.normal(size=(700, 2))
+        self.coordinates[:, 0] += (self.labels == 'BB')
+        self.paths = [os.path.join(self.directory.name, name)
+                      for name in ("labels.npy", "coordinates.npy")]
+        np.save(self.paths[0], self.labels)
+        np.save(self.paths[1], self.coordinates)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_same_as_in_memory(self):
+        est_memory = wke()
+        est_memory.load_arrays(self.labels, self.coordinates)
+
+        # About 100 points in a chunk.
+        est_chunked = wke()
+        est_chunked.load_npy(*self.paths,
+                             directory=os.path.join(self.directory.name, "out"),
+                             max_memory=100 * (8 * (8 + 24 + 3) + 64))
+        self.assertEqual(est_chunked.labels, est_memory.labels)
+
+        est_memory.calculate_neighborhoods(k=NN_K)
+        est_chunked.calculate_neighborhoods(k=NN_K)
+        self.assertIsInstance(est_chunked.neighborhood_array, np.memmap)
+        np.testing.assert_array_equal(est_chunked.neighborhood_array,
+                                      est_memory.neighborhood_array)
+        self.assertAlmostEqual(est_chunked.calculate_mi(k=NN_K),
+                               est_memory.calculate_mi(k=NN_K))
+        np.testing.assert_allclose(est_chunked.calculate_mi_curve([3, 8]),
+                                   est_memory.calculate_mi_curve([3, 8]))
+
+    def test_trees_built_once_per_pass(self):
+        directory = os.path.join(self.directory.name, "out")
+        est = wke()
+        est.load_npy(*self.paths, directory=directory,
+                     max_memory=100 * (8 * (8 + 24 + 3) + 64))
+        with mock.patch.object(chunked, "build_label_trees",
+                               wraps=chunked.build_label_trees) as build:
+            est.calculate_neighborhoods(k=NN_K)
+        # Seven chunks of about 100 points, in two passes.
+        self.assertEqual(build.call_count, 2 * 7)
+        self.assertFalse(any(name.startswith("nearest")
+                             for name in os.listdir(directory)))
+
+    def test_not_available(self):
+        est = wke()
+        est.load_npy(*self.paths)
+        with self.assertRaises(ValueError):
+            est.add_label('D', self.coordinates)
+        with self.assertRaises(ValueError):
+            est.bootstrap(k=NN_K)
+        with self.assertRaises(ValueError):
+            wke(sparse=True).load_npy(*self.paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+from cce.cli import main, read_data
+from cce.estimator import WeightedKraskovEstimator as wke
+
+
+class TestCommandLine(unittest.TestCase):
+    """Tests of the `cce` command."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        labels = np.repeat([0, 1, 2], 200)
+        coordinates = (labels[:, np.newaxis] / 2
+                       + 0.3 * np.random.normal(size=(600, 2)))
+        self.npy = os.path.join(self.directory.name, "data.npy")
+        np.save(self.npy, np.column_stack([labels, coordinates]))
+        self.csv = os.path.join(self.directory.name, "data.csv")
+        with open(self.csv, "w") as file:
+            file.write("label,x,y\n")
+            for label, (x, y) in zip(labels, coordinates):
+                file.write("{},{!r},{!r}\n".format("ABC"[label], float(x),
+                                                   float(y)))
+        self.output = os.path.join(self.directory.name, "results.jsonl")
+        self.estimator = wke()
+        self.estimator.load_arrays(labels, coordinates)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _results(self) -> list:
+        with open(self.output) as file:
+            return [json.loads(line) for line in file]
+
+    def test_read_data(self):
+        labels, coordinates = read_data(self.npy)
+        self.assertEqual(labels.dtype, np.int64)
+        self.assertEqual(coordinates.shape, (600, 2))
+        csv_labels, csv_coordinates = read_data(self.csv, header=True)
+        self.assertEqual(csv_labels[0], "A")
+        np.testing.assert_array_equal(csv_coordinates, coordinates)
+
+    def test_statistics(self):
+        ks = [5, 10]
+        self.assertEqual(main([self.npy, "-k", "5", "10", "-s", "mi",
+                               "-p", "1", "-o", self.output]), 0)
+        results = self._results()
+        self.assertEqual([result["k"] for result in results], ks)
+        for result, mi in zip(results,
+                              self.estimator.calculate_mi_curve(ks)):
+            self.assertAlmostEqual(result["mi"], mi)
+            self.assertIn("ball_counting", result["stages"])
+
+        main([self.csv, "--header", "-k", "5", "-p", "1",
+              "-o", self.output])
+        result, = self._results()
+        mi, weights = self.estimator.calculate_maximized_mi(k=5)
+        self.assertAlmostEqual(result["mi"], mi)
+        for label, weight in weights.items():
+            self.assertAlmostEqual(result["weights"]["ABC"[label]], weight)
+
+        main([self.npy, "-k", "5", "-s", "weighted_mi", "-w", "0=0.2",
+              "1=0.3", "2=0.5", "-p", "1", "-o", self.output])
+        result, = self._results()
+        self.assertAlmostEqual(result["mi"],
+                               self.estimator.calculate_weighted_mi(
+                                   {0: 0.2, 1: 0.3, 2: 0.5}, k=5))
+
+    def test_pool_and_resume(self):
+        missing = os.path.join(self.directory.name, "missing.csv")
+        self.assertEqual(main([self.npy, missing, "-k", "5", "-s", "mi",
+                               "-p", "2", "-o", self.output]), 1)
+        results = {result["file"]: result for result in self._results()}
+        self.assertIn("FileNotFoundError", results[missing]["error"])
+        self.assertAlmostEqual(results[self.npy]["mi"],
+                               self.estimator.calculate_mi(k=5))
+
+        # Only the new value of k and the failed file are estimated again.
+        main([self.npy, missing, "-k", "5", "8", "-s", "mi", "-p", "1",
+              "-o", self.output, "--resume"])
+        results = self._results()
+        self.assertEqual([(result["file"], result["k"])
+                          for result in results[2:]],
+                         [(self.npy, 8), (missing, 5), (missing, 8)])
+
+    def test_arguments(self):
+        with self.assertRaises(SystemExit):
+            main([self.npy, "-s", "weighted_mi"])
+        with self.assertRaises(SystemExit):
+            main([self.npy, "-s", "weighted_mi", "-w", "0:1"])
+        with self.assertRaises(SystemExit):
+            main([self.npy, "--resume"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import numpy as np
+from cce.estimator import WeightedKraskovEstimator as wke
+from tests.noisy_channel import communicate
+
+KS = [5, 10, 20]
+
+
+class TestCurves(unittest.TestCase):
+    """Tests of estimation for many values of k at once."""
+
+    def setUp(self):
+        self.data = communicate({'A': 300, 'B': 500, 'C': 400},
+                                {'A': 0.0, 'B': 0.5, 'C': 1.0}, sigma=0.3)
+
+    def test_mi_curve(self):
+        for sparse in (False, True):
+            est = wke(self.data, sparse=sparse)
+            curve = est.calculate_mi_curve(KS)
+            self.assertEqual(curve.shape, (len(KS), ))
+            for k, mi in zip(KS, curve):
+                self.assertAlmostEqual(mi, est.calculate_mi(k=k))
+
+    def test_mi_curve_list_method(self):
+        est_list = wke(self.data, neighborhood_method="list")
+        est_count = wke(self.data)
+        np.testing.assert_allclose(est_list.calculate_mi_curve(KS),
+                                   est_count.calculate_mi_curve(KS))
+
+    def test_maximized_mi_curve(self):
+        est = wke(self.data)
+        mis, weights = est.calculate_maximized_mi_curve(KS)
+        self.assertEqual(weights.shape, (len(KS), 3))
+        for k, mi, w in zip(KS, mis, weights):
+            mi_single, w_single = est.calculate_maximized_mi(k=k)
+            self.assertAlmostEqual(mi, mi_single)
+            np.testing.assert_allclose(
+                w, [w_single[label] for label in est.labels])
+
+
+if __name__ == '__main__':
+    unittest.main()
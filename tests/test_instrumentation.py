@@ -0,0 +1,83 @@
+import io
+import json
+import unittest
+import numpy as np
+from cce.estimator import WeightedKraskovEstimator as wke
+from cce.instrumentation import Instrumentation, JSONLinesSink, DISABLED
+from tests.noisy_channel import communicate
+
+NN_K = 5
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Tests of timers, counters and traces of the estimation stages."""
+
+    def setUp(self):
+        self.data = communicate({'A': 300, 'B': 400},
+                                {'A': 0.0, 'B': 0.5}, sigma=0.3)
+
+    def test_stages_and_counters(self):
+        instrumentation = Instrumentation(memory=True)
+        estimator = wke(self.data, instrumentation=instrumentation)
+        mi = estimator.calculate_mi(k=NN_K)
+        estimator.optimize_weights()
+
+        summary = instrumentation.summary()
+        self.assertEqual(set(summary["stages"]),
+                         {"preprocessing", "tree_construction", "epsilons",
+                          "ball_counting", "scoring", "optimization"})
+        for stage in summary["stages"].values():
+            self.assertEqual(stage["calls"], 1)
+            self.assertGreaterEqual(stage["seconds"], 0)
+            self.assertGreater(stage["peak_bytes"], 0)
+        self.assertEqual(summary["counters"]["epsilon_queries"], 700)
+        self.assertLessEqual(summary["counters"]["ball_queries"], 2 * 700)
+        self.assertAlmostEqual(summary["gauges"]["average_ball_size"],
+                               estimator.neighborhood_array.sum() / 700)
+        self.assertGreater(len(summary["traces"]["loss"]), 0)
+
+        # Results do not depend on the instrumentation.
+        self.assertAlmostEqual(wke(self.data).calculate_mi(k=NN_K), mi)
+
+    def test_sinks(self):
+        events = []
+        file = io.StringIO()
+        instrumentation = Instrumentation(sinks=[events.append])
+        instrumentation.add_sink(JSONLinesSink(file))
+
+        estimator = wke(self.data, instrumentation=instrumentation)
+        estimator.calculate_maximized_mi(k=NN_K)
+
+        lines = [json.loads(line) for line in file.getvalue().splitlines()]
+        self.assertEqual(len(lines), len(events))
+        self.assertEqual({event["event"] for event in lines},
+                         {"stage", "counter", "gauge", "trace"})
+        losses = [event["value"] for event in events
+                  if event["event"] == "trace"]
+        self.assertEqual(losses, instrumentation.summary()["traces"]["loss"])
+        # The loss never increases.
+        self.assertTrue((np.diff(losses) <= 1e-12).all())
+
+        instrumentation.reset()
+        self.assertEqual(instrumentation.summary()["stages"], {})
+
+    def test_nested_stages(self):
+        instrumentation = Instrumentation(memory=True)
+        with instrumentation.stage("outer"):
+            outer = np.ones(10**6)
+            with instrumentation.stage("inner"):
+                inner = np.ones(10**5)
+            del outer, inner
+        stages = instrumentation.summary()["stages"]
+        self.assertGreaterEqual(stages["outer"]["peak_bytes"], 8 * 10**6)
+        self.assertLess(stages["inner"]["peak_bytes"], 8 * 10**6)
+
+    def test_disabled_by_default(self):
+        estimator = wke(self.data)
+        self.assertIs(estimator.instrumentation, DISABLED)
+        estimator.calculate_mi(k=NN_K)
+        self.assertIsNone(estimator._loss_trace().get("callback"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import numpy as np
+from scipy.sparse import issparse
+from cce.estimator import WeightedKraskovEstimator as wke
+from tests.noisy_channel import communicate
+
+NN_K = 5
+
+
+class TestLabels(unittest.TestCase):
+    """Tests of adding and removing labels of the loaded data."""
+
+    def setUp(self):
+        # Points of label C lie within the range of A and B, so that
+        # the data are normalized in the same way with and without C.
+        self.data = communicate({'A': 300, 'B': 400},
+                                {'A': 0.0, 'B': 1.0}, sigma=0.3)
+        self.points_c = [np.array([x]) for x in
+                         np.random.uniform(0.2, 0.8, size=200)]
+        self.data_c = [('C', x) for x in self.points_c]
+
+    def _assert_same_estimates(self, est, est_expected):
+        self.assertEqual(est.labels, est_expected.labels)
+        est.calculate_neighborhoods(k=NN_K)
+        est_expected.calculate_neighborhoods(k=NN_K)
+        array, expected = est.neighborhood_array, est_expected.neighborhood_array
+        if issparse(array):
+            array, expected = array.toarray(), expected.toarray()
+        np.testing.assert_array_equal(array, expected)
+        self.assertAlmostEqual(est.calculate_mi(k=NN_K),
+                               est_expected.calculate_mi(k=NN_K))
+
+    def test_add_label(self):
+        for sparse in (False, True):
+            est = wke(self.data, sparse=sparse)
+            est.calculate_neighborhoods(k=NN_K)
+            est.add_label('C', self.points_c)
+            self._assert_same_estimates(
+                est, wke(self.data + self.data_c, sparse=sparse))
+
+    def test_add_label_before_neighborhoods(self):
+        est = wke(self.data)
+        est.add_label('C', self.points_c)
+        self.assertIsNone(est.neighborhood_array)
+        self._assert_same_estimates(est, wke(self.data + self.data_c))
+
+    def test_remove_label(self):
+        for sparse in (False, True):
+            est = wke(self.data_c + self.data, sparse=sparse)
+            est.calculate_neighborhoods(k=NN_K)
+            est.remove_label('C')
+            self._assert_same_estimates(est, wke(self.data, sparse=sparse))
+
+    def test_add_and_remove(self):
+        est = wke(self.data)
+        est.calculate_neighborhoods(k=NN_K)
+        mi = est.calculate_mi(k=NN_K)
+        est.add_label('C', self.points_c)
+        est.remove_label('C')
+        self.assertAlmostEqual(est.calculate_mi(k=NN_K), mi)
+        _, weights = est.calculate_maximized_mi(k=NN_K)
+        self.assertEqual(set(weights), {'A', 'B'})
+
+    def test_errors(self):
+        est = wke()
+        with self.assertRaises(Exception):
+            est.add_label('C', self.points_c)
+        est.load(self.data)
+        with self.assertRaises(ValueError):
+            est.add_label('A', self.points_c)
+        with self.assertRaises(ValueError):
+            est.remove_label('C')
+        est.calculate_neighborhoods(k=NN_K)
+        with self.assertRaises(ValueError):
+            est.add_label('C', self.points_c[:NN_K])
+        est.remove_label('A')
+        with self.assertRaises(ValueError):
+            est.remove_label('B')
+
+
+if __name__ == '__main__':
+    unittest.main()
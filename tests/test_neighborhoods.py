@@ -0,0 +1,209 @@
+import unittest
+import numpy as np
+from scipy.sparse import issparse
+from cce.estimator import WeightedKraskovEstimator as wke
+from tests.noisy_channel import communicate
+
+NN_K = 5
+
+
+class TestNeighborhoods(unittest.TestCase):
+    """Tests of batched, count-only neighborhood calculation against the
+    original, per-point implementation."""
+
+    def _compare_methods(self, data, k=NN_K):
+        est_count = wke(data, neighborhood_method="count")
+        est_list = wke(data, neighborhood_method="list")
+        est_count.calculate_neighborhoods(k=k)
+        est_list.calculate_neighborhoods(k=k)
+        np.testing.assert_array_equal(est_count.neighborhood_array,
+                                      est_list.neighborhood_array)
+        self.assertAlmostEqual(est_count.calculate_mi(k=k),
+                               est_list.calculate_mi(k=k))
+
+    def test_two_labels(self):
+        data = communicate({'A': 500, 'B': 700},
+                           {'A': 0.0, 'B': 0.5}, sigma=0.3)
+        self._compare_methods(data)
+
+    def test_multidimensional(self):
+        data = [(label, np.random.normal(loc=label, size=3))
+                for label in range(4) for _ in range(300)]
+        self._compare_methods(data, k=10)
+
+    def test_own_point_not_counted(self):
+        data = communicate({'A': 200, 'B': 200},
+                           {'A': 0.0, 'B': 100.0})
+        est = wke(data)
+        est.calculate_neighborhoods(k=NN_K)
+        same_label = est.neighborhood_array[np.arange(400), est.label_array]
+        self.assertTrue((same_label >= NN_K).all())
+
+    def test_sparse(self):
+        data = [(label, [np.random.normal(loc=label / 10)])
+                for label in range(50) for _ in range(40)]
+        est_dense = wke(data)
+        est_sparse = wke(data, sparse=True)
+        est_dense.calculate_neighborhoods(k=NN_K)
+        est_sparse.calculate_neighborhoods(k=NN_K)
+        self.assertTrue(issparse(est_sparse.neighborhood_array))
+        np.testing.assert_array_equal(est_sparse.neighborhood_array.toarray(),
+                                      est_dense.neighborhood_array)
+        self.assertAlmostEqual(est_sparse.calculate_mi(k=NN_K),
+                               est_dense.calculate_mi(k=NN_K))
+
+        mi_dense, w_dense = est_dense.optimize_weights()
+        mi_sparse, w_sparse = est_sparse.optimize_weights()
+        self.assertAlmostEqual(mi_sparse, mi_dense)
+        for label in w_dense:
+            self.assertAlmostEqual(w_sparse[label], w_dense[label])
+
+    def test_epsilons_within_labels(self):
+        data = [(label, np.random.normal(size=2))
+                for label in range(3) for _ in range(50)]
+        est = wke(data)
+        coordinates, labels = est._immersed_data_coordinates, est.label_array
+        epsilons = est._epsilons([1, NN_K])
+        for i, point in enumerate(coordinates):
+            distances = np.sort(np.linalg.norm(
+                coordinates[labels == labels[i]] - point, axis=1))
+            np.testing.assert_allclose(epsilons[i], distances[[1, NN_K]])
+
+    def test_processes(self):
+        data = [(label, np.random.normal(loc=label / 4, size=2))
+                for label in range(5) for _ in range(200)]
+        for sparse in (False, True):
+            est_serial = wke(data, sparse=sparse)
+            est_pool = wke(data, sparse=sparse, processes=3)
+            est_serial.calculate_neighborhoods(k=NN_K)
+            est_pool.calculate_neighborhoods(k=NN_K)
+            self.assertEqual(issparse(est_pool.neighborhood_array), sparse)
+            if sparse:
+                self.assertEqual((est_serial.neighborhood_array
+                                  != est_pool.neighborhood_array).nnz, 0)
+            else:
+                np.testing.assert_array_equal(est_serial.neighborhood_array,
+                                              est_pool.neighborhood_array)
+            np.testing.assert_array_equal(est_serial._epsilon_array,
+                                          est_pool._epsilon_array)
+            np.testing.assert_array_equal(est_serial.calculate_mi_curve([3, 8]),
+                                          est_pool.calculate_mi_curve([3, 8]))
+
+    def test_approximation(self):
+        data = [(label, np.random.normal(loc=label / 4, size=10))
+                for label in range(3) for _ in range(400)]
+        exact = wke(data)
+        mi = exact.calculate_mi(k=NN_K)
+        report = exact.approximation_report(k=NN_K, sample_size=100)
+        self.assertEqual(report["mi_deviation"], 0)
+        self.assertEqual(report["exact_fraction"], 1)
+
+        approximate = wke(data, approximation=1.)
+        approximate_mi = approximate.calculate_mi(k=NN_K)
+        same_label = approximate.neighborhood_array[np.arange(1200),
+                                                    approximate.label_array]
+        self.assertTrue((same_label == NN_K).all())
+        self.assertTrue((approximate._epsilon_array
+                         <= 2 * exact._epsilon_array + 1e-12).all())
+
+        # The whole data set as the sample gives the exact deviation.
+        report = approximate.approximation_report(k=NN_K, sample_size=1200)
+        self.assertAlmostEqual(report["mi_deviation"], approximate_mi - mi)
+        self.assertLessEqual(report["epsilon_error"], 1 + 1e-12)
+
+        approximate_pool = wke(data, approximation=1., processes=2)
+        np.testing.assert_array_equal(
+            approximate_pool.calculate_mi_curve([NN_K]), [approximate_mi])
+
+        with self.assertRaises(ValueError):
+            wke(approximation=1., neighborhood_method="list")
+
+    def test_compact(self):
+        data = [(label, np.random.normal(loc=label / 4, size=2))
+                for _ in range(300) for label in range(4)]
+        for sparse in (False, True):
+            est = wke(data, sparse=sparse)
+            est_compact = wke(data, sparse=sparse, compact=True)
+            mi = est.calculate_mi(k=NN_K)
+            self.assertAlmostEqual(est_compact.calculate_mi(k=NN_K), mi)
+            self.assertEqual(est_compact.neighborhood_array.dtype, np.uint16)
+            self.assertTrue((np.diff(est_compact.label_array) >= 0).all())
+            for tree in est_compact.label_trees:
+                self.assertTrue(np.shares_memory(
+                    tree.data, est_compact._immersed_data_coordinates))
+
+            report, compact_report = (est.memory_report(),
+                                      est_compact.memory_report())
+            self.assertLess(compact_report["neighborhood_array"],
+                            report["neighborhood_array"])
+            self.assertLess(compact_report["label_trees"],
+                            report["label_trees"])
+            self.assertEqual(compact_report["total"],
+                             sum(compact_report.values())
+                             - compact_report["total"])
+
+            self.assertAlmostEqual(est_compact.optimize_weights()[0],
+                                   est.optimize_weights()[0])
+            self.assertAlmostEqual(est_compact.calculate_mi_curve([3])[0],
+                                   est.calculate_mi_curve([3])[0])
+
+            new_points = np.random.normal(size=(50, 2))
+            est.add_label(4, new_points)
+            est_compact.add_label(4, new_points)
+            self.assertEqual(est_compact.neighborhood_array.dtype, np.uint16)
+            self.assertAlmostEqual(est_compact.calculate_mi(k=NN_K),
+                                   est.calculate_mi(k=NN_K))
+
+    def test_spatial_order(self):
+        data = [(label, np.random.normal(loc=label / 4, size=2))
+                for _ in range(300) for label in range(4)]
+        for sparse in (False, True):
+            est = wke(data, sparse=sparse)
+            est_ordered = wke(data, sparse=sparse, spatial_order=True)
+            mi = est.calculate_mi(k=NN_K)
+            self.assertAlmostEqual(est_ordered.calculate_mi(k=NN_K), mi)
+            self.assertTrue((np.diff(est_ordered.label_array) >= 0).all())
+            self.assertFalse(np.array_equal(
+                est_ordered._immersed_data_coordinates,
+                est._immersed_data_coordinates))
+
+            # Arrays of rows come back in the order of the data.
+            neighborhood_array = est_ordered.in_loaded_order(
+                est_ordered.neighborhood_array)
+            if sparse:
+                neighborhood_array = neighborhood_array.toarray()
+            np.testing.assert_array_equal(
+                neighborhood_array, est.in_loaded_order(
+                    est.neighborhood_array.toarray() if sparse
+                    else est.neighborhood_array))
+            np.testing.assert_array_equal(
+                est_ordered.in_loaded_order(est_ordered.label_array),
+                est.label_array)
+            np.testing.assert_array_equal(
+                est_ordered.in_loaded_order(est_ordered._epsilon_array),
+                est._epsilon_array)
+            self.assertAlmostEqual(est_ordered.optimize_weights()[0],
+                                   est.optimize_weights()[0])
+
+            new_points = np.random.normal(size=(50, 2))
+            for estimator in (est, est_ordered):
+                estimator.add_label(4, new_points)
+                estimator.remove_label(1)
+            self.assertAlmostEqual(est_ordered.calculate_mi(k=NN_K),
+                                   est.calculate_mi(k=NN_K))
+            np.testing.assert_array_equal(
+                est_ordered.in_loaded_order(est_ordered._epsilon_array),
+                est._epsilon_array)
+
+        est_compact = wke(data, compact=True)
+        np.testing.assert_array_equal(
+            est_compact.in_loaded_order(est_compact.label_array),
+            wke(data).label_array)
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            wke(neighborhood_method="unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
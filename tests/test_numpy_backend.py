@@ -0,0 +1,254 @@
+import unittest
+from importlib.util import find_spec
+import numpy as np
+from scipy.sparse import csr_matrix
+from cce.estimator import WeightedKraskovEstimator as wke
+from cce import minibatch_backend, numpy_backend
+from cce.optimization import weight_optimizer
+from cce.scoring import weight_loss
+from tests.noisy_channel import communicate
+
+NN_K = 10
+ATOL = 0.02
+
+requires_tensorflow = unittest.skipIf(find_spec("tensorflow") is None,
+                                      "TensorFlow is not installed")
+
+
+def _neighborhoods(data, k=NN_K):
+    est = wke(data)
+    est.calculate_neighborhoods(k=k)
+    return est.neighborhood_array, est.label_array
+
+
+class TestNumpyBackend(unittest.TestCase):
+    """Tests of the NumPy implementation of scoring and optimization
+    against the TensorFlow one."""
+
+    def setUp(self):
+        data = communicate({'A': 400, 'B': 600, 'C': 500},
+                           {'A': 0.0, 'B': 0.0002, 'C': 1.0})
+        self.neighb_count, self.labels = _neighborhoods(data)
+
+    @requires_tensorflow
+    def test_loss_agrees_with_tensorflow(self):
+        for weights in ([1/3, 1/3, 1/3], [0.1, 0.2, 0.7], [0.5, 0.49, 0.01]):
+            loss_np = numpy_backend.weight_loss(self.neighb_count,
+                                                self.labels, weights)
+            loss_tf = weight_loss(self.neighb_count, self.labels, weights,
+                                  backend="tensorflow")
+            self.assertAlmostEqual(loss_np, loss_tf, delta=1e-4)
+
+    def test_gradient(self):
+        weights = np.array([0.2, 0.3, 0.5])
+        label_counts = numpy_backend._label_counts(self.labels, 3)
+        _, gradient = numpy_backend._loss_and_gradient(
+            self.neighb_count, self.labels, label_counts, weights)
+
+        h = 1e-6
+        for j in range(3):
+            shift = h * np.eye(3)[j]
+            loss_plus = numpy_backend.weight_loss(self.neighb_count,
+                                                  self.labels, weights + shift)
+            loss_minus = numpy_backend.weight_loss(self.neighb_count,
+                                                   self.labels, weights - shift)
+            self.assertAlmostEqual((loss_plus - loss_minus) / (2 * h),
+                                   gradient[j], delta=1e-6)
+
+    def test_batch_loss(self):
+        weights_matrix = np.random.dirichlet(np.ones(3), size=20)
+        losses = [numpy_backend.weight_loss(self.neighb_count, self.labels, w)
+                  for w in weights_matrix]
+        np.testing.assert_allclose(
+            numpy_backend.weight_loss_batch(self.neighb_count, self.labels,
+                                            weights_matrix), losses)
+        np.testing.assert_allclose(
+            numpy_backend.weight_loss_batch(csr_matrix(self.neighb_count),
+                                            self.labels, weights_matrix),
+            losses)
+
+    def test_zero_weight(self):
+        # Labels with zero weight drop out of the loss: it is the loss of
+        # the points of the other labels, counting only their neighbors.
+        weights_matrix = np.array([[0.5, 0.5, 0.], [0., 0.3, 0.7]])
+        with np.errstate(all="raise"):
+            losses = numpy_backend.weight_loss_batch(
+                self.neighb_count, self.labels, weights_matrix)
+        label_counts = numpy_backend._label_counts(self.labels, 3)
+        for loss, weights in zip(losses, weights_matrix):
+            with np.errstate(all="raise"):
+                self.assertAlmostEqual(
+                    numpy_backend.weight_loss(self.neighb_count, self.labels,
+                                              weights), loss)
+            kept = weights > 0
+            rows = kept[self.labels]
+            expected, _ = numpy_backend._loss_and_gradient(
+                self.neighb_count[rows][:, kept],
+                np.cumsum(kept)[self.labels[rows]] - 1, label_counts[kept],
+                weights[kept], compute_gradient=False,
+                num_data=len(self.labels))
+            self.assertAlmostEqual(loss, expected)
+
+        est = wke(communicate({'A': 300, 'B': 400, 'C': 200},
+                              {'A': 0.0, 'B': 0.5, 'C': 1.0}, sigma=0.3))
+        mis = est.calculate_weighted_mi_batch([[0.5, 0.5, 0.]], k=NN_K)
+        self.assertTrue(np.isfinite(mis).all())
+        self.assertAlmostEqual(
+            mis[0], est.calculate_weighted_mi({'A': 0.5, 'B': 0.5, 'C': 0.},
+                                              k=NN_K))
+
+    def test_batch_mi_in_estimator(self):
+        data = communicate({'A': 300, 'B': 400}, {'A': 0.0, 'B': 0.5},
+                           sigma=0.3)
+        est = wke(data)
+        weights_matrix = np.array([[0.5, 0.5], [0.2, 0.8], [0.9, 0.1]])
+        mis = est.calculate_weighted_mi_batch(weights_matrix, k=NN_K)
+        for mi, weights in zip(mis, weights_matrix):
+            self.assertAlmostEqual(
+                mi, est.calculate_weighted_mi(dict(zip(est.labels, weights)),
+                                              k=NN_K))
+        with self.assertRaises(ValueError):
+            est.calculate_weighted_mi_batch([[0.5, 0.6]], k=NN_K)
+        with self.assertRaises(ValueError):
+            est.calculate_weighted_mi_batch([[0.5, 0.3, 0.2]], k=NN_K)
+
+    @requires_tensorflow
+    def test_optimizer_agrees_with_tensorflow(self):
+        loss_np, w_np = numpy_backend.weight_optimizer(self.neighb_count,
+                                                       self.labels)
+        loss_tf, w_tf = weight_optimizer(self.neighb_count, self.labels,
+                                         backend="tensorflow")
+        self.assertAlmostEqual(w_np.sum(), 1)
+        self.assertLessEqual(loss_np, loss_tf + 1e-4)
+        self.assertAlmostEqual(loss_np, loss_tf, delta=ATOL)
+        np.testing.assert_allclose(w_np, w_tf, atol=ATOL)
+
+    def test_diagnostics_and_warm_start(self):
+        data = communicate({'A': 500, 'B': 1000, 'C': 700},
+                           {'A': 0.0, 'B': 0.5, 'C': 1.0}, sigma=0.3)
+        est = wke(data)
+        est.calculate_neighborhoods(k=NN_K)
+        mi, weights, diagnostics = est.optimize_weights(
+            return_diagnostics=True)
+        self.assertTrue(diagnostics["converged"])
+        self.assertGreater(diagnostics["iterations"], 0)
+        self.assertGreaterEqual(diagnostics["wall_time"], 0)
+
+        mi_warm, _, warm = est.optimize_weights(initial_weights=weights,
+                                                return_diagnostics=True)
+        self.assertAlmostEqual(mi_warm, mi, places=5)
+        self.assertLess(warm["iterations"], diagnostics["iterations"])
+
+        _, _, limited = est.optimize_weights(max_iter=1,
+                                             return_diagnostics=True)
+        self.assertEqual(limited["iterations"], 1)
+        self.assertFalse(limited["converged"])
+
+    @requires_tensorflow
+    def test_tensorflow_diagnostics(self):
+        loss, _, diagnostics = weight_optimizer(
+            self.neighb_count, self.labels, backend="tensorflow",
+            max_iter=300, return_diagnostics=True)
+        self.assertLessEqual(diagnostics["iterations"], 300)
+        self.assertIn("gradient_norm", diagnostics)
+        self.assertIn("wall_time", diagnostics)
+
+    @requires_tensorflow
+    def test_backends_agree_in_estimator(self):
+        data = communicate({'A': 500, 'B': 1000}, {'A': 0.0, 'B': 1.0})
+        est = wke(data)
+        est.calculate_neighborhoods(k=NN_K)
+        mi_np, w_np = est.optimize_weights()
+        mi_tf, w_tf = est.optimize_weights(backend="tensorflow")
+        self.assertAlmostEqual(mi_np, mi_tf, delta=ATOL)
+        for label in w_np:
+            self.assertAlmostEqual(w_np[label], w_tf[label], delta=ATOL)
+
+    @requires_tensorflow
+    def test_sparse_loss_agrees_with_tensorflow(self):
+        weights = [0.1, 0.2, 0.7]
+        neighb_count = csr_matrix(self.neighb_count)
+        loss_dense = numpy_backend.weight_loss(self.neighb_count,
+                                               self.labels, weights)
+        loss_np = numpy_backend.weight_loss(neighb_count, self.labels, weights)
+        loss_tf = weight_loss(neighb_count, self.labels, weights,
+                              backend="tensorflow")
+        self.assertAlmostEqual(loss_np, loss_dense)
+        self.assertAlmostEqual(loss_np, loss_tf, delta=1e-4)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            wke(backend="unknown")
+
+
+class TestMinibatchBackend(unittest.TestCase):
+    """Tests of the stochastic minibatch optimizer against the full-batch
+    one."""
+
+    def setUp(self):
+        data = communicate({'A': 1500, 'B': 3000, 'C': 2000},
+                           {'A': 0.0, 'B': 0.5, 'C': 1.0}, sigma=0.3)
+        self.neighb_count, self.labels = _neighborhoods(data)
+
+    def test_unbiased_loss_and_gradient(self):
+        weights = np.array([0.2, 0.3, 0.5])
+        label_counts = numpy_backend._label_counts(self.labels, 3)
+        loss, gradient = numpy_backend._loss_and_gradient(
+            self.neighb_count, self.labels, label_counts, weights)
+
+        sample = minibatch_backend._stratified_sampler(
+            self.labels, label_counts, 500, np.random.default_rng(0))
+        estimates = []
+        for _ in range(400):
+            rows, sample_labels, scale = sample()
+            self.assertTrue((self.labels[rows] == sample_labels).all())
+            estimate = numpy_backend._loss_and_gradient(
+                self.neighb_count[rows], sample_labels, label_counts,
+                weights, num_data=len(self.labels), scale=scale)
+            estimates.append(np.concatenate([[estimate[0]], estimate[1]]))
+        np.testing.assert_allclose(np.mean(estimates, axis=0),
+                                   np.concatenate([[loss], gradient]),
+                                   atol=0.01)
+
+    def test_optimizer_agrees_with_full_batch(self):
+        loss, weights = numpy_backend.weight_optimizer(self.neighb_count,
+                                                       self.labels)
+        for variance_reduction in ("svrg", "average", None):
+            loss_mb, w_mb, diagnostics = minibatch_backend.weight_optimizer(
+                self.neighb_count, self.labels, batch_size=500,
+                variance_reduction=variance_reduction, seed=0,
+                return_diagnostics=True)
+            self.assertAlmostEqual(w_mb.sum(), 1)
+            self.assertAlmostEqual(loss_mb, loss, places=4)
+            np.testing.assert_allclose(w_mb, weights, atol=ATOL)
+            self.assertAlmostEqual(
+                loss_mb, numpy_backend.weight_loss(self.neighb_count,
+                                                   self.labels, w_mb))
+            self.assertGreater(diagnostics["iterations"], 0)
+            self.assertEqual(diagnostics["full_gradients"] > 0,
+                             variance_reduction == "svrg")
+
+        sparse_loss, _ = minibatch_backend.weight_optimizer(
+            csr_matrix(self.neighb_count), self.labels, batch_size=500,
+            seed=0)
+        self.assertAlmostEqual(sparse_loss, loss, places=4)
+
+    def test_minibatch_in_estimator(self):
+        data = communicate({'A': 500, 'B': 1000}, {'A': 0.0, 'B': 1.0})
+        est = wke(data)
+        est.calculate_neighborhoods(k=NN_K)
+        mi, weights = est.optimize_weights()
+        mi_mb, w_mb = est.optimize_weights(backend="minibatch",
+                                           batch_size=200, seed=0)
+        self.assertAlmostEqual(mi_mb, mi, places=4)
+        for label in weights:
+            self.assertAlmostEqual(w_mb[label], weights[label], delta=ATOL)
+
+    def test_unknown_variance_reduction(self):
+        with self.assertRaises(ValueError):
+            minibatch_backend.weight_optimizer(self.neighb_count, self.labels,
+                                               variance_reduction="unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,9 @@
 import unittest
-from cce.preprocessing import normalize
+import numpy as np
+from cce.estimator import WeightedKraskovEstimator as wke
+from cce.preprocessing import (normalize, normalize_coordinates, index_labels,
+                               jitter_duplicates, unique, morton_order)
+from tests.noisy_channel import communicate
 
 LARGE_VALUES_SMALL_SPREAD = [('1', [1e9, 1e9]),
                              ('1', [1e9+1, 1e9+1]),
@@ -43,5 +47,96 @@ class NormalizationTests(unittest.TestCase):
             self.assertAlmostEqual(max_, 1)
 
 
+class ArrayTests(unittest.TestCase):
+
+    def test_index_labels(self):
+        """Test if labels are indexed in order of appearance."""
+        indices, values = index_labels(np.array(['b', 'a', 'b', 'c', 'a']))
+        np.testing.assert_array_equal(indices, [0, 1, 0, 2, 1])
+        self.assertEqual(values, ['b', 'a', 'c'])
+
+        indices, values = index_labels(np.array([1, 'a', 1], dtype=object))
+        np.testing.assert_array_equal(indices, [0, 1, 0])
+        self.assertEqual(values, [1, 'a'])
+
+        indices, values = index_labels([1, '1', 2, 1])
+        np.testing.assert_array_equal(indices, [0, 1, 2, 0])
+        self.assertEqual(values, [1, '1', 2])
+        self.assertEqual(index_labels([3, 1, 3])[1], [3, 1])
+
+        est = wke()
+        est.load_arrays([1, '1'] * 20, np.random.normal(size=40))
+        self.assertEqual(est.labels, [1, '1'])
+        est.calculate_weighted_mi({1: 0.5, '1': 0.5}, k=3)
+
+    def test_normalize_in_place(self):
+        """Test if a float64 array is normalized without a copy."""
+        arr = np.array([[1., 2.], [3., 5.]])
+        self.assertIs(normalize_coordinates(arr, copy=False), arr)
+        np.testing.assert_allclose(arr, [[0., .25], [.5, 1.]])
+        self.assertIsNot(normalize_coordinates(arr), arr)
+
+    def test_morton_order(self):
+        """Test if points are ordered along the Z curve within labels."""
+        arr = np.array([[1., 1.], [0., 0.], [1., 0.], [0., 1.]])
+        np.testing.assert_array_equal(morton_order(arr), [1, 3, 2, 0])
+        np.testing.assert_array_equal(
+            morton_order(arr, labels=np.array([1, 0, 1, 0])), [1, 3, 2, 0])
+        np.testing.assert_array_equal(
+            morton_order(arr, labels=np.array([0, 1, 0, 1])), [2, 0, 1, 3])
+
+        arr = np.random.rand(1000, 3)
+        order = morton_order(arr)
+        np.testing.assert_array_equal(np.sort(order), np.arange(1000))
+        # Successive points of the curve are much closer than random ones.
+        steps = np.linalg.norm(np.diff(arr[order], axis=0), axis=1)
+        self.assertLess(steps.mean(),
+                        np.linalg.norm(np.diff(arr, axis=0), axis=1).mean() / 3)
+
+    def test_load_arrays(self):
+        """Test if arrays give the same estimates as the list of tuples."""
+        data = communicate({'A': 300, 'B': 400}, {'A': 0., 'B': 1.},
+                           sigma=0.5)
+        labels = np.array([label for label, _ in data])
+        coordinates = np.array([value for _, value in data])
+
+        est_list, est_arrays = wke(data), wke()
+        est_arrays.load_arrays(labels, coordinates[:, 0], copy=False)
+        self.assertEqual(est_arrays.labels, est_list.labels)
+        self.assertAlmostEqual(est_arrays.calculate_mi(k=10),
+                               est_list.calculate_mi(k=10))
+        with self.assertRaises(ValueError):
+            est_arrays.load_arrays(labels[1:], coordinates)
+
+
+class JitterTests(unittest.TestCase):
+
+    def test_only_repeated_points_perturbed(self):
+        """Test if first copies are kept and repeats are moved within bound."""
+        arr = np.random.randint(0, 5, size=(2000, 2)).astype(float)
+        original = arr.copy()
+        arr, report = jitter_duplicates(arr, rng=0)
+
+        self.assertTrue(unique(arr))
+        _, first = np.unique(original, axis=0, return_index=True)
+        moved = np.ones(len(arr), dtype=bool)
+        moved[first] = False
+        self.assertEqual(report["perturbed"], moved.sum())
+        np.testing.assert_array_equal(arr[~moved], original[~moved])
+
+        shifts = arr[moved] - original[moved]
+        self.assertTrue((shifts > 0).all())
+        self.assertTrue((shifts <= report["max_shift"]).all())
+        np.testing.assert_array_equal(report["max_shift"], [0.5, 0.5])
+
+    def test_unique_points_untouched(self):
+        """Test if an array without repeated points is left as it is."""
+        arr = np.random.rand(100, 3)
+        original = arr.copy()
+        arr, report = jitter_duplicates(arr)
+        self.assertEqual(report["perturbed"], 0)
+        np.testing.assert_array_equal(arr, original)
+
+
 if __name__ == '__main__':
     unittest.main()
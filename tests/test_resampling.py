@@ -0,0 +1,55 @@
+import unittest
+import numpy as np
+from cce.estimator import WeightedKraskovEstimator as wke
+from tests.noisy_channel import communicate
+
+NN_K = 10
+
+
+class TestResampling(unittest.TestCase):
+    """Tests of bootstrap and subsampling confidence intervals."""
+
+    def setUp(self):
+        data = communicate({'A': 600, 'B': 600, 'C': 600},
+                           {'A': 0.0, 'B': 0.5, 'C': 1.0}, sigma=0.3)
+        self.est = wke(data)
+
+    def test_subsampling_mi(self):
+        result = self.est.bootstrap(k=NN_K, n_resamples=10, fraction=0.8,
+                                    replace=False, processes=1, seed=0)
+        lower, upper = result["interval"]
+        self.assertEqual(len(result["samples"]), 10)
+        self.assertLessEqual(lower, upper)
+        self.assertAlmostEqual(result["estimate"], self.est.calculate_mi(NN_K))
+        self.assertAlmostEqual(result["samples"].mean(), result["estimate"],
+                               delta=0.05)
+
+    def test_pool_is_reproducible(self):
+        options = dict(k=NN_K, statistic="maximized_mi", n_resamples=4,
+                       fraction=0.8, replace=False, seed=1)
+        in_process = self.est.bootstrap(processes=1, **options)
+        in_pool = self.est.bootstrap(processes=2, **options)
+        np.testing.assert_allclose(in_process["samples"], in_pool["samples"])
+        np.testing.assert_allclose(in_process["weight_samples"],
+                                   in_pool["weight_samples"])
+
+    def test_maximized_mi_weights(self):
+        result = self.est.bootstrap(k=NN_K, statistic="maximized_mi",
+                                    n_resamples=6, fraction=0.8,
+                                    replace=False, processes=1, seed=2)
+        self.assertEqual(result["weight_samples"].shape, (6, 3))
+        np.testing.assert_allclose(result["weight_samples"].sum(axis=1), 1)
+        for label, (lower, upper) in result["weight_intervals"].items():
+            self.assertLessEqual(lower, upper)
+            self.assertAlmostEqual(result["weights"][label], (lower + upper) / 2,
+                                   delta=0.1)
+
+    def test_weighted_mi_requires_weights(self):
+        with self.assertRaises(ValueError):
+            self.est.bootstrap(k=NN_K, statistic="weighted_mi")
+        with self.assertRaises(ValueError):
+            self.est.bootstrap(k=NN_K, statistic="unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+from cce.estimator import WeightedKraskovEstimator as wke
+from cce.numpy_backend import weight_optimizer
+from tests.noisy_channel import communicate
+
+NN_K = 5
+
+
+class TestSubsets(unittest.TestCase):
+    """Tests of estimates for subsets of labels."""
+
+    def setUp(self):
+        self.data = communicate({'A': 200, 'B': 300, 'C': 250, 'D': 150},
+                                {'A': 0.0, 'B': 0.3, 'C': 0.6, 'D': 1.2},
+                                sigma=0.3)
+
+    def test_subset_neighborhoods(self):
+        for sparse in (False, True):
+            est = wke(self.data, sparse=sparse)
+            est.calculate_neighborhoods(k=NN_K)
+            indices = [est._label2index[label] for label in ('D', 'B')]
+            rows = np.concatenate([np.flatnonzero(est.label_array == i)
+                                   for i in indices])
+            loss, weights = weight_optimizer(
+                est.neighborhood_array[rows][:, indices],
+                np.repeat([0, 1], [150, 300]))
+
+            mi, subset_weights = est.calculate_subset_maximized_mi(
+                ['D', 'B'], k=NN_K)
+            self.assertAlmostEqual(subset_weights['D'], weights[0])
+            self.assertAlmostEqual(subset_weights['B'], weights[1])
+
+            # Estimates differ only by points on boundaries of balls.
+            subset = [point for point in self.data if point[0] in 'BD']
+            self.assertAlmostEqual(mi, wke(subset).calculate_maximized_mi(
+                k=NN_K)[0], delta=0.01)
+            self.assertAlmostEqual(
+                est.calculate_subset_mi(['B', 'D'], k=NN_K),
+                wke(subset).calculate_mi(k=NN_K), delta=0.01)
+
+    def test_capacity_matrix(self):
+        est = wke(self.data)
+        matrix = est.calculate_capacity_matrix(k=NN_K, processes=2)
+        self.assertEqual(matrix.shape, (4, 4))
+        np.testing.assert_array_equal(matrix, matrix.T)
+        np.testing.assert_array_equal(np.diag(matrix), 0)
+        i, j = est.labels.index('A'), est.labels.index('C')
+        self.assertAlmostEqual(
+            matrix[i, j], est.calculate_subset_maximized_mi(['A', 'C'],
+                                                            k=NN_K)[0])
+        # Labels further apart are easier to discriminate.
+        self.assertGreater(matrix[est.labels.index('A'),
+                                  est.labels.index('D')],
+                           matrix[est.labels.index('A'),
+                                  est.labels.index('B')])
+
+        matrix = est.calculate_capacity_matrix(k=NN_K, labels=['C', 'A'],
+                                               processes=1)
+        self.assertAlmostEqual(matrix[0, 1], matrix[1, 0])
+        self.assertAlmostEqual(matrix[0, 1], est.calculate_subset_maximized_mi(
+            ['A', 'C'], k=NN_K)[0])
+
+    def test_invalid_subsets(self):
+        est = wke(self.data)
+        with self.assertRaises(ValueError):
+            est.calculate_subset_mi(['A'], k=NN_K)
+        with self.assertRaises(ValueError):
+            est.calculate_subset_mi(['A', 'A'], k=NN_K)
+        with self.assertRaises(ValueError):
+            est.calculate_subset_mi(['A', 'E'], k=NN_K)
+
+
+if __name__ == '__main__':
+    unittest.main()